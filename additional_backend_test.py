@@ -3,11 +3,12 @@
 Additional Backend API Testing for existing endpoints
 """
 
+import os
 import requests
 import json
 
 # Backend URL from environment
-BACKEND_URL = "https://freezetag-game.preview.emergentagent.com/api"
+BACKEND_URL = os.environ.get("BACKEND_URL", "https://freezetag-game.preview.emergentagent.com/api")
 
 def test_existing_endpoints():
     """Test some existing endpoints to ensure they're working"""
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Game engine CPU benchmark on the in-memory storage engine
+
+Plays full rounds (start, freezes, unfreezes, round end, finalization) through
+the Socket.IO handlers without a database or network, and reports the CPU
+cost per handled event.
+
+    python bench_game.py --rooms 200 --players 8
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import time
+
+os.environ["STORAGE_ENGINE"] = "memory"
+
+import server  # noqa: E402
+
+# Socket.IO request logging would dominate the measurement
+logging.disable(logging.INFO)
+
+
+async def create_players(count):
+    ids = []
+    for i in range(count):
+        result = await server.db.users.insert_one({
+            "username": f"bench{i}",
+            "email": f"bench{i}@example.com",
+            "password": "",
+            "owned_powers": [],
+            "owned_skins": ["default"],
+            "equipped_skin": "default",
+            "stats": {"games_played": 0, "games_won": 0, "times_frozen": 0,
+                      "times_unfrozen_others": 0, "times_as_mraz": 0,
+                      "total_play_time": 0, "longest_survival": 0, "xp": 0, "level": 1},
+            "created_at": server.datetime.utcnow()
+        })
+        ids.append(str(result.inserted_id))
+    return ids
+
+
+async def play_round(room_code, player_ids):
+    """Play one round and return the number of handled events"""
+    await server.start_game("bench", {"room_code": room_code})
+    room = await server.db.rooms.find_one({"code": room_code})
+    mraz_id = room["current_mraz"]
+    events = 1
+    others = [p for p in player_ids if p != mraz_id]
+    for victim in others:
+        await server.freeze_player("bench", {"room_code": room_code, "frozen_player_id": victim, "mraz_id": mraz_id})
+        events += 1
+        # Every other freeze gets thawed once by a teammate
+        if events % 2 and len(others) > 2:
+            helper = random.choice([p for p in others if p != victim])
+            await server.unfreeze_player("bench", {"room_code": room_code, "frozen_player_id": victim, "unfreezer_id": helper})
+            await server.freeze_player("bench", {"room_code": room_code, "frozen_player_id": victim, "mraz_id": mraz_id})
+            events += 2
+        server.player_connections[f"bench-{victim}"] = victim
+        await server.update_location(f"bench-{victim}", {"room_code": room_code, "player_id": victim, "latitude": 44.8, "longitude": 20.4})
+        events += 1
+    return events
+
+
+async def main(rooms, players, rounds):
+    await server.ensure_indexes()
+    room_codes = []
+    for r in range(rooms):
+        player_ids = await create_players(players)
+        code = f"B{r:05d}"
+        await server.db.rooms.insert_one({
+            "code": code,
+            "name": code,
+            "host_id": player_ids[0],
+            "players": [{"id": pid, "username": f"bench{i}", "is_host": i == 0, "is_ready": True,
+                         "is_frozen": False, "equipped_skin": "default"} for i, pid in enumerate(player_ids)],
+            "status": "waiting",
+            "max_players": players,
+            "is_private": True,
+            "settings": dict(server.DEFAULT_ROOM_SETTINGS),
+            "created_at": server.datetime.utcnow()
+        })
+        room_codes.append((code, player_ids))
+
+    events = 0
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    for _ in range(rounds):
+        for code, player_ids in room_codes:
+            events += await play_round(code, player_ids)
+        await server.process_location_rooms()
+        await server.flush_round_results()
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+
+    print(f"rooms={rooms} players={players} rounds={rounds} events={events}")
+    print(f"cpu={cpu:.3f}s wall={wall:.3f}s")
+    print(f"cpu per event={cpu / events * 1e6:.1f}us  events/s={events / wall:.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", type=int, default=100)
+    parser.add_argument("--players", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(main(args.rooms, args.players, args.rounds))
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark for launcher.py
+
+Starts the launcher in a fresh process, polls /api/health/ready until it
+answers 200, reads the warm-up phase timings from /api/metrics, then sends
+SIGTERM and times the drain. Uses the in-memory storage engine unless
+STORAGE_ENGINE/MONGO_URL are set in the environment.
+
+    python bench_startup.py --runs 5 --workers 2
+"""
+
+import argparse
+import json
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+LAUNCHER = Path(__file__).parent / "launcher.py"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def get(url: str):
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, b""
+    except OSError:
+        return None, b""
+
+
+def run_once(workers: int, timeout: float) -> dict:
+    port = free_port()
+    base = f"http://127.0.0.1:{port}/api"
+    env = {"STORAGE_ENGINE": "memory", **os.environ}
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, str(LAUNCHER), "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"] + (["--allow-split-state"] if workers > 1 else []),
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while True:
+            status, _ = get(f"{base}/health/ready")
+            if status == 200:
+                break
+            if process.poll() is not None or time.perf_counter() - started > timeout:
+                raise RuntimeError("launcher did not become ready")
+            time.sleep(0.01)
+        ready = time.perf_counter() - started
+        _, body = get(f"{base}/metrics")
+        phases = json.loads(body).get("startup", {}).get("phases_ms", {}) if body else {}
+
+        stopping = time.perf_counter()
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=timeout)
+        return {"ready_s": ready, "drain_s": time.perf_counter() - stopping, "phases_ms": phases}
+    finally:
+        if process.poll() is None:
+            process.kill()
+
+
+def main(runs: int, workers: int, timeout: float):
+    results = [run_once(workers, timeout) for _ in range(runs)]
+    ready = [r["ready_s"] for r in results]
+    drain = [r["drain_s"] for r in results]
+    print(f"workers={workers} runs={runs}")
+    print(f"time to ready: min={min(ready):.3f}s median={statistics.median(ready):.3f}s max={max(ready):.3f}s")
+    print(f"drain on SIGTERM: median={statistics.median(drain):.3f}s")
+    phases = {}
+    for r in results:
+        for name, ms in r["phases_ms"].items():
+            phases.setdefault(name, []).append(ms)
+    for name, values in phases.items():
+        print(f"  {name:<14} median={statistics.median(values):.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+    main(args.runs, args.workers, args.timeout)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Exports users, rooms and room history for analytics
+
+Streams a collection straight from MongoDB (MONGO_URL/DB_NAME, as for the
+server) into an NDJSON or Parquet file, one batch at a time. With --state the
+last exported watermark is kept per collection, so the next run only moves
+documents added since.
+
+    python export.py users --format parquet --out users.parquet --state nightly.json
+    python export.py room_history --watermark finished_at --since 2025-01-01T00:00:00
+"""
+
+import asyncio
+import json
+import os
+from pathlib import Path
+from typing import Optional
+
+import typer
+
+cli = typer.Typer(add_completion=False, help="Export collections as NDJSON or Parquet.")
+
+
+def load_state(path: Optional[Path]) -> dict:
+    if path is None or not path.exists():
+        return {}
+    return json.loads(path.read_text())
+
+
+def save_state(path: Path, state: dict):
+    # Replace atomically so a crash never leaves a half-written watermark
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(json.dumps(state, indent=2))
+    os.replace(tmp, path)
+
+
+async def export(chunks, out: Path) -> int:
+    # Written next to the target and renamed at the end: a failed run leaves
+    # the previous export and the stored watermark untouched
+    tmp = out.with_suffix(out.suffix + ".part")
+    size = 0
+    with open(tmp, "wb") as f:
+        async for chunk in chunks:
+            # Blocking writes on purpose: the next batch is only read once this one is on disk
+            f.write(chunk)
+            size += len(chunk)
+    os.replace(tmp, out)
+    return size
+
+
+@cli.command()
+def main(
+    collection: str = typer.Argument(..., help="users, rooms or room_history"),
+    format: str = typer.Option("ndjson", help="ndjson or parquet (needs pyarrow)"),
+    out: Optional[Path] = typer.Option(None, help="Output file, default <collection>.<format>"),
+    watermark: str = typer.Option("_id", help="Field to resume from: _id, created_at or finished_at"),
+    since: Optional[str] = typer.Option(None, help="Only documents after this watermark value (<iso time>|<_id> for time fields)"),
+    state: Optional[Path] = typer.Option(None, help="JSON file keeping the last watermark per collection"),
+    batch_size: int = typer.Option(1000, help="Documents per cursor batch and per Parquet row group"),
+    secondary: bool = typer.Option(True, "--secondary/--primary", help="Read from a secondary when available"),
+):
+    """Export one collection, incrementally when --since or --state is given."""
+    import server
+
+    saved = load_state(state)
+    previous = saved.get(collection)
+    if since is None and previous and previous.get("watermark") == watermark:
+        since = previous.get("since")
+    try:
+        job = server.ExportJob(collection, watermark, since, batch_size, secondary)
+        chunks = server.export_stream(job, format)
+    except (ValueError, server.InvalidId) as e:
+        raise typer.BadParameter(str(e))
+    out = out or Path(f"{collection}.{format}")
+
+    size = asyncio.run(export(chunks, out))
+    typer.echo(f"{job.exported} {collection} documents, {size} bytes -> {out} (last {watermark}: {job.last})")
+    if state is not None:
+        saved[collection] = {"watermark": watermark, "since": job.last}
+        save_state(state, saved)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Production launcher
+
+Runs socket_app on uvloop and httptools (when installed). The worker warms up
+before it reports ready, and on SIGTERM drains: readiness goes false, running
+rounds get up to DRAIN_TIMEOUT seconds to end, buffered writes are flushed,
+then it exits.
+
+Run one worker per process and scale out with more processes behind a
+load balancer. Rooms, rounds, the matchmaking queue, bots, powers and the
+Socket.IO sessions all live in the worker's memory. Socket.IO has no shared
+client manager, and nothing pins a client to one worker. With pre-forked
+workers on one port, polling requests land on workers that don't know the
+session, room broadcasts only reach the emitting worker's sockets, and
+matchmaking splits across processes. --workers above 1 is therefore refused
+unless --allow-split-state is given, e.g. for startup benchmarks.
+
+    python launcher.py --port 8001
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import logging
+import os
+import signal
+import sys
+from pathlib import Path
+
+import uvicorn
+from uvicorn.supervisors import Multiprocess
+
+logger = logging.getLogger("launcher")
+
+APP = "server:socket_app"
+
+
+def pick(module: str, preferred: str, fallback: str) -> str:
+    if importlib.util.find_spec(module) is not None:
+        return preferred
+    logger.warning(f"{module} is not installed, falling back to {fallback}")
+    return fallback
+
+
+class DrainingServer(uvicorn.Server):
+    """uvicorn server whose first SIGTERM/SIGINT drains the game before shutting down"""
+
+    def __init__(self, config: uvicorn.Config):
+        super().__init__(config)
+        self.drain_task = None
+
+    def handle_exit(self, sig, frame):
+        if self.drain_task is None and self.started:
+            self.drain_task = asyncio.get_event_loop().create_task(self.drain())
+        elif sig == signal.SIGINT or self.drain_task is None:
+            # A second Ctrl-C, or a signal before startup finished, exits right away
+            super().handle_exit(sig, frame)
+
+    async def drain(self):
+        import server
+        try:
+            await server.drain()
+        finally:
+            self.should_exit = True
+
+
+class Supervisor(Multiprocess):
+    """Signals every worker at once so they drain in parallel rather than one by one"""
+
+    def shutdown(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+
+
+def build_config(args) -> uvicorn.Config:
+    return uvicorn.Config(
+        APP,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop=pick("uvloop", "uvloop", "asyncio"),
+        http=pick("httptools", "httptools", "h11"),
+        # Negotiated per connection; applies to every frame on that connection
+        ws_per_message_deflate=os.environ.get("WS_PER_MESSAGE_DEFLATE", "1") == "1",
+        lifespan="on",
+        proxy_headers=True,
+        log_level=args.log_level,
+        timeout_graceful_shutdown=args.graceful_timeout,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8001")))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", "1")))
+    parser.add_argument("--allow-split-state", action="store_true",
+                        help="allow --workers above 1 although game state and sessions are per worker")
+    parser.add_argument("--graceful-timeout", type=int, default=10,
+                        help="seconds to wait for open connections once draining has finished")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+    if args.workers > 1 and not args.allow_split_state:
+        parser.error(f"--workers {args.workers}: game state and Socket.IO sessions are not shared between "
+                     "workers; run one worker per process (or pass --allow-split-state)")
+
+    # The app is imported by string so every worker imports it fresh
+    sys.path.insert(0, str(Path(__file__).parent))
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    config = build_config(args)
+
+    if config.workers > 1:
+        logger.warning(f"Running {config.workers} workers with split state: each has its own rooms, "
+                       "matchmaking queue and Socket.IO sessions, and clients are not pinned to a worker")
+        sock = config.bind_socket()
+        server = DrainingServer(config)
+        Supervisor(config, target=server.run, sockets=[sock]).run()
+    else:
+        DrainingServer(config).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+Replays traffic recorded with TRAFFIC_RECORD_PATH against a local socket_app
+
+`run` drives one or more recordings through the Socket.IO handlers and the
+REST routes of an in-process server on the in-memory storage engine, keeping
+the recorded timing (scaled by --speed) and per-client ordering, and writes
+latency percentiles and throughput to a JSON report. `compare` prints the
+deltas between two reports, e.g. one per build.
+
+    python replay.py run traffic-*.ndjson.gz --speed 10 --out candidate.json
+    python replay.py compare baseline.json candidate.json --threshold 10
+"""
+
+import asyncio
+import gzip
+import json
+import logging
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import typer
+
+os.environ.setdefault("STORAGE_ENGINE", "memory")
+# Never record the replay itself
+os.environ.pop("TRAFFIC_RECORD_PATH", None)
+
+cli = typer.Typer(add_completion=False, help="Replay recorded traffic and compare builds.")
+
+TOKEN_RE = re.compile(r"^<token:([0-9a-f]{24})>$")
+ID_KEYS = ("id", "player_id", "frozen_player_id", "mraz_id", "unfreezer_id", "user_id", "host_id")
+PERCENTILES = (50, 90, 95, 99)
+
+
+def load_events(paths: List[Path]) -> List[Dict]:
+    events = []
+    for path in paths:
+        opener = gzip.open if path.suffix == ".gz" else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            events.extend(json.loads(line) for line in f if line.strip())
+    # Several workers' recordings interleave by their offset from start
+    events.sort(key=lambda e: e["t"])
+    return events
+
+
+def parse_speed(speed: str) -> float:
+    """'1', '10x' or 'max' (0 = no delays)"""
+    speed = speed.lower()
+    if speed == "max":
+        return 0.0
+    return float(speed.rstrip("x"))
+
+
+class Replay:
+    def __init__(self, server, events: List[Dict], speed: float):
+        self.server = server
+        self.events = events
+        self.speed = speed
+        # Pseudonyms from the recording -> values the replayed server generated
+        self.ids: Dict[str, str] = {}
+        self.tokens: Dict[str, str] = {}
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.lag: List[float] = []
+        self.chains: Dict[str, asyncio.Future] = {}
+        self.sids: Dict[str, str] = {}
+
+    # ---------- seeding ----------
+
+    def collect(self, value, key: Optional[str], found: Dict[str, Optional[str]]):
+        """Gather ids and room codes (value -> key they appeared under)"""
+        if isinstance(value, dict):
+            for k, v in value.items():
+                self.collect(v, k, found)
+        elif isinstance(value, list):
+            for v in value:
+                self.collect(v, key, found)
+        elif isinstance(value, str):
+            token = TOKEN_RE.match(value)
+            if token:
+                found.setdefault(token.group(1), "user_id")
+            elif key in ID_KEYS and self.server.OBJECT_ID_RE.match(value):
+                found.setdefault(value, key)
+            elif key in ("room_code", "code") and self.server.ROOM_CODE_RE.match(value):
+                found.setdefault(value, "room_code")
+
+    async def seed(self):
+        """Create the users and rooms that existed before the recording started.
+
+        Anything first seen in a recorded response was created during the
+        recording and is created again by replaying that request instead.
+        """
+        introduced = set()
+        users = set()
+        rooms: Dict[str, List[str]] = {}
+        for event in self.events:
+            requested: Dict[str, Optional[str]] = {}
+            self.collect(event.get("data"), None, requested)
+            self.collect(event.get("body"), None, requested)
+            self.collect(event.get("query"), None, requested)
+            for part in event.get("path", "").split("/"):
+                self.collect(part, "room_code" if self.server.ROOM_CODE_RE.match(part) else "id", requested)
+            for value, key in requested.items():
+                if value in introduced:
+                    continue
+                if key == "room_code":
+                    rooms.setdefault(value, [])
+                else:
+                    users.add(value)
+            if event.get("event") == "join_game" and isinstance(event.get("data"), dict):
+                code = event["data"].get("room_code")
+                player = event["data"].get("player_id")
+                if code in rooms and player and player not in rooms[code]:
+                    rooms[code].append(player)
+            response: Dict[str, Optional[str]] = {}
+            self.collect(event.get("response"), None, response)
+            introduced.update(v for v in response if v not in requested)
+
+        server = self.server
+        for user_id in users:
+            await server.db.users.insert_one({
+                "_id": server.ObjectId(user_id),
+                "username": f"user_{user_id[:8]}",
+                "email": f"{user_id[:12]}@example.invalid",
+                "password": "",
+                "coins": 100, "gems": 10, "is_premium": False, "subscription_type": None,
+                "owned_powers": [], "owned_skins": ["default"], "equipped_skin": "default",
+                "stats": {"games_played": 0, "games_won": 0, "times_frozen": 0,
+                          "times_unfrozen_others": 0, "times_as_mraz": 0,
+                          "total_play_time": 0, "longest_survival": 0, "xp": 0, "level": 1},
+                "created_at": server.datetime.utcnow(),
+            })
+        for code, players in rooms.items():
+            await server.db.rooms.insert_one({
+                "code": code,
+                "name": code,
+                "host_id": players[0] if players else None,
+                "players": [{"id": pid, "username": f"user_{pid[:8]}", "is_host": i == 0, "is_ready": True,
+                             "is_frozen": False, "equipped_skin": "default"} for i, pid in enumerate(players)],
+                "status": "waiting",
+                "current_mraz": None,
+                "frozen_players": [],
+                "max_players": max(len(players), 2),
+                "is_private": True,
+                "settings": dict(server.DEFAULT_ROOM_SETTINGS),
+                "created_at": server.datetime.utcnow(),
+            })
+        return len(users), len(rooms)
+
+    # ---------- rewriting ----------
+
+    def resolve(self, value):
+        if isinstance(value, dict):
+            return {k: self.resolve(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.resolve(v) for v in value]
+        if not isinstance(value, str):
+            return value
+        token = TOKEN_RE.match(value)
+        if token:
+            if value not in self.tokens:
+                self.tokens[value] = self.server.create_token(self.ids.get(token.group(1), token.group(1)))
+            return self.tokens[value]
+        return self.ids.get(value, value)
+
+    def learn(self, recorded, actual):
+        """Map pseudonyms in a recorded response onto the replayed response"""
+        if isinstance(recorded, dict) and isinstance(actual, dict):
+            for key, value in recorded.items():
+                if key in actual:
+                    self.learn(value, actual[key])
+        elif isinstance(recorded, list) and isinstance(actual, list):
+            for a, b in zip(recorded, actual):
+                self.learn(a, b)
+        elif isinstance(recorded, str) and isinstance(actual, str) and recorded != actual:
+            if TOKEN_RE.match(recorded):
+                self.tokens[recorded] = actual
+            elif self.server.OBJECT_ID_RE.match(recorded) or self.server.ROOM_CODE_RE.match(recorded):
+                self.ids[recorded] = actual
+
+    # ---------- dispatch ----------
+
+    def label(self, event: Dict) -> str:
+        if event["kind"] == "sio":
+            return f"sio {event['event']}"
+        parts = []
+        for part in event["path"].split("/"):
+            if self.server.OBJECT_ID_RE.match(part):
+                part = "{id}"
+            elif self.server.ROOM_CODE_RE.match(part):
+                part = "{code}"
+            parts.append(part)
+        return f"{event['method']} {'/'.join(parts)}"
+
+    def actor(self, event: Dict) -> str:
+        """Events of one client keep their recorded order"""
+        if event["kind"] == "sio":
+            return event["sid"]
+        token = (event.get("query") or {}).get("token")
+        return token or f"http-{id(event)}"
+
+    async def session(self, recorded_sid: str) -> str:
+        """Socket.IO sid for a recorded client, connected to the default namespace on first use"""
+        if recorded_sid not in self.sids:
+            self.sids[recorded_sid] = await self.server.sio.manager.connect(f"replay-{recorded_sid}", "/")
+        return self.sids[recorded_sid]
+
+    async def send(self, event: Dict, client) -> bool:
+        if event["kind"] == "sio":
+            sid = await self.session(event["sid"])
+            if event["event"] == "disconnect":
+                await self.server.sio._trigger_event("disconnect", "/", sid, "client disconnect")
+                await self.server.sio.manager.disconnect(sid, "/")
+                del self.sids[event["sid"]]
+            else:
+                await self.server.sio._trigger_event(event["event"], "/", sid, self.resolve(event["data"]))
+            return True
+        response = await client.request(
+            event["method"],
+            "/".join(self.resolve(part) for part in event["path"].split("/")),
+            params=self.resolve(event.get("query") or {}),
+            json=self.resolve(event["body"]) if event.get("body") is not None else None,
+        )
+        if event.get("response") is not None and response.headers.get("content-type", "").startswith("application/json"):
+            self.learn(event["response"], response.json())
+        return response.status_code == event["status"]
+
+    async def play(self, event: Dict, client, previous: Optional[asyncio.Future]):
+        if previous is not None:
+            await previous
+        label = self.label(event)
+        started = time.perf_counter()
+        try:
+            ok = await self.send(event, client)
+        except Exception as e:
+            logging.debug(f"{label} failed: {e}")
+            ok = False
+        self.latencies.setdefault(label, []).append((time.perf_counter() - started) * 1000)
+        if not ok:
+            self.errors[label] = self.errors.get(label, 0) + 1
+
+    async def run(self, client) -> float:
+        pending = []
+        started = time.perf_counter()
+        for event in self.events:
+            if self.speed:
+                delay = started + event["t"] / self.speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    self.lag.append(-delay * 1000)
+            actor = self.actor(event)
+            task = asyncio.ensure_future(self.play(event, client, self.chains.get(actor)))
+            self.chains[actor] = task
+            pending.append(task)
+            # Later events refer to what this request creates (users, rooms)
+            if event.get("response") is not None and self.created(event):
+                await task
+            else:
+                await asyncio.sleep(0)
+        await asyncio.gather(*pending)
+        return time.perf_counter() - started
+
+    def created(self, event: Dict) -> Dict[str, Optional[str]]:
+        requested: Dict[str, Optional[str]] = {}
+        for key in ("body", "query"):
+            self.collect(event.get(key), None, requested)
+        response: Dict[str, Optional[str]] = {}
+        self.collect(event.get("response"), None, response)
+        return {v: k for v, k in response.items() if v not in requested and v not in self.ids}
+
+    def report(self, wall: float) -> Dict:
+        import numpy as np
+
+        handlers = {}
+        for label, samples in sorted(self.latencies.items()):
+            values = np.asarray(samples)
+            handlers[label] = {
+                "count": len(samples),
+                "errors": self.errors.get(label, 0),
+                "mean_ms": round(float(values.mean()), 3),
+                **{f"p{p}_ms": round(float(np.percentile(values, p)), 3) for p in PERCENTILES},
+                "max_ms": round(float(values.max()), 3),
+            }
+        total = sum(len(s) for s in self.latencies.values())
+        return {
+            "events": total,
+            "errors": sum(self.errors.values()),
+            "wall_s": round(wall, 3),
+            "throughput": round(total / wall, 1) if wall else None,
+            "schedule_lag_p99_ms": round(float(np.percentile(self.lag, 99)), 3) if self.lag else 0.0,
+            "handlers": handlers,
+        }
+
+
+def build_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def replay(paths: List[Path], speed: float) -> Dict:
+    import httpx
+    import server
+
+    # Socket.IO request logging would dominate the measurement, and replayed
+    # clients have no transport to receive emits, which engineio warns about
+    logging.disable(logging.WARNING)
+    for handler in server.app.router.on_startup:
+        await handler()
+    events = load_events(paths)
+    session = Replay(server, events, speed)
+    users, rooms = await session.seed()
+    transport = httpx.ASGITransport(app=server.socket_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://replay") as client:
+        wall = await session.run(client)
+    for handler in server.app.router.on_shutdown:
+        await handler()
+    return {
+        "build": build_revision(),
+        "python": platform.python_version(),
+        "traces": [str(p) for p in paths],
+        "speed": speed or "max",
+        "seeded": {"users": users, "rooms": rooms},
+        **session.report(wall),
+    }
+
+
+@cli.command()
+def run(
+    traces: List[Path] = typer.Argument(..., exists=True, help="Recorded .ndjson.gz files"),
+    speed: str = typer.Option("1", help="Replay speed: 1, 10 or max"),
+    out: Path = typer.Option(Path("replay.json"), help="Where to write the report"),
+):
+    """Replay recorded traffic and write a latency/throughput report."""
+    result = asyncio.run(replay(traces, parse_speed(speed)))
+    out.write_text(json.dumps(result, indent=2))
+    typer.echo(f"{result['events']} events in {result['wall_s']}s "
+               f"({result['throughput']}/s, {result['errors']} errors) -> {out}")
+
+
+def delta(before: Optional[float], after: Optional[float]) -> str:
+    if not before or after is None:
+        return "n/a"
+    return f"{(after - before) / before * 100:+.1f}%"
+
+
+@cli.command()
+def compare(
+    baseline: Path = typer.Argument(..., exists=True),
+    candidate: Path = typer.Argument(..., exists=True),
+    threshold: float = typer.Option(0.0, help="Exit 1 if any p95 regresses by more than this many percent"),
+):
+    """Print latency and throughput deltas between two reports."""
+    a = json.loads(baseline.read_text())
+    b = json.loads(candidate.read_text())
+    typer.echo(f"build        {a.get('build')} -> {b.get('build')}")
+    typer.echo(f"throughput   {a['throughput']} -> {b['throughput']}/s ({delta(a['throughput'], b['throughput'])})")
+    typer.echo(f"errors       {a['errors']} -> {b['errors']}")
+    typer.echo("")
+    typer.echo(f"{'handler':<40} {'count':>7} {'p50 ms':>18} {'p95 ms':>18} {'p99 ms':>18}")
+    regressions = []
+    for label in sorted(set(a["handlers"]) | set(b["handlers"])):
+        before = a["handlers"].get(label, {})
+        after = b["handlers"].get(label, {})
+        cells = []
+        for p in ("p50_ms", "p95_ms", "p99_ms"):
+            cells.append(f"{before.get(p, '-')}->{after.get(p, '-')} {delta(before.get(p), after.get(p)):>7}")
+        typer.echo(f"{label:<40} {after.get('count', before.get('count', 0)):>7} " + " ".join(f"{c:>18}" for c in cells))
+        if threshold and before.get("p95_ms") and after.get("p95_ms"):
+            if (after["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100 > threshold:
+                regressions.append(label)
+    if regressions:
+        typer.echo(f"\np95 regressed by more than {threshold}%: {', '.join(regressions)}", err=True)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    cli()
@@ -1,28 +1,180 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Depends
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, PlainTextResponse, StreamingResponse
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Callable, Set, NamedTuple, Annotated, Union, get_args, get_origin, get_type_hints
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import uuid
 from datetime import datetime, timedelta
 import socketio
 import bcrypt
 import jwt
-from bson import ObjectId
+from bson import ObjectId, Binary
+from bson.errors import InvalidId
+from pymongo import UpdateOne, WriteConcern, monitoring
+from pymongo.errors import BulkWriteError
+from pymongo.read_concern import ReadConcern
+from pymongo.read_preferences import SecondaryPreferred
+import asyncio
+import heapq
+import bisect
+import numpy as np
 import random
 import string
+import math
+import re
+import threading
+import io
+import sys
+import types
+import json
+import cProfile
+import pstats
+import marshal
+import tracemalloc
+import zlib
+import gzip
+import hmac
+import hashlib
+import secrets
+from urllib.parse import parse_qsl
+from collections import deque, Counter
+from array import array
+from storage import MemoryClient
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional: NDJSON exports only
+    pa = pq = None
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ.get('DB_NAME', 'frozen_game')]
+DB_NAME = os.environ.get('DB_NAME', 'frozen_game')
+
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '100'))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '0'))
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Counts connection pool events so pool utilization can be reported"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.open = 0
+        self.checked_out = 0
+        self.waiting = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.pool_clears = 0
+
+    def snapshot(self) -> Dict:
+        with self.lock:
+            return {
+                "max_pool_size": MONGO_MAX_POOL_SIZE,
+                "open": self.open,
+                "checked_out": self.checked_out,
+                "waiting": self.waiting,
+                "utilization": round(self.checked_out / MONGO_MAX_POOL_SIZE, 3) if MONGO_MAX_POOL_SIZE else 0,
+                "checkouts_total": self.checkouts,
+                "checkout_failures_total": self.checkout_failures,
+                "pool_clears_total": self.pool_clears,
+            }
+
+    def connection_created(self, event):
+        with self.lock:
+            self.open += 1
+
+    def connection_closed(self, event):
+        with self.lock:
+            self.open -= 1
+
+    def connection_check_out_started(self, event):
+        with self.lock:
+            self.waiting += 1
+
+    def connection_checked_out(self, event):
+        with self.lock:
+            self.waiting -= 1
+            self.checked_out += 1
+            self.checkouts += 1
+
+    def connection_check_out_failed(self, event):
+        with self.lock:
+            self.waiting -= 1
+            self.checkout_failures += 1
+
+    def connection_checked_in(self, event):
+        with self.lock:
+            self.checked_out -= 1
+
+    def pool_cleared(self, event):
+        with self.lock:
+            self.pool_clears += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+pool_monitor = PoolMonitor()
+
+# STORAGE_ENGINE=memory swaps MongoDB for the in-process engine (dev, tests, benchmarks)
+STORAGE_ENGINE = os.environ.get('STORAGE_ENGINE', 'mongo')
+
+if STORAGE_ENGINE == 'memory':
+    client = MemoryClient()
+else:
+    client = AsyncIOMotorClient(
+        os.environ['MONGO_URL'],
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', '300000')),
+        waitQueueTimeoutMS=int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', '2000')),
+        serverSelectionTimeoutMS=int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000')),
+        connectTimeoutMS=int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '5000')),
+        socketTimeoutMS=int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', '10000')),
+        compressors=os.environ.get('MONGO_COMPRESSORS', 'zlib'),
+        event_listeners=[pool_monitor],
+    )
+db = client[DB_NAME]
+
+# Per-operation-class views of the same database:
+# - stats_db: counter increments; w=1 by default, MONGO_STATS_W=0 makes them fire-and-forget
+# - purchase_db: coins, gems and subscriptions; majority write and read concern
+# - ranking_db: leaderboard and stats reads, served by secondaries when available
+stats_db = client.get_database(
+    DB_NAME,
+    write_concern=WriteConcern(w=int(os.environ.get('MONGO_STATS_W', '1')))
+)
+purchase_db = client.get_database(
+    DB_NAME,
+    write_concern=WriteConcern(w="majority", wtimeout=5000),
+    read_concern=ReadConcern("majority")
+)
+ranking_db = client.get_database(
+    DB_NAME,
+    read_preference=SecondaryPreferred(max_staleness=int(os.environ.get('MONGO_RANKING_MAX_STALENESS', '120')))
+)
 
 # JWT Secret
 JWT_SECRET = os.environ.get('JWT_SECRET', 'frozen-game-secret-key-2025')
@@ -32,6 +184,9 @@ JWT_ALGORITHM = "HS256"
 sio = socketio.AsyncServer(
     async_mode='asgi',
     cors_allowed_origins='*',
+    # Long-polling payloads; websocket frames use permessage-deflate from the ASGI server
+    http_compression=True,
+    compression_threshold=int(os.environ.get('EIO_COMPRESSION_THRESHOLD', '1024')),
     logger=True,
     engineio_logger=True
 )
@@ -46,6 +201,9 @@ socket_app = socketio.ASGIApp(sio, app)
 # In-memory game state
 active_games: Dict[str, Dict] = {}
 player_connections: Dict[str, str] = {}  # sid -> player_id
+room_sids: Dict[str, Set[str]] = {}  # room_code -> connected sids
+sid_rooms: Dict[str, Set[str]] = {}  # sid -> joined room codes
+room_activity: Dict[str, float] = {}  # room_code -> last activity time
 
 # ==================== MODELS ====================
 
@@ -111,6 +269,69 @@ class PurchaseRequest(BaseModel):
 class SubscriptionRequest(BaseModel):
     plan: str  # monthly, yearly
 
+# ==================== SLIM USER ====================
+
+class SlimUser:
+    """Read-only view over a projected user document.
+
+    Only the fields in the projection used for the read are meaningful; the
+    rest hold their defaults.
+    """
+    __slots__ = (
+        "id", "username", "email", "password", "coins", "gems", "is_premium",
+        "subscription_type", "owned_powers", "owned_skins", "equipped_skin",
+        "stats", "ble_device", "is_admin"
+    )
+
+    def __init__(self, doc: dict):
+        self.id = doc.get("_id")
+        self.username = doc.get("username", "")
+        self.email = doc.get("email", "")
+        self.password = doc.get("password", "")
+        self.coins = doc.get("coins", 0)
+        self.gems = doc.get("gems", 0)
+        self.is_premium = doc.get("is_premium", False)
+        self.subscription_type = doc.get("subscription_type")
+        self.owned_powers = doc.get("owned_powers", [])
+        self.owned_skins = doc.get("owned_skins", ["default"])
+        self.equipped_skin = doc.get("equipped_skin", "default")
+        self.stats = doc.get("stats", {})
+        self.ble_device = doc.get("ble_device")
+        self.is_admin = doc.get("is_admin", False)
+
+    def profile(self) -> dict:
+        return {
+            "id": str(self.id),
+            "username": self.username,
+            "email": self.email,
+            "coins": self.coins,
+            "gems": self.gems,
+            "is_premium": self.is_premium,
+            "subscription_type": self.subscription_type,
+            "owned_powers": self.owned_powers,
+            "owned_skins": self.owned_skins,
+            "equipped_skin": self.equipped_skin,
+            "stats": self.stats
+        }
+
+# Projections per call site, so reads transfer only what is used
+AUTH_PROJECTION = {"username": 1, "equipped_skin": 1}
+PROFILE_PROJECTION = {
+    "username": 1, "email": 1, "coins": 1, "gems": 1, "is_premium": 1,
+    "subscription_type": 1, "owned_powers": 1, "owned_skins": 1,
+    "equipped_skin": 1, "stats": 1
+}
+LOGIN_PROJECTION = {**PROFILE_PROJECTION, "password": 1}
+WALLET_PROJECTION = {"coins": 1, "gems": 1, "owned_powers": 1, "owned_skins": 1}
+SKINS_PROJECTION = {"owned_skins": 1}
+BLE_PROJECTION = {"username": 1, "ble_device": 1}
+STATS_PROJECTION = {"username": 1, "stats": 1}
+ADMIN_PROJECTION = {"username": 1, "is_admin": 1}
+MATCHMAKING_PROJECTION = {"username": 1, "equipped_skin": 1, "stats.level": 1, "subscription_type": 1}
+
+def leaderboard_projection(stat: str) -> dict:
+    return {"_id": 0, "username": 1, f"stats.{stat}": 1, "stats.level": 1}
+
 # ==================== HELPERS ====================
 
 def generate_room_code():
@@ -122,6 +343,19 @@ def hash_password(password: str) -> str:
 def verify_password(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password.encode(), hashed.encode())
 
+# bcrypt is CPU-bound, so it runs on its own pool instead of the event loop
+HASH_WORKERS = int(os.environ.get('HASH_WORKERS', '4'))
+hash_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+hash_jobs_in_flight = 0
+
+async def run_hashing(func: Callable, *args):
+    global hash_jobs_in_flight
+    hash_jobs_in_flight += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(hash_executor, func, *args)
+    finally:
+        hash_jobs_in_flight -= 1
+
 def create_token(user_id: str) -> str:
     payload = {
         "user_id": user_id,
@@ -136,12 +370,158 @@ def decode_token(token: str) -> Optional[str]:
     except:
         return None
 
-async def get_current_user(token: str) -> Optional[dict]:
+async def get_current_user(token: str, projection: dict = AUTH_PROJECTION) -> Optional[SlimUser]:
     user_id = decode_token(token)
     if not user_id:
         return None
-    user = await db.users.find_one({"_id": ObjectId(user_id)})
-    return user
+    user = await db.users.find_one({"_id": ObjectId(user_id)}, projection)
+    return SlimUser(user) if user else None
+
+# ==================== USER LOADER ====================
+
+class UserLoader:
+    """Coalesces user lookups issued within one event-loop tick into one $in query.
+
+    Results are kept in a small LRU cache shared by all requests; writers of
+    the cached fields call invalidate() or prime().
+    """
+
+    def __init__(self, projection: dict, cache_size: int = 10000):
+        self.projection = projection
+        self.cache_size = cache_size
+        self.cache: "OrderedDict[str, dict]" = OrderedDict()
+        self.pending: Dict[str, List[asyncio.Future]] = {}
+        self.queries = 0
+
+    async def load(self, user_id: str) -> Optional[dict]:
+        cached = self.cache.get(user_id)
+        if cached is not None:
+            self.cache.move_to_end(user_id)
+            return cached
+        if not ObjectId.is_valid(user_id):
+            return None
+        future = asyncio.get_running_loop().create_future()
+        if not self.pending:
+            asyncio.get_running_loop().call_soon(self._dispatch)
+        self.pending.setdefault(user_id, []).append(future)
+        return await future
+
+    async def load_many(self, user_ids: List[str]) -> List[Optional[dict]]:
+        return list(await asyncio.gather(*(self.load(uid) for uid in user_ids)))
+
+    def prime(self, user_id: str, doc: dict):
+        self.cache[user_id] = {k: doc.get(k) for k in self.projection}
+        self.cache.move_to_end(user_id)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def invalidate(self, user_id: str):
+        self.cache.pop(user_id, None)
+
+    def _dispatch(self):
+        batch, self.pending = self.pending, {}
+        asyncio.ensure_future(self._fetch(batch))
+
+    async def _fetch(self, batch: Dict[str, List[asyncio.Future]]):
+        self.queries += 1
+        try:
+            docs = await db.users.find(
+                {"_id": {"$in": [ObjectId(uid) for uid in batch]}},
+                self.projection
+            ).to_list(len(batch))
+        except Exception as e:
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+        found = {}
+        for doc in docs:
+            user_id = str(doc["_id"])
+            self.prime(user_id, doc)
+            found[user_id] = self.cache[user_id]
+        for user_id, futures in batch.items():
+            for future in futures:
+                if not future.done():
+                    future.set_result(found.get(user_id))
+
+# Username and skin of players, as shown in game events
+user_cards = UserLoader({"username": 1, "equipped_skin": 1})
+
+# ==================== SINGLE-FLIGHT READS ====================
+
+SINGLE_FLIGHT_MAX_ENTRIES = int(os.environ.get('SINGLE_FLIGHT_MAX_ENTRIES', '10000'))  # cached results per reader
+
+class SingleFlight:
+    """Runs one call per key at a time and shares its result with concurrent callers.
+
+    Results are also kept for `ttl` seconds, so bursts of identical reads (a
+    whole room reconnecting at once) reach the database once. Keys come from
+    clients, so the cache is bounded: misses (None) are not kept, expired
+    entries are swept on insert and at most `max_entries` stay, oldest out first.
+    """
+
+    def __init__(self, ttl: float, max_entries: int = SINGLE_FLIGHT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.inflight: Dict[Any, asyncio.Future] = {}
+        # key -> (expires_at, value); one ttl, so insertion order is expiry order
+        self.cache: "OrderedDict[Any, tuple]" = OrderedDict()
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key, fetch: Callable):
+        hit = self.cache.get(key)
+        if hit is not None:
+            if hit[0] > time.monotonic():
+                self.shared += 1
+                return hit[1]
+            del self.cache[key]
+        future = self.inflight.get(key)
+        if future is not None:
+            self.shared += 1
+            return await asyncio.shield(future)
+        
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        self.calls += 1
+        try:
+            value = await fetch()
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody else was waiting
+            raise
+        else:
+            future.set_result(value)
+            # A forget() during the call means the value may already be stale
+            if self.inflight.get(key) is future and self.ttl > 0 and value is not None:
+                self.store(key, value)
+            return value
+        finally:
+            if self.inflight.get(key) is future:
+                del self.inflight[key]
+
+    def store(self, key, value):
+        now = time.monotonic()
+        self.cache.pop(key, None)
+        self.cache[key] = (now + self.ttl, value)
+        while self.cache:
+            oldest = next(iter(self.cache.values()))
+            if oldest[0] > now and len(self.cache) <= self.max_entries:
+                break
+            self.cache.popitem(last=False)
+
+    def forget(self, key):
+        self.cache.pop(key, None)
+        self.inflight.pop(key, None)
+
+    def stats(self) -> Dict:
+        return {"calls_total": self.calls, "shared_total": self.shared, "cached": len(self.cache)}
+
+room_reads = SingleFlight(ttl=float(os.environ.get('ROOM_READ_CACHE_TTL', '0.25')))
+public_room_reads = SingleFlight(ttl=float(os.environ.get('PUBLIC_ROOMS_CACHE_TTL', '1.0')))
+stats_reads = SingleFlight(ttl=float(os.environ.get('STATS_READ_CACHE_TTL', '1.0')))
+leaderboard_reads = SingleFlight(ttl=float(os.environ.get('LEADERBOARD_CACHE_TTL', '5.0')))
 
 # ==================== SHOP DATA ====================
 
@@ -267,226 +647,1391 @@ import time
 # Store server start time
 SERVER_START_TIME = time.time()
 
-@api_router.get("/health")
-async def health_check():
-    """Health check endpoint with MongoDB connectivity test"""
+HEALTH_PROBE_INTERVAL = float(os.environ.get('HEALTH_PROBE_INTERVAL', '5'))
+HEALTH_DB_TIMEOUT = float(os.environ.get('HEALTH_DB_TIMEOUT', '2'))
+LOOP_LAG_DEGRADED_MS = float(os.environ.get('LOOP_LAG_DEGRADED_MS', '100'))
+EXECUTOR_DEGRADED_RATIO = float(os.environ.get('EXECUTOR_DEGRADED_RATIO', '2'))
+
+# Set once startup has finished; readiness stays false until then
+server_ready = False
+# Set on SIGTERM by the launcher; readiness goes false while rounds wind down
+draining = False
+
+# Latest probe result, served as-is by the health endpoints
+health_state: Dict[str, Any] = {
+    "status": "starting",
+    "database": "unknown",
+    "loop_lag_ms": 0.0,
+    "hash_executor": {"workers": HASH_WORKERS, "in_flight": 0},
+    "active_rooms": 0,
+    "checked_at": None,
+}
+
+async def probe_health(loop_lag_ms: float):
     try:
-        # Test MongoDB connection with ping
-        await db.command("ping")
+        await asyncio.wait_for(db.command("ping"), HEALTH_DB_TIMEOUT)
         db_status = "connected"
     except Exception as e:
         logger.error(f"MongoDB connection failed: {e}")
         db_status = "disconnected"
     
-    # Calculate uptime
-    uptime_seconds = int(time.time() - SERVER_START_TIME)
+    executor_saturated = hash_jobs_in_flight >= HASH_WORKERS * EXECUTOR_DEGRADED_RATIO
+    if db_status != "connected":
+        status = "down"
+    elif loop_lag_ms > LOOP_LAG_DEGRADED_MS or executor_saturated:
+        status = "degraded"
+    else:
+        status = "ok"
     
-    return {
-        "status": "ok",
+    health_state.update({
+        "status": status,
         "database": db_status,
-        "uptime": uptime_seconds,
-        "version": "1.0"
-    }
+        "loop_lag_ms": round(loop_lag_ms, 2),
+        "hash_executor": {"workers": HASH_WORKERS, "in_flight": hash_jobs_in_flight},
+        "active_rooms": len(active_games),
+        "checked_at": datetime.utcnow().isoformat(),
+    })
 
-# ==================== AUTH ROUTES ====================
+async def health_probe_loop():
+    while True:
+        # How late the wake-up is measures how long the loop was held by others
+        started = time.monotonic()
+        await asyncio.sleep(HEALTH_PROBE_INTERVAL)
+        lag_ms = max(0.0, (time.monotonic() - started - HEALTH_PROBE_INTERVAL) * 1000)
+        await probe_health(lag_ms)
 
-@api_router.post("/auth/register")
-async def register(user: UserCreate):
-    # Check if user exists
-    existing = await db.users.find_one({"$or": [{"email": user.email}, {"username": user.username}]})
-    if existing:
-        raise HTTPException(status_code=400, detail="Korisnik vec postoji")
-    
-    # Create user
-    user_doc = {
-        "username": user.username,
-        "email": user.email,
-        "password": hash_password(user.password),
-        "coins": 100,  # Starting coins
-        "gems": 10,    # Starting gems
-        "is_premium": False,
-        "subscription_type": None,
-        "owned_powers": [],
-        "owned_skins": ["default"],
-        "equipped_skin": "default",
-        "stats": {
-            "games_played": 0,
-            "games_won": 0,
-            "times_frozen": 0,
-            "times_unfrozen_others": 0,
-            "times_as_mraz": 0,
-            "total_play_time": 0,
-            "longest_survival": 0,
-            "xp": 0,
-            "level": 1
-        },
-        "created_at": datetime.utcnow()
-    }
-    
-    result = await db.users.insert_one(user_doc)
-    token = create_token(str(result.inserted_id))
-    
+@api_router.get("/health")
+async def health_check():
+    """Health check endpoint, answered from the last background probe"""
     return {
-        "token": token,
-        "user": {
-            "id": str(result.inserted_id),
-            "username": user.username,
-            "email": user.email,
-            "coins": user_doc["coins"],
-            "gems": user_doc["gems"],
-            "is_premium": False,
-            "stats": user_doc["stats"]
-        }
+        **health_state,
+        "ready": server_ready,
+        "uptime": int(time.time() - SERVER_START_TIME),
+        "version": "1.0"
     }
 
-@api_router.post("/auth/login")
-async def login(credentials: UserLogin):
-    user = await db.users.find_one({"email": credentials.email})
-    if not user or not verify_password(credentials.password, user["password"]):
-        raise HTTPException(status_code=401, detail="Pogresni podaci za prijavu")
-    
-    token = create_token(str(user["_id"]))
-    
-    return {
-        "token": token,
-        "user": {
-            "id": str(user["_id"]),
-            "username": user["username"],
-            "email": user["email"],
-            "coins": user.get("coins", 0),
-            "gems": user.get("gems", 0),
-            "is_premium": user.get("is_premium", False),
-            "subscription_type": user.get("subscription_type"),
-            "owned_powers": user.get("owned_powers", []),
-            "owned_skins": user.get("owned_skins", ["default"]),
-            "equipped_skin": user.get("equipped_skin", "default"),
-            "stats": user.get("stats", {})
-        }
-    }
+@api_router.get("/health/live")
+async def liveness():
+    """Liveness: the process is up and its event loop is serving requests"""
+    return {"status": "alive"}
 
-@api_router.get("/auth/me")
-async def get_me(token: str):
-    user = await get_current_user(token)
-    if not user:
-        raise HTTPException(status_code=401, detail="Neautorizovan pristup")
-    
+@api_router.get("/health/ready")
+async def readiness():
+    """Readiness: startup finished and the database answered the last probe"""
+    ready = server_ready and health_state["database"] == "connected"
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"ready": ready, "status": health_state["status"], "database": health_state["database"]}
+    )
+
+# ==================== METRICS ====================
+
+# section name -> function returning that section's current metrics
+metrics_sources: Dict[str, Callable[[], Dict]] = {}
+
+def metrics_source(name: str):
+    def register(func):
+        metrics_sources[name] = func
+        return func
+    return register
+
+@api_router.get("/metrics")
+async def get_metrics():
+    return {name: source() for name, source in metrics_sources.items()}
+
+@metrics_source("mongo_pool")
+def mongo_pool_metrics() -> Dict:
+    return pool_monitor.snapshot()
+
+@metrics_source("single_flight")
+def single_flight_metrics() -> Dict:
     return {
-        "id": str(user["_id"]),
-        "username": user["username"],
-        "email": user["email"],
-        "coins": user.get("coins", 0),
-        "gems": user.get("gems", 0),
-        "is_premium": user.get("is_premium", False),
-        "subscription_type": user.get("subscription_type"),
-        "owned_powers": user.get("owned_powers", []),
-        "owned_skins": user.get("owned_skins", ["default"]),
-        "equipped_skin": user.get("equipped_skin", "default"),
-        "stats": user.get("stats", {})
+        "rooms": room_reads.stats(),
+        "public_rooms": public_room_reads.stats(),
+        "stats": stats_reads.stats(),
+        "leaderboard": leaderboard_reads.stats(),
     }
 
-# ==================== GAME ROUTES ====================
+@metrics_source("user_loader")
+def user_loader_metrics() -> Dict:
+    return {"cached": len(user_cards.cache), "queries_total": user_cards.queries}
 
-@api_router.post("/rooms/create")
-async def create_room(request: CreateRoomRequest, token: str):
-    user = await get_current_user(token)
+# ==================== PROFILING ====================
+
+SLOW_HANDLER_MS = float(os.environ.get('SLOW_HANDLER_MS', '100'))
+PROFILE_MAX_SECONDS = 300
+SAMPLER_INTERVAL = 0.005  # seconds between stack samples for the flamegraph
+
+async def require_admin(token: str) -> SlimUser:
+    user = await get_current_user(token, ADMIN_PROJECTION)
     if not user:
         raise HTTPException(status_code=401, detail="Neautorizovan pristup")
+    if not user.is_admin:
+        raise HTTPException(status_code=403, detail="Potrebna su administratorska prava")
+    return user
+
+# --- slow handlers ---
+
+slow_handler_threshold = SLOW_HANDLER_MS / 1000
+slow_handlers: "deque[Dict]" = deque(maxlen=200)
+slow_handler_counts: Dict[str, int] = {}
+
+def payload_size(data) -> int:
+    try:
+        return len(json.dumps(data, default=str))
+    except (TypeError, ValueError):
+        return -1
+
+def report_slow_step(elapsed: float, describe: Callable[[], tuple]):
+    name, size = describe()
+    entry = {"handler": name, "ms": round(elapsed * 1000, 1), "payload_bytes": size, "at": time.time()}
+    slow_handlers.append(entry)
+    slow_handler_counts[name] = slow_handler_counts.get(name, 0) + 1
+    logger.warning(f"Slow handler {name} held the event loop for {entry['ms']}ms (payload {entry['payload_bytes']} bytes)")
+
+@types.coroutine
+def timed_steps(coro, describe: Callable[[], tuple]):
+    """Drive `coro` and time every step it runs between awaits.
+
+    A step is the time the handler holds the event loop without yielding, so
+    an over-threshold step is exactly what delays every other client.
+    `describe` returns (handler name, payload bytes) and only runs for slow steps.
+    """
+    send, error = None, None
+    while True:
+        started = time.perf_counter()
+        try:
+            yielded = coro.throw(error) if error is not None else coro.send(send)
+        except StopIteration as stop:
+            elapsed = time.perf_counter() - started
+            if elapsed > slow_handler_threshold:
+                report_slow_step(elapsed, describe)
+            return stop.value
+        elapsed = time.perf_counter() - started
+        if elapsed > slow_handler_threshold:
+            report_slow_step(elapsed, describe)
+        try:
+            send, error = (yield yielded), None
+        except BaseException as e:
+            send, error = None, e
+
+class SlowRouteMiddleware:
+    """Times each step of HTTP requests with timed_steps, labelled by endpoint name"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or slow_handler_threshold <= 0:
+            return await self.app(scope, receive, send)
+        
+        def describe():
+            # Routing fills in scope["endpoint"] once a route matched
+            endpoint = scope.get("endpoint")
+            headers = dict(scope.get("headers") or [])
+            return (
+                getattr(endpoint, "__name__", None) or scope.get("path", "?"),
+                int(headers.get(b"content-length", 0) or 0)
+            )
+        return await timed_steps(self.app(scope, receive, send), describe)
+
+# --- cProfile and stack sampling ---
+
+profile_session: Dict[str, Any] = {"profiler": None, "sampler": None, "timer": None, "started_at": None, "stopped_at": None}
+profile_results: Dict[str, Any] = {"stats": None, "stacks": None}
+
+class StackSampler(threading.Thread):
+    """Samples the event loop thread's stack; output is collapsed-stack text for flamegraph tools"""
+
+    def __init__(self, thread_id: int, interval: float = SAMPLER_INTERVAL):
+        super().__init__(daemon=True, name="stack-sampler")
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.running = threading.Event()
+        self.running.set()
+
+    def run(self):
+        while self.running.is_set():
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def stop(self) -> Counter:
+        self.running.clear()
+        self.join()
+        return self.stacks
+
+def stop_profiling() -> bool:
+    profiler = profile_session["profiler"]
+    if profiler is None:
+        return False
+    profiler.disable()
+    # A manual stop must not leave the timer to cut the next session short
+    profile_session["timer"].cancel()
+    profile_results["stats"] = pstats.Stats(profiler)
+    profile_results["stacks"] = profile_session["sampler"].stop()
+    profile_session.update(profiler=None, sampler=None, timer=None, stopped_at=time.time())
+    return True
+
+@api_router.post("/admin/profile/start")
+async def start_profiling(token: str, seconds: float = 30):
+    """Profile the event loop thread for `seconds`, or until stopped"""
+    await require_admin(token)
+    if profile_session["profiler"] is not None:
+        raise HTTPException(status_code=409, detail="Profilisanje je vec pokrenuto")
+    seconds = min(max(seconds, 1), PROFILE_MAX_SECONDS)
     
-    room_code = generate_room_code()
-    room_doc = {
-        "code": room_code,
-        "name": request.name,
-        "host_id": str(user["_id"]),
-        "players": [{
-            "id": str(user["_id"]),
-            "username": user["username"],
-            "is_host": True,
-            "is_ready": False,
-            "is_frozen": False,
-            "equipped_skin": user.get("equipped_skin", "default")
-        }],
-        "status": "waiting",
-        "current_mraz": None,
-        "frozen_players": [],
-        "max_players": request.max_players,
-        "is_private": request.is_private,
-        "settings": {
-            "freeze_duration": 0,  # 0 = until unfrozen
-            "game_duration": 300,  # 5 minutes
-            "powers_enabled": True
-        },
-        "created_at": datetime.utcnow()
-    }
+    sampler = StackSampler(threading.get_ident())
+    profiler = cProfile.Profile()
+    timer = asyncio.get_running_loop().call_later(seconds, stop_profiling)
+    profile_session.update(profiler=profiler, sampler=sampler, timer=timer, started_at=time.time(), stopped_at=None)
+    sampler.start()
+    profiler.enable()
+    return {"profiling": True, "seconds": seconds}
+
+@api_router.post("/admin/profile/stop")
+async def end_profiling(token: str):
+    await require_admin(token)
+    return {"stopped": stop_profiling()}
+
+@api_router.get("/admin/profile/result")
+async def get_profile_result(token: str, format: str = "text", limit: int = 50):
+    """Last profile as pstats (binary, for snakeviz/pstats), flamegraph (collapsed stacks) or text"""
+    await require_admin(token)
+    stats = profile_results["stats"]
+    if stats is None:
+        raise HTTPException(status_code=404, detail="Nema rezultata profilisanja")
     
-    result = await db.rooms.insert_one(room_doc)
+    if format == "pstats":
+        return Response(
+            content=marshal.dumps(stats.stats),
+            media_type="application/octet-stream",
+            headers={"Content-Disposition": "attachment; filename=profile.pstats"}
+        )
+    if format == "flamegraph":
+        lines = [f"{stack} {count}" for stack, count in profile_results["stacks"].most_common()]
+        return PlainTextResponse("\n".join(lines) + "\n")
     
-    # Create clean response without ObjectId
-    room_response = {
-        "id": str(result.inserted_id),
-        "code": room_code,
-        "name": request.name,
-        "host_id": str(user["_id"]),
-        "players": room_doc["players"],
-        "status": "waiting",
-        "current_mraz": None,
-        "frozen_players": [],
-        "max_players": request.max_players,
-        "is_private": request.is_private,
-        "settings": room_doc["settings"],
-        "created_at": room_doc["created_at"].isoformat()
+    out = io.StringIO()
+    stats.stream = out
+    stats.sort_stats("cumulative").print_stats(limit)
+    return PlainTextResponse(out.getvalue())
+
+@api_router.get("/admin/slow-handlers")
+async def get_slow_handlers(token: str, threshold_ms: Optional[float] = None):
+    """Recent slow handler steps; pass threshold_ms to change the threshold (0 disables)"""
+    global slow_handler_threshold
+    await require_admin(token)
+    if threshold_ms is not None:
+        slow_handler_threshold = max(threshold_ms, 0) / 1000
+    return {
+        "threshold_ms": slow_handler_threshold * 1000,
+        "counts": dict(slow_handler_counts),
+        "recent": list(slow_handlers),
     }
-    
-    # Store in active games
-    active_games[room_code] = room_response
-    
-    return {"room": room_response}
 
-@api_router.post("/rooms/join")
-async def join_room(request: JoinRoomRequest, token: str):
-    user = await get_current_user(token)
-    if not user:
-        raise HTTPException(status_code=401, detail="Neautorizovan pristup")
-    
-    room = await db.rooms.find_one({"code": request.room_code.upper(), "status": "waiting"})
-    if not room:
-        raise HTTPException(status_code=404, detail="Soba nije pronadjena ili je igra vec pocela")
+# --- memory ---
+
+memory_snapshots: Dict[str, Any] = {"last": None}
+
+def deep_sizeof(obj, seen: Optional[Set[int]] = None) -> int:
+    """Approximate retained size of a container tree; NumPy arrays count their buffers"""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes + sys.getsizeof(obj) if obj.base is None else sys.getsizeof(obj)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(deep_sizeof(v, seen) for v in obj)
+    elif hasattr(obj, "__dict__"):
+        size += deep_sizeof(vars(obj), seen)
+    return size
+
+# Every per-room map on this worker, for memory accounting
+ROOM_STATE = {
+    "active_games": lambda: active_games,
+    "round_trackers": lambda: round_trackers,
+    "movement": lambda: movement_rooms,
+    "traces": lambda: trace_buffers,
+    "rssi": lambda: rssi_rooms,
+    "bots": lambda: bot_rooms,
+    "spectators": lambda: spectator_sids,
+    "spectator_events": lambda: spectator_events,
+}
+
+def room_memory() -> Dict[str, Dict[str, int]]:
+    usage: Dict[str, Dict[str, int]] = {}
+    for kind, state in ROOM_STATE.items():
+        for code, value in list(state().items()):
+            usage.setdefault(code, {})[kind] = deep_sizeof(value)
+    for sizes in usage.values():
+        sizes["total"] = sum(sizes.values())
+    return usage
+
+@api_router.post("/admin/memory/tracemalloc")
+async def toggle_tracemalloc(token: str, enable: bool = True, frames: int = 1):
+    """Start or stop tracemalloc; tracing slows allocations while it runs"""
+    await require_admin(token)
+    if enable and not tracemalloc.is_tracing():
+        tracemalloc.start(min(max(frames, 1), 25))
+    elif not enable and tracemalloc.is_tracing():
+        tracemalloc.stop()
+        memory_snapshots["last"] = None
+    return {"tracing": tracemalloc.is_tracing()}
+
+@api_router.get("/admin/memory/snapshot")
+async def get_memory_snapshot(token: str, limit: int = 25):
+    """Top allocation sites, and the growth of each since the previous snapshot"""
+    await require_admin(token)
+    if not tracemalloc.is_tracing():
+        raise HTTPException(status_code=409, detail="tracemalloc nije pokrenut")
     
-    if len(room["players"]) >= room.get("max_players", 10):
-        raise HTTPException(status_code=400, detail="Soba je puna")
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    previous = memory_snapshots["last"]
+    memory_snapshots["last"] = snapshot
+    current, peak = tracemalloc.get_traced_memory()
     
-    # Check if already in room
-    for p in room["players"]:
-        if p["id"] == str(user["_id"]):
-            # Return clean response
-            room_response = {
-                "id": str(room["_id"]),
-                "code": room["code"],
-                "name": room["name"],
-                "host_id": room.get("host_id", ""),
-                "players": room["players"],
-                "status": room["status"],
-                "current_mraz": room.get("current_mraz"),
-                "frozen_players": room.get("frozen_players", []),
-                "max_players": room.get("max_players", 10),
-                "is_private": room.get("is_private", False),
-                "settings": room.get("settings", {}),
-                "created_at": room.get("created_at").isoformat() if room.get("created_at") else None
-            }
-            return {"room": room_response}
+    def describe(stat):
+        frame = stat.traceback[0]
+        return {"location": f"{frame.filename}:{frame.lineno}", "size": stat.size, "count": stat.count}
     
-    new_player = {
-        "id": str(user["_id"]),
-        "username": user["username"],
-        "is_host": False,
-        "is_ready": False,
-        "is_frozen": False,
-        "equipped_skin": user.get("equipped_skin", "default")
+    result = {
+        "traced_bytes": current,
+        "peak_bytes": peak,
+        "top": [describe(stat) for stat in snapshot.statistics("lineno")[:limit]],
     }
-    
-    await db.rooms.update_one(
-        {"_id": room["_id"]},
+    if previous is not None:
+        result["growth"] = [
+            {**describe(stat), "size_diff": stat.size_diff, "count_diff": stat.count_diff}
+            for stat in snapshot.compare_to(previous, "lineno")[:limit]
+        ]
+    return result
+
+@api_router.get("/admin/memory/rooms")
+async def get_room_memory(token: str, limit: int = 20):
+    """Approximate bytes held per room by this worker's in-memory game state"""
+    await require_admin(token)
+    usage = room_memory()
+    largest = sorted(usage.items(), key=lambda item: item[1]["total"], reverse=True)[:limit]
+    return {
+        "rooms": len(usage),
+        "total_bytes": sum(sizes["total"] for sizes in usage.values()),
+        "largest": [{"room_code": code, **sizes} for code, sizes in largest],
+    }
+
+@metrics_source("profiling")
+def profiling_metrics() -> Dict:
+    return {
+        "profiling": profile_session["profiler"] is not None,
+        "slow_threshold_ms": slow_handler_threshold * 1000,
+        "slow_steps": dict(slow_handler_counts),
+        "tracemalloc": tracemalloc.is_tracing(),
+    }
+
+# ==================== EXPORT ====================
+
+# Admin exports for analytics. Documents stream from an async cursor in
+# batches; each batch is encoded and handed to the client before the next one
+# is read, so memory stays at one batch however large the collection is.
+# Incremental exports resume after a watermark: records come sorted by it, so
+# the last record's value is the next run's `since`.
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '1000'))
+EXPORT_MAX_BATCH_SIZE = 10000
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "parquet": "application/vnd.apache.parquet"}
+EXPORT_COLLECTIONS = {
+    # collection -> (projection, watermark fields)
+    "users": ({"password": 0, "email": 0}, ("_id", "created_at")),
+    "rooms": (None, ("_id", "created_at")),
+    "room_history": (None, ("_id", "finished_at", "created_at")),
+}
+
+# Analytics reads go to secondaries unless the caller asks for the primary
+export_db = client.get_database(
+    DB_NAME,
+    read_preference=SecondaryPreferred(max_staleness=int(os.environ.get('MONGO_EXPORT_MAX_STALENESS', '300')))
+)
+
+export_counts = {"running": 0, "finished": 0, "documents": 0, "bytes": 0}
+
+def plain(value):
+    """BSON values as JSON/Arrow friendly Python values"""
+    if isinstance(value, dict):
+        return {k: plain(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [plain(v) for v in value]
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, Binary):
+        return bytes(value)
+    return value
+
+def export_json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return value.hex()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+class ExportJob:
+    """One export pass over a collection in watermark order.
+
+    Time watermarks are not unique, so they resume from the compound
+    (value, _id): `since` and `last` read '<iso time>|<_id>'. A bare time
+    is accepted as `since` and means everything after it.
+    """
+
+    def __init__(self, collection: str, watermark: str = "_id", since: Optional[str] = None,
+                 batch_size: int = EXPORT_BATCH_SIZE, secondary: bool = True):
+        if collection not in EXPORT_COLLECTIONS:
+            raise ValueError(f"unknown collection {collection}")
+        projection, watermarks = EXPORT_COLLECTIONS[collection]
+        if watermark not in watermarks:
+            raise ValueError(f"{collection} can only be exported by {', '.join(watermarks)}")
+        if not 1 <= batch_size <= EXPORT_MAX_BATCH_SIZE:
+            raise ValueError(f"batch_size must be between 1 and {EXPORT_MAX_BATCH_SIZE}")
+        self.collection = collection
+        self.projection = projection
+        self.watermark = watermark
+        self.batch_size = batch_size
+        self.secondary = secondary
+        self.conditions: List[Dict] = []
+        if since:
+            self.conditions.append(self.beyond(*self.parse(since), "$gt"))
+        self.last: Optional[str] = since
+        self.until: Optional[str] = None
+        self.exported = 0
+
+    def parse(self, value: str) -> tuple:
+        if self.watermark == "_id":
+            return ObjectId(value), None
+        at, _, doc_id = value.partition("|")
+        return datetime.fromisoformat(at), ObjectId(doc_id) if doc_id else None
+
+    def beyond(self, value, doc_id: Optional[ObjectId], op: str) -> Dict:
+        """Documents after ($gt) or up to ($lte) a watermark position"""
+        if self.watermark == "_id":
+            return {"_id": {op: value}}
+        strict = "$gt" if op == "$gt" else "$lt"
+        if doc_id is None:
+            return {self.watermark: {op: value}}
+        return {"$or": [{self.watermark: {strict: value}}, {self.watermark: value, "_id": {op: doc_id}}]}
+
+    def position(self, doc: Dict) -> Optional[str]:
+        value = doc.get(self.watermark)
+        if value is None:
+            return None
+        if self.watermark == "_id":
+            return str(value)
+        return f"{value.isoformat()}|{doc['_id']}"
+
+    @property
+    def query(self) -> Dict:
+        if len(self.conditions) > 1:
+            return {"$and": self.conditions}
+        return self.conditions[0] if self.conditions else {}
+
+    def order(self, direction: int = 1) -> List[tuple]:
+        if self.watermark == "_id":
+            return [("_id", direction)]
+        return [(self.watermark, direction), ("_id", direction)]
+
+    def source(self):
+        return export_db if self.secondary else db
+
+    async def snapshot(self):
+        """End the export at the newest document right now, so its watermark is known before streaming"""
+        newest = await self.source()[self.collection].find(
+            self.query, {self.watermark: 1}
+        ).sort(self.order(-1)).limit(1).to_list(1)
+        if newest and newest[0].get(self.watermark) is not None:
+            self.until = self.position(newest[0])
+            self.conditions.append(self.beyond(*self.parse(self.until), "$lte"))
+
+    def cursor(self):
+        return self.source()[self.collection].find(self.query, self.projection).sort(self.order()).batch_size(self.batch_size)
+
+    async def batches(self):
+        batch = []
+        async for doc in self.cursor():
+            batch.append(plain(doc))
+            if len(batch) == self.batch_size:
+                yield batch
+                self.advance(batch)
+                batch = []
+        if batch:
+            yield batch
+            self.advance(batch)
+
+    def advance(self, batch: List[Dict]):
+        last = self.position(batch[-1])
+        if last is not None:
+            self.last = last
+        self.exported += len(batch)
+        export_counts["documents"] += len(batch)
+
+async def counted(chunks):
+    export_counts["running"] += 1
+    try:
+        async for chunk in chunks:
+            export_counts["bytes"] += len(chunk)
+            yield chunk
+    finally:
+        export_counts["running"] -= 1
+        export_counts["finished"] += 1
+
+async def stream_ndjson(job: ExportJob):
+    async for batch in job.batches():
+        yield "".join(
+            json.dumps(doc, default=export_json_default, separators=(",", ":")) + "\n" for doc in batch
+        ).encode()
+
+class ParquetSink(io.RawIOBase):
+    """Write-only file for ParquetWriter that hands its bytes out as they are written.
+
+    tell() keeps counting across drains: the writer records offsets from it.
+    """
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+async def stream_parquet(job: ExportJob):
+    """One row group per batch. The schema comes from the first batch;
+    fields that only appear later are dropped, missing ones are null."""
+    sink = ParquetSink()
+    writer = None
+    async for batch in job.batches():
+        if writer is None:
+            table = pa.Table.from_pylist(batch)
+            writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), table.schema, compression="zstd")
+        else:
+            table = pa.Table.from_pylist(batch, schema=writer.schema)
+        await asyncio.to_thread(writer.write_table, table)
+        yield sink.drain()
+    if writer is None:
+        # Empty export: still a valid file
+        writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), pa.schema([("_id", pa.string())]))
+    writer.close()
+    yield sink.drain()
+
+def export_stream(job: ExportJob, format: str):
+    if format == "parquet":
+        if pa is None:
+            raise ValueError("parquet export needs pyarrow")
+        return counted(stream_parquet(job))
+    if format == "ndjson":
+        return counted(stream_ndjson(job))
+    raise ValueError(f"unknown format {format}")
+
+@api_router.get("/admin/export/{collection}")
+async def export_collection(collection: str, token: str, format: str = "ndjson", watermark: str = "_id",
+                            since: Optional[str] = None, batch_size: int = EXPORT_BATCH_SIZE, secondary: bool = True):
+    """Stream a collection as NDJSON or Parquet, optionally only documents after `since`
+
+    X-Export-Since carries the watermark of the last document in the export,
+    to be passed as `since` on the next incremental run.
+    """
+    await require_admin(token)
+    try:
+        job = ExportJob(collection, watermark, since, batch_size, secondary)
+        chunks = export_stream(job, format)
+    except (ValueError, InvalidId) as e:
+        raise HTTPException(status_code=400, detail=f"Neispravan izvoz: {e}")
+    # Headers go out before the body: fix the end of the export first so the
+    # response can say where the next incremental run starts
+    await job.snapshot()
+    extension = "ndjson" if format == "ndjson" else "parquet"
+    return StreamingResponse(chunks, media_type=EXPORT_FORMATS[format], headers={
+        "Content-Disposition": f'attachment; filename="{collection}.{extension}"',
+        "X-Export-Watermark": watermark,
+        "X-Export-Since": job.until or since or "",
+    })
+
+@metrics_source("export")
+def export_metrics() -> Dict:
+    return dict(export_counts)
+
+# ==================== COMPRESSION ====================
+
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+COMPRESS_GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', '6'))
+COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', '4'))
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+# Path prefix -> minimum body size worth compressing; None never compresses.
+# Longest prefix wins, everything else uses COMPRESS_MIN_BYTES.
+COMPRESSION_POLICY: Dict[str, Optional[int]] = {
+    "/api/health": None,       # probes: tiny and frequent
+    "/api/rooms": 512,         # room payloads with player lists
+    "/api/admin/profile": 0,   # profiles and flamegraphs are large text
+}
+
+compression_stats = {
+    "responses": 0, "compressed": 0, "streamed": 0,
+    "bytes_in": 0, "bytes_out": 0, "cpu_seconds": 0.0,
+}
+
+def compression_threshold(path: str) -> Optional[int]:
+    best, threshold = -1, COMPRESS_MIN_BYTES
+    for prefix, value in COMPRESSION_POLICY.items():
+        if path.startswith(prefix) and len(prefix) > best:
+            best, threshold = len(prefix), value
+    return threshold
+
+class BrotliCompressor:
+    """brotli with the zlib compressobj interface: flush() ends the stream, flush(Z_SYNC_FLUSH) does not"""
+
+    def __init__(self):
+        self.compressor = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.process(data)
+
+    def flush(self, mode: int = zlib.Z_FINISH) -> bytes:
+        return self.compressor.finish() if mode == zlib.Z_FINISH else self.compressor.flush()
+
+def new_compressor(encoding: str):
+    if encoding == "br":
+        return BrotliCompressor()
+    # wbits 31: gzip container
+    return zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+class CompressionMiddleware:
+    """gzip/brotli for REST responses above a per-path size threshold.
+
+    Whole responses are compressed only when that makes them smaller; streamed
+    responses of a compressible type are compressed chunk by chunk.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        threshold = compression_threshold(scope["path"])
+        accept = dict(scope.get("headers") or []).get(b"accept-encoding", b"").decode("latin-1")
+        encoding = "br" if brotli is not None and "br" in accept else "gzip" if "gzip" in accept else None
+        if threshold is None or encoding is None:
+            return await self.app(scope, receive, send)
+        
+        start = None
+        compressor = None
+        
+        async def send_compressed(message):
+            nonlocal start, compressor
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or start is None:
+                return await send(message)
+            
+            body = message.get("body", b"")
+            more = message.get("more_body", False)
+            if compressor is None:
+                headers = dict(start["headers"])
+                content_type = headers.get(b"content-type", b"").decode("latin-1")
+                eligible = (
+                    b"content-encoding" not in headers
+                    and content_type.startswith(COMPRESSIBLE_TYPES)
+                    and (more or len(body) >= threshold)
+                )
+                if not eligible:
+                    compression_stats["responses"] += 1
+                    await send(start)
+                    start = None
+                    return await send(message)
+                compressor = new_compressor(encoding)
+                if not more:
+                    return await self.send_whole(send, start, body, compressor, encoding)
+                compression_stats["streamed"] += 1
+                await send(self.compressed_start(start, encoding, None))
+            
+            # Streaming: flush every chunk so clients see rows as they are produced
+            started = time.thread_time()
+            out = compressor.compress(body) + compressor.flush(zlib.Z_SYNC_FLUSH if more else zlib.Z_FINISH)
+            compression_stats["cpu_seconds"] += time.thread_time() - started
+            compression_stats["bytes_in"] += len(body)
+            compression_stats["bytes_out"] += len(out)
+            await send({"type": "http.response.body", "body": out, "more_body": more})
+        
+        await self.app(scope, receive, send_compressed)
+
+    @staticmethod
+    def compressed_start(start, encoding: str, length: Optional[int]) -> Dict:
+        headers = [(k, v) for k, v in start["headers"] if k not in (b"content-length", b"vary")]
+        headers.append((b"content-encoding", encoding.encode()))
+        headers.append((b"vary", b"Accept-Encoding"))
+        if length is not None:
+            headers.append((b"content-length", str(length).encode()))
+        return {**start, "headers": headers}
+
+    async def send_whole(self, send, start, body: bytes, compressor, encoding: str):
+        started = time.thread_time()
+        out = compressor.compress(body) + compressor.flush()
+        compression_stats["cpu_seconds"] += time.thread_time() - started
+        compression_stats["responses"] += 1
+        if len(out) >= len(body):
+            await send(start)
+            return await send({"type": "http.response.body", "body": body})
+        compression_stats["compressed"] += 1
+        compression_stats["bytes_in"] += len(body)
+        compression_stats["bytes_out"] += len(out)
+        await send(self.compressed_start(start, encoding, len(out)))
+        await send({"type": "http.response.body", "body": out})
+
+@metrics_source("compression")
+def compression_metrics() -> Dict:
+    saved = compression_stats["bytes_in"] - compression_stats["bytes_out"]
+    cpu_ms = compression_stats["cpu_seconds"] * 1000
+    return {
+        **{k: v for k, v in compression_stats.items() if k != "cpu_seconds"},
+        "bytes_saved": saved,
+        "cpu_ms": round(cpu_ms, 2),
+        "bytes_saved_per_cpu_ms": round(saved / cpu_ms) if cpu_ms else None,
+        "brotli": brotli is not None,
+        "eio_threshold": sio.eio.compression_threshold,
+    }
+
+# ==================== TRAFFIC RECORDING ====================
+
+# Opt-in: set to a directory to record every Socket.IO event and REST call of
+# this worker as anonymized gzip NDJSON, for replay.py
+TRAFFIC_RECORD_PATH = os.environ.get('TRAFFIC_RECORD_PATH')
+TRAFFIC_FLUSH_INTERVAL = 1.0
+TRAFFIC_MAX_PENDING = 100000   # records buffered before new ones are dropped
+TRAFFIC_MAX_BODY = 65536       # request bodies larger than this are not recorded
+
+OBJECT_ID_RE = re.compile(r"^[0-9a-f]{24}$")
+ROOM_CODE_RE = re.compile(r"^[A-Z0-9]{4,12}$")
+
+class TrafficAnonymizer:
+    """Consistent pseudonyms for one recording.
+
+    Ids, room codes and names map to keyed hashes of the same shape, so a
+    replay sees the same relations (who froze whom, who is in which room)
+    without the real values. Coordinates keep their relative movement but are
+    shifted by a random offset. Passwords become one shared placeholder and
+    tokens become a reference to the (pseudonymous) user they belong to.
+    """
+
+    PASSWORD = "replay-password"
+    NAME_FIELDS = {"username", "name", "device_name", "mraz_username", "winner_username"}
+    DROP_FIELDS = {"password": PASSWORD}
+
+    def __init__(self):
+        self.key = secrets.token_bytes(32)
+        self.lat_offset = random.uniform(-10, 10)
+        self.lon_offset = random.uniform(-10, 10)
+
+    def digest(self, value: str) -> str:
+        return hmac.new(self.key, value.encode(), hashlib.sha256).hexdigest()
+
+    def token(self, token: str) -> str:
+        user_id = decode_token(token)
+        return f"<token:{self.digest(user_id)[:24]}>" if user_id else "<token:invalid>"
+
+    def value(self, value, key: Optional[str] = None):
+        if isinstance(value, dict):
+            return {k: self.value(v, k) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.value(v, key) for v in value]
+        if key in self.DROP_FIELDS:
+            return self.DROP_FIELDS[key]
+        if key == "latitude" and isinstance(value, (int, float)):
+            return max(-90.0, min(90.0, value + self.lat_offset))
+        if key == "longitude" and isinstance(value, (int, float)):
+            return (value + self.lon_offset + 180) % 360 - 180
+        if not isinstance(value, str):
+            return value
+        if key == "token":
+            return self.token(value)
+        if key == "email":
+            return f"{self.digest(value)[:12]}@example.invalid"
+        if key in self.NAME_FIELDS:
+            return f"user_{self.digest(value)[:8]}"
+        if OBJECT_ID_RE.match(value):
+            return self.digest(value)[:24]
+        if key in ("room_code", "code") and ROOM_CODE_RE.match(value):
+            return self.digest(value)[:len(value)].upper()
+        if key in ("device_id", "device_ids"):
+            return self.digest(value)[:12]
+        return value
+
+class TrafficRecorder:
+    def __init__(self, directory: str):
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        self.path = Path(directory) / f"traffic-{stamp}-{os.getpid()}.ndjson.gz"
+        self.file = gzip.open(self.path, "wt", encoding="utf-8")
+        self.anonymize = TrafficAnonymizer()
+        self.started = time.monotonic()
+        self.pending: List[str] = []
+        self.recorded = 0
+        self.dropped = 0
+
+    def add(self, record: Dict):
+        if len(self.pending) >= TRAFFIC_MAX_PENDING:
+            self.dropped += 1
+            return
+        record["t"] = round(time.monotonic() - self.started, 4)
+        self.pending.append(json.dumps(record, default=str, separators=(",", ":")))
+
+    def sio(self, event: str, sid: str, data):
+        self.add({"kind": "sio", "event": event, "sid": self.anonymize.digest(sid)[:16], "data": self.anonymize.value(data)})
+
+    def http(self, method: str, path: str, query: str, body, status: int, response, ms: float):
+        params = {k: v for k, v in parse_qsl(query)}
+        self.add({
+            "kind": "http", "method": method,
+            "path": "/".join(self.anonymize.value(part, "code") for part in path.split("/")),
+            "query": self.anonymize.value(params), "body": self.anonymize.value(body),
+            "status": status, "response": self.anonymize.value(response), "ms": round(ms, 2),
+        })
+
+    def write(self, lines: List[str]):
+        self.file.write("\n".join(lines) + "\n")
+        self.file.flush()
+
+    async def flush(self):
+        if not self.pending:
+            return
+        lines, self.pending = self.pending, []
+        # gzip and file I/O stay off the event loop
+        await asyncio.to_thread(self.write, lines)
+        self.recorded += len(lines)
+
+    def close(self):
+        if self.pending:
+            self.write(self.pending)
+            self.recorded += len(self.pending)
+            self.pending = []
+        self.file.close()
+
+traffic_recorder: Optional[TrafficRecorder] = TrafficRecorder(TRAFFIC_RECORD_PATH) if TRAFFIC_RECORD_PATH else None
+
+def parse_recorded_json(chunks: List[bytes], size: int):
+    if not chunks or size > TRAFFIC_MAX_BODY:
+        return None
+    try:
+        return json.loads(b"".join(chunks))
+    except ValueError:
+        return None
+
+class TrafficRecorderMiddleware:
+    """Records REST calls (method, path, query, JSON bodies, status, latency) when recording is on.
+
+    Sits inside CompressionMiddleware so it sees plain response bodies. The
+    (anonymized) response lets the replayer map ids and room codes the server
+    generated during recording onto the ones it generates during replay.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if traffic_recorder is None or scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        
+        request_chunks = []
+        request_size = 0
+        response_chunks = []
+        response_size = 0
+        status = 0
+        
+        async def recording_receive():
+            nonlocal request_size
+            message = await receive()
+            if message["type"] == "http.request" and request_size <= TRAFFIC_MAX_BODY:
+                request_chunks.append(message.get("body", b""))
+                request_size += len(request_chunks[-1])
+            return message
+        
+        async def recording_send(message):
+            nonlocal status, response_size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body" and response_size <= TRAFFIC_MAX_BODY:
+                response_chunks.append(message.get("body", b""))
+                response_size += len(response_chunks[-1])
+            await send(message)
+        
+        started = time.perf_counter()
+        try:
+            await self.app(scope, recording_receive, recording_send)
+        finally:
+            traffic_recorder.http(
+                scope["method"], scope["path"], scope.get("query_string", b"").decode("latin-1"),
+                parse_recorded_json(request_chunks, request_size), status,
+                parse_recorded_json(response_chunks, response_size),
+                (time.perf_counter() - started) * 1000
+            )
+
+async def traffic_recorder_loop():
+    while True:
+        await asyncio.sleep(TRAFFIC_FLUSH_INTERVAL)
+        try:
+            await traffic_recorder.flush()
+        except Exception as e:
+            logger.error(f"Traffic recording failed: {e}")
+
+@metrics_source("traffic_recorder")
+def traffic_recorder_metrics() -> Dict:
+    if traffic_recorder is None:
+        return {"recording": False}
+    return {
+        "recording": True,
+        "path": str(traffic_recorder.path),
+        "recorded": traffic_recorder.recorded,
+        "pending": len(traffic_recorder.pending),
+        "dropped": traffic_recorder.dropped,
+    }
+
+# ==================== OUTBOX ====================
+
+# Side effects that do not belong on the request path (ledgers, notifications,
+# analytics, payment calls) go through the outbox: handlers enqueue a record
+# and return; the outbox loop persists new records to db.outbox in one
+# bulk_write per tick and only then dispatches them, with a concurrency cap,
+# retries with backoff and a lease so another worker can pick up records a
+# crashed worker left behind. Records enqueued within the last tick are lost
+# if the process dies before it persists them.
+#
+# Delivery is at least once: effect handlers get the record key and must be
+# idempotent on it (e.g. upsert with the key as _id).
+OUTBOX_FLUSH_INTERVAL = float(os.environ.get('OUTBOX_FLUSH_INTERVAL', '0.2'))
+OUTBOX_CONCURRENCY = int(os.environ.get('OUTBOX_CONCURRENCY', '16'))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', '8'))
+OUTBOX_HANDLER_TIMEOUT = float(os.environ.get('OUTBOX_HANDLER_TIMEOUT', '10'))
+OUTBOX_LEASE_SECONDS = 60.0        # a record untouched this long may be claimed by another worker
+OUTBOX_RETRY_BASE = 1.0            # s, doubled per attempt
+OUTBOX_RETRY_MAX = 300.0
+OUTBOX_RECOVER_INTERVAL = 30.0
+OUTBOX_RECOVER_BATCH = 200
+OUTBOX_MAX_PENDING = 100000        # enqueued but not yet persisted
+OUTBOX_RETENTION_SECONDS = int(os.environ.get('OUTBOX_RETENTION_SECONDS', '86400'))  # done records; failed ones stay
+
+OUTBOX_WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+outbox_handlers: Dict[str, tuple] = {}     # kind -> (handler, concurrency)
+outbox_pending: List[Dict] = []            # enqueued, not yet persisted
+outbox_scheduled: List[tuple] = []         # heap of (due, seq, record)
+outbox_scheduled_ids: Set[str] = set()     # keys waiting in outbox_scheduled
+outbox_running: Dict[str, asyncio.Task] = {}  # key -> task
+outbox_running_by_kind: Counter = Counter()
+outbox_results: Dict[str, UpdateOne] = {}  # key -> status update for the next flush
+outbox_seq = 0
+outbox_counts = {"enqueued": 0, "persisted": 0, "succeeded": 0, "retried": 0, "failed": 0,
+                 "dropped": 0, "recovered": 0}
+
+def outbox_handler(kind: str, concurrency: Optional[int] = None):
+    """Register handler(payload, key) for a kind of side effect, optionally with its own concurrency cap"""
+    def register(handler):
+        outbox_handlers[kind] = (handler, concurrency or OUTBOX_CONCURRENCY)
+        return handler
+    return register
+
+def enqueue_side_effect(kind: str, payload: Dict, key: Optional[str] = None) -> Optional[str]:
+    """Queue a side effect; returns its idempotency key"""
+    if len(outbox_pending) >= OUTBOX_MAX_PENDING:
+        outbox_counts["dropped"] += 1
+        logger.error(f"Outbox full, dropped {kind}")
+        return None
+    now = datetime.utcnow()
+    record = {
+        "_id": key or uuid.uuid4().hex,
+        "kind": kind,
+        "payload": payload,
+        "status": "pending",
+        "attempts": 0,
+        "created_at": now,
+        "owner": OUTBOX_WORKER_ID,
+        "lease_until": now + timedelta(seconds=OUTBOX_LEASE_SECONDS),
+    }
+    outbox_pending.append(record)
+    outbox_counts["enqueued"] += 1
+    return record["_id"]
+
+def schedule_side_effect(record: Dict, delay: float = 0.0):
+    global outbox_seq
+    outbox_seq += 1
+    heapq.heappush(outbox_scheduled, (time.monotonic() + delay, outbox_seq, record))
+    outbox_scheduled_ids.add(record["_id"])
+
+async def persist_outbox():
+    """Store new records, then make them eligible for dispatch"""
+    if not outbox_pending:
+        return
+    batch = outbox_pending[:]
+    outbox_pending.clear()
+    try:
+        # Upserts keyed by _id: enqueuing the same key twice stores it once
+        await db.outbox.bulk_write([
+            UpdateOne({"_id": record["_id"]}, {"$setOnInsert": {k: v for k, v in record.items() if k != "_id"}}, upsert=True)
+            for record in batch
+        ], ordered=False)
+    except Exception as e:
+        logger.error(f"Persisting {len(batch)} outbox records failed: {e}")
+        outbox_pending[:0] = batch
+        return
+    outbox_counts["persisted"] += len(batch)
+    for record in batch:
+        schedule_side_effect(record)
+
+def retry_delay(attempts: int) -> float:
+    delay = min(OUTBOX_RETRY_BASE * 2 ** (attempts - 1), OUTBOX_RETRY_MAX)
+    return delay * random.uniform(0.8, 1.2)
+
+def record_outcome(record: Dict, update: Dict):
+    # Only the worker holding the lease reports; a worker that lost it stays quiet
+    outbox_results[record["_id"]] = UpdateOne({"_id": record["_id"], "owner": OUTBOX_WORKER_ID}, {"$set": update})
+
+async def run_side_effect(record: Dict):
+    key, kind = record["_id"], record["kind"]
+    handler, _ = outbox_handlers[kind]
+    record["attempts"] += 1
+    try:
+        await asyncio.wait_for(handler(record["payload"], key), OUTBOX_HANDLER_TIMEOUT)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        if record["attempts"] >= OUTBOX_MAX_ATTEMPTS:
+            outbox_counts["failed"] += 1
+            logger.error(f"Outbox {kind} {key} failed after {record['attempts']} attempts: {error}")
+            record_outcome(record, {"status": "failed", "attempts": record["attempts"], "error": error})
+            return
+        delay = retry_delay(record["attempts"])
+        outbox_counts["retried"] += 1
+        record_outcome(record, {
+            "attempts": record["attempts"], "error": error,
+            "lease_until": datetime.utcnow() + timedelta(seconds=delay + OUTBOX_LEASE_SECONDS),
+        })
+        schedule_side_effect(record, delay)
+        return
+    finally:
+        outbox_running.pop(key, None)
+        outbox_running_by_kind[kind] -= 1
+    outbox_counts["succeeded"] += 1
+    record_outcome(record, {"status": "done", "attempts": record["attempts"], "done_at": datetime.utcnow()})
+
+def dispatch_outbox():
+    """Start every due record that fits under the global and per-kind concurrency caps"""
+    now = time.monotonic()
+    deferred = []
+    while outbox_scheduled and outbox_scheduled[0][0] <= now and len(outbox_running) < OUTBOX_CONCURRENCY:
+        item = heapq.heappop(outbox_scheduled)
+        record = item[2]
+        key, kind = record["_id"], record["kind"]
+        outbox_scheduled_ids.discard(key)
+        if key in outbox_running:
+            continue  # recovered while already running here
+        if kind not in outbox_handlers:
+            outbox_counts["failed"] += 1
+            record_outcome(record, {"status": "failed", "error": f"no handler for {kind}"})
+            continue
+        if outbox_running_by_kind[kind] >= outbox_handlers[kind][1]:
+            deferred.append(item)
+            continue
+        outbox_running_by_kind[kind] += 1
+        outbox_running[key] = asyncio.create_task(run_side_effect(record))
+    for item in deferred:
+        heapq.heappush(outbox_scheduled, item)
+        outbox_scheduled_ids.add(item[2]["_id"])
+
+async def flush_outbox_results():
+    if not outbox_results:
+        return
+    updates = list(outbox_results.values())
+    outbox_results.clear()
+    try:
+        await db.outbox.bulk_write(updates, ordered=False)
+    except Exception as e:
+        logger.error(f"Saving {len(updates)} outbox results failed: {e}")
+
+async def flush_outbox():
+    await persist_outbox()
+    dispatch_outbox()
+    await flush_outbox_results()
+
+async def recover_outbox() -> int:
+    """Claim pending records whose lease ran out (their worker died or lost track of them)"""
+    now = datetime.utcnow()
+    stale = await db.outbox.find(
+        {"status": "pending", "lease_until": {"$lt": now}}, {"lease_until": 1}
+    ).to_list(OUTBOX_RECOVER_BATCH)
+    claimed = 0
+    for doc in stale:
+        # Still ours: waiting for its retry or a free slot past the lease
+        if doc["_id"] in outbox_running or doc["_id"] in outbox_scheduled_ids:
+            continue
+        # Guarded by the old lease so only one worker wins each record
+        record = await db.outbox.find_one_and_update(
+            {"_id": doc["_id"], "status": "pending", "lease_until": doc["lease_until"]},
+            {"$set": {"owner": OUTBOX_WORKER_ID, "lease_until": now + timedelta(seconds=OUTBOX_LEASE_SECONDS)}},
+            return_document=True
+        )
+        if record:
+            schedule_side_effect(record)
+            claimed += 1
+    outbox_counts["recovered"] += claimed
+    return claimed
+
+async def outbox_loop():
+    last_recovery = 0.0
+    while True:
+        await asyncio.sleep(OUTBOX_FLUSH_INTERVAL)
+        try:
+            await flush_outbox()
+            if time.monotonic() - last_recovery >= OUTBOX_RECOVER_INTERVAL:
+                last_recovery = time.monotonic()
+                await recover_outbox()
+        except Exception as e:
+            logger.error(f"Outbox tick failed: {e}")
+
+async def drain_outbox(deadline: float):
+    """Persist everything queued and give running side effects until deadline to finish"""
+    await persist_outbox()
+    dispatch_outbox()
+    while outbox_running and time.monotonic() < deadline:
+        await asyncio.wait(list(outbox_running.values()), timeout=max(0.0, deadline - time.monotonic()))
+    await flush_outbox_results()
+
+@metrics_source("outbox")
+def outbox_metrics() -> Dict:
+    return {
+        "pending": len(outbox_pending),
+        "scheduled": len(outbox_scheduled),
+        "running": len(outbox_running),
+        **outbox_counts,
+    }
+
+# --- side effects ---
+
+@outbox_handler("test_event")
+async def store_test_event(payload: Dict, key: str):
+    await db.test_events.update_one({"_id": key}, {"$setOnInsert": payload}, upsert=True)
+
+@outbox_handler("purchase")
+async def record_purchase(payload: Dict, key: str):
+    """Purchase ledger for analytics and support, plus a live notice to the buyer"""
+    await db.purchases.update_one({"_id": key}, {"$setOnInsert": payload}, upsert=True)
+    sid = player_sids.get(payload["user_id"])
+    if sid is not None:
+        await sio.emit('purchase_completed', {
+            'kind': payload["kind"], 'item_id': payload["item_id"]
+        }, to=sid)
+
+# ==================== AUTH ROUTES ====================
+
+@api_router.post("/auth/register")
+async def register(user: UserCreate):
+    # Check if user exists
+    existing = await db.users.find_one({"$or": [{"email": user.email}, {"username": user.username}]})
+    if existing:
+        raise HTTPException(status_code=400, detail="Korisnik vec postoji")
+    
+    # Create user
+    user_doc = {
+        "username": user.username,
+        "email": user.email,
+        "password": await run_hashing(hash_password, user.password),
+        "coins": 100,  # Starting coins
+        "gems": 10,    # Starting gems
+        "is_premium": False,
+        "subscription_type": None,
+        "owned_powers": [],
+        "owned_skins": ["default"],
+        "equipped_skin": "default",
+        "stats": {
+            "games_played": 0,
+            "games_won": 0,
+            "times_frozen": 0,
+            "times_unfrozen_others": 0,
+            "times_as_mraz": 0,
+            "total_play_time": 0,
+            "longest_survival": 0,
+            "xp": 0,
+            "level": 1
+        },
+        "created_at": datetime.utcnow()
+    }
+    
+    result = await db.users.insert_one(user_doc)
+    token = create_token(str(result.inserted_id))
+    
+    return {
+        "token": token,
+        "user": {
+            "id": str(result.inserted_id),
+            "username": user.username,
+            "email": user.email,
+            "coins": user_doc["coins"],
+            "gems": user_doc["gems"],
+            "is_premium": False,
+            "stats": user_doc["stats"]
+        }
+    }
+
+@api_router.post("/auth/login")
+async def login(credentials: UserLogin):
+    doc = await db.users.find_one({"email": credentials.email}, LOGIN_PROJECTION)
+    user = SlimUser(doc) if doc else None
+    if not user or not await run_hashing(verify_password, credentials.password, user.password):
+        raise HTTPException(status_code=401, detail="Pogresni podaci za prijavu")
+    
+    token = create_token(str(user.id))
+    
+    return {
+        "token": token,
+        "user": user.profile()
+    }
+
+@api_router.get("/auth/me")
+async def get_me(token: str):
+    user = await get_current_user(token, PROFILE_PROJECTION)
+    if not user:
+        raise HTTPException(status_code=401, detail="Neautorizovan pristup")
+    
+    return user.profile()
+
+# ==================== GAME ROUTES ====================
+
+DEFAULT_ROOM_SETTINGS = {
+    "freeze_duration": 0,  # 0 = until unfrozen
+    "game_duration": 300,  # 5 minutes
+    "powers_enabled": True
+}
+
+@api_router.post("/rooms/create")
+async def create_room(request: CreateRoomRequest, token: str):
+    user = await get_current_user(token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Neautorizovan pristup")
+    
+    room_code = generate_room_code()
+    room_doc = {
+        "code": room_code,
+        "name": request.name,
+        "host_id": str(user.id),
+        "players": [{
+            "id": str(user.id),
+            "username": user.username,
+            "is_host": True,
+            "is_ready": False,
+            "is_frozen": False,
+            "equipped_skin": user.equipped_skin
+        }],
+        "status": "waiting",
+        "current_mraz": None,
+        "frozen_players": [],
+        "max_players": request.max_players,
+        "is_private": request.is_private,
+        "settings": dict(DEFAULT_ROOM_SETTINGS),
+        "created_at": datetime.utcnow()
+    }
+    
+    result = await db.rooms.insert_one(room_doc)
+    
+    # Create clean response without ObjectId
+    room_response = {
+        "id": str(result.inserted_id),
+        "code": room_code,
+        "name": request.name,
+        "host_id": str(user.id),
+        "players": room_doc["players"],
+        "status": "waiting",
+        "current_mraz": None,
+        "frozen_players": [],
+        "max_players": request.max_players,
+        "is_private": request.is_private,
+        "settings": room_doc["settings"],
+        "created_at": room_doc["created_at"].isoformat()
+    }
+    
+    # Store in active games
+    active_games[room_code] = room_response
+    user_cards.prime(str(user.id), {"username": user.username, "equipped_skin": user.equipped_skin})
+    touch_room(room_code)
+    
+    return {"room": room_response}
+
+@api_router.post("/rooms/join")
+async def join_room(request: JoinRoomRequest, token: str):
+    user = await get_current_user(token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Neautorizovan pristup")
+    
+    room = await db.rooms.find_one({"code": request.room_code.upper(), "status": "waiting"})
+    if not room:
+        raise HTTPException(status_code=404, detail="Soba nije pronadjena ili je igra vec pocela")
+    
+    if len(room["players"]) >= room.get("max_players", 10):
+        raise HTTPException(status_code=400, detail="Soba je puna")
+    
+    # Check if already in room
+    for p in room["players"]:
+        if p["id"] == str(user.id):
+            # Return clean response
+            room_response = {
+                "id": str(room["_id"]),
+                "code": room["code"],
+                "name": room["name"],
+                "host_id": room.get("host_id", ""),
+                "players": room["players"],
+                "status": room["status"],
+                "current_mraz": room.get("current_mraz"),
+                "frozen_players": room.get("frozen_players", []),
+                "max_players": room.get("max_players", 10),
+                "is_private": room.get("is_private", False),
+                "settings": room.get("settings", {}),
+                "created_at": room.get("created_at").isoformat() if room.get("created_at") else None
+            }
+            return {"room": room_response}
+    
+    new_player = {
+        "id": str(user.id),
+        "username": user.username,
+        "is_host": False,
+        "is_ready": False,
+        "is_frozen": False,
+        "equipped_skin": user.equipped_skin
+    }
+    
+    await db.rooms.update_one(
+        {"_id": room["_id"]},
         {"$push": {"players": new_player}}
     )
+    room_reads.forget(room["code"])
     
     # Create clean response
     room_response = {
@@ -506,13 +2051,18 @@ async def join_room(request: JoinRoomRequest, token: str):
     
     # Update active games
     active_games[request.room_code.upper()] = room_response
+    user_cards.prime(str(user.id), {"username": user.username, "equipped_skin": user.equipped_skin})
+    touch_room(request.room_code.upper())
     
     return {"room": room_response}
 
 @api_router.get("/rooms/public")
 async def get_public_rooms():
     try:
-        rooms = await db.rooms.find({"is_private": False, "status": "waiting"}).to_list(20)
+        rooms = await public_room_reads.do(
+            "public",
+            lambda: db.rooms.find({"is_private": False, "status": "waiting"}).to_list(20)
+        )
         
         # Convert ObjectId to string and clean data
         cleaned_rooms = []
@@ -538,7 +2088,8 @@ async def get_public_rooms():
 
 @api_router.get("/rooms/{room_code}")
 async def get_room(room_code: str):
-    room = await db.rooms.find_one({"code": room_code.upper()})
+    code = room_code.upper()
+    room = await room_reads.do(code, lambda: db.rooms.find_one({"code": code}))
     if not room:
         raise HTTPException(status_code=404, detail="Soba nije pronadjena")
     
@@ -559,221 +2110,2485 @@ async def get_room(room_code: str):
         "round_number": room.get("round_number", 0),
         "created_at": room.get("created_at").isoformat() if room.get("created_at") else None,
     }
-    return room_response
+    return room_response
+
+@api_router.get("/rooms/{room_code}/traces")
+async def get_room_traces(room_code: str, round_number: int, token: str):
+    """Recorded positions of every player in one round, for players of that round"""
+    user = await get_current_user(token, {"_id": 1})
+    if not user:
+        raise HTTPException(status_code=401, detail="Neautorizovan pristup")
+    
+    docs = await db.location_traces.find(
+        {"room_code": room_code.upper(), "round_number": round_number}
+    ).to_list(None)
+    if not any(d["player_id"] == str(user.id) for d in docs):
+        raise HTTPException(status_code=404, detail="Putanje nisu pronadjene")
+    
+    traces = {}
+    for doc in docs:
+        trace = decode_trace(doc)
+        traces[doc["player_id"]] = {key: values.tolist() for key, values in trace.items()}
+    return {"room_code": room_code.upper(), "round_number": round_number, "traces": traces}
+
+# ==================== SHOP ROUTES ====================
+
+# Static catalogue responses, rendered once at startup
+catalogue: Dict[str, bytes] = {}
+
+def load_catalogue():
+    catalogue["items"] = JSONResponse({"items": SHOP_ITEMS}).body
+    catalogue["plans"] = JSONResponse({"plans": PREMIUM_FEATURES}).body
+
+@api_router.get("/shop/items")
+async def get_shop_items():
+    if "items" not in catalogue:
+        load_catalogue()
+    return Response(content=catalogue["items"], media_type="application/json")
+
+@api_router.get("/shop/premium")
+async def get_premium_plans():
+    if "plans" not in catalogue:
+        load_catalogue()
+    return Response(content=catalogue["plans"], media_type="application/json")
+
+@api_router.post("/shop/purchase")
+async def purchase_item(request: PurchaseRequest, token: str):
+    user = await get_current_user(token, WALLET_PROJECTION)
+    if not user:
+        raise HTTPException(status_code=401, detail="Neautorizovan pristup")
+    
+    item = next((i for i in SHOP_ITEMS if i["id"] == request.item_id), None)
+    if not item:
+        raise HTTPException(status_code=404, detail="Proizvod nije pronadjen")
+    
+    # Check if already owned
+    if item["type"] == "power" and request.item_id in user.owned_powers:
+        raise HTTPException(status_code=400, detail="Vec posedujete ovu moc")
+    if item["type"] == "skin" and request.item_id in user.owned_skins:
+        raise HTTPException(status_code=400, detail="Vec posedujete ovaj skin")
+    
+    # Check currency
+    if request.currency == "coins":
+        if user.coins < item["price_coins"]:
+            raise HTTPException(status_code=400, detail="Nemate dovoljno novcica")
+        update = {"$inc": {"coins": -item["price_coins"]}}
+    elif request.currency == "gems":
+        if user.gems < item["price_gems"]:
+            raise HTTPException(status_code=400, detail="Nemate dovoljno dragulja")
+        update = {"$inc": {"gems": -item["price_gems"]}}
+    else:
+        # Real money purchase - would integrate with payment gateway
+        update = {}
+    
+    # Add item to inventory
+    if item["type"] == "power":
+        update["$push"] = {"owned_powers": request.item_id}
+    elif item["type"] == "skin":
+        update["$push"] = {"owned_skins": request.item_id}
+    
+    await purchase_db.users.update_one({"_id": user.id}, update)
+    if item["type"] == "power" and str(user.id) in power_inventory:
+        power_inventory[str(user.id)] |= {request.item_id}
+    enqueue_side_effect("purchase", {
+        "user_id": str(user.id),
+        "kind": item["type"],
+        "item_id": request.item_id,
+        "currency": request.currency,
+        "price": item.get(f"price_{request.currency}"),
+        "purchased_at": datetime.utcnow()
+    })
+    
+    return {"success": True, "message": f"Uspesno ste kupili {item['name']}!"}
+
+@api_router.post("/shop/subscribe")
+async def subscribe(request: SubscriptionRequest, token: str):
+    user = await get_current_user(token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Neautorizovan pristup")
+    
+    plan = PREMIUM_FEATURES.get(request.plan)
+    if not plan:
+        raise HTTPException(status_code=404, detail="Plan nije pronadjen")
+    
+    # In real app, the payment gateway call would be an outbox side effect too
+    await purchase_db.users.update_one(
+        {"_id": user.id},
+        {
+            "$set": {
+                "is_premium": True,
+                "subscription_type": request.plan,
+                "subscription_started": datetime.utcnow()
+            }
+        }
+    )
+    enqueue_side_effect("purchase", {
+        "user_id": str(user.id),
+        "kind": "subscription",
+        "item_id": request.plan,
+        "currency": "money",
+        "price": plan.get("price"),
+        "purchased_at": datetime.utcnow()
+    })
+    
+    return {"success": True, "message": f"Uspesno ste aktivirali {request.plan} pretplatu!"}
+
+@api_router.post("/shop/equip-skin")
+async def equip_skin(skin_id: str, token: str):
+    user = await get_current_user(token, SKINS_PROJECTION)
+    if not user:
+        raise HTTPException(status_code=401, detail="Neautorizovan pristup")
+    
+    if skin_id not in user.owned_skins:
+        raise HTTPException(status_code=400, detail="Ne posedujete ovaj skin")
+    
+    await db.users.update_one(
+        {"_id": user.id},
+        {"$set": {"equipped_skin": skin_id}}
+    )
+    user_cards.invalidate(str(user.id))
+    
+    return {"success": True}
+
+# ==================== BLE DEVICE ====================
+
+class BLEDeviceRequest(BaseModel):
+    device_id: str
+    device_name: str
+
+@api_router.post("/ble/save-device")
+async def save_ble_device(request: BLEDeviceRequest, token: str):
+    """Save connected BLE device to user profile"""
+    user = await get_current_user(token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Neautorizovan pristup")
+    
+    await db.users.update_one(
+        {"_id": user.id},
+        {
+            "$set": {
+                "ble_device": {
+                    "device_id": request.device_id,
+                    "device_name": request.device_name,
+                    "connected_at": datetime.utcnow()
+                }
+            }
+        }
+    )
+    if str(user.id) in power_inventory:
+        # Player is in a game on this worker; start matching their new device
+        register_ble_device(str(user.id), request.device_id)
+    
+    return {"success": True, "message": f"Uređaj {request.device_name} je sačuvan"}
+
+@api_router.delete("/ble/remove-device")
+async def remove_ble_device(token: str):
+    """Remove BLE device from user profile"""
+    user = await get_current_user(token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Neautorizovan pristup")
+    
+    await db.users.update_one(
+        {"_id": user.id},
+        {"$unset": {"ble_device": ""}}
+    )
+    forget_ble_device(str(user.id))
+    
+    return {"success": True, "message": "Uređaj je uklonjen"}
+
+@api_router.get("/ble/device")
+async def get_ble_device(token: str):
+    """Get saved BLE device for user"""
+    user = await get_current_user(token, BLE_PROJECTION)
+    if not user:
+        raise HTTPException(status_code=401, detail="Neautorizovan pristup")
+    
+    ble_device = user.ble_device
+    return {"device": ble_device}
+
+# ==================== GAME TEST ====================
+
+@api_router.post("/game/freeze-test")
+async def freeze_test(token: str):
+    """Test freeze functionality - simulates a freeze event"""
+    user = await get_current_user(token, BLE_PROJECTION)
+    if not user:
+        raise HTTPException(status_code=401, detail="Neautorizovan pristup")
+    
+    # Check if user has BLE device connected
+    ble_device = user.ble_device
+    has_ble = ble_device is not None
+    
+    # Log test event
+    test_event = {
+        "user_id": str(user.id),
+        "username": user.username,
+        "event_type": "freeze_test",
+        "has_ble_device": has_ble,
+        "ble_device_id": ble_device.get("device_id") if ble_device else None,
+        "timestamp": datetime.utcnow()
+    }
+    
+    # Stored by the outbox, off the request path
+    enqueue_side_effect("test_event", test_event)
+    
+    return {
+        "success": True,
+        "message": "Test freeze event triggered!",
+        "user": user.username,
+        "has_ble_device": has_ble,
+        "device_name": ble_device.get("device_name") if ble_device else None
+    }
+
+# ==================== LEADERBOARD ====================
+
+def read_leaderboard(stat: str):
+    return ranking_db.users.find({}, leaderboard_projection(stat)).sort(f"stats.{stat}", -1).limit(100).to_list(100)
+
+@api_router.get("/leaderboard")
+async def get_leaderboard(category: str = "xp"):
+    stat = category if category != "wins" else "games_won"
+    docs = await leaderboard_reads.do(stat, lambda: read_leaderboard(stat))
+    users = [SlimUser(doc) for doc in docs]
+    
+    return {
+        "leaderboard": [
+            {
+                "rank": i + 1,
+                "username": u.username,
+                "value": u.stats.get(stat, 0),
+                "level": u.stats.get("level", 1)
+            }
+            for i, u in enumerate(users)
+        ]
+    }
+
+@api_router.get("/leaderboard/seasons/{season}")
+async def get_season_archive(season: str, category: str = "xp"):
+    """Final standings of a past season, e.g. 2026-Q3"""
+    if category not in LEADERBOARD_STATS:
+        raise HTTPException(status_code=400, detail="Nepoznata kategorija")
+    doc = await ranking_db.leaderboard_seasons.find_one({"season": season}, {"_id": 0, f"top.{category}": 1, "archived_at": 1})
+    if not doc:
+        raise HTTPException(status_code=404, detail="Sezona nije pronadjena")
+    return {"season": season, "archived_at": doc["archived_at"].isoformat(), "leaderboard": doc["top"].get(category, [])}
+
+@api_router.get("/leaderboard/{period}")
+async def get_period_leaderboard(period: str, category: str = "xp", key: Optional[str] = None):
+    """Top players of the current (or given) day, week or season"""
+    if period not in LEADERBOARD_PERIODS:
+        raise HTTPException(status_code=404, detail="Nepoznat period")
+    field = LEADERBOARD_STATS.get(category)
+    if field is None:
+        raise HTTPException(status_code=400, detail="Nepoznata kategorija")
+    key = key or period_key(period, datetime.utcnow())
+    docs = await leaderboard_reads.do((period, key, field), lambda: read_period_leaderboard(period, key, field))
+    return {
+        "period": period,
+        "key": key,
+        "leaderboard": [
+            {"rank": i + 1, "user_id": d["user_id"], "username": d.get("username", ""), "value": d.get(field, 0)}
+            for i, d in enumerate(docs)
+        ]
+    }
+
+# ==================== ACHIEVEMENT ROUTES ====================
+
+@api_router.get("/achievements")
+async def get_achievements(token: Optional[str] = None):
+    """All achievements; with a token, also which ones the user has unlocked"""
+    unlocked = []
+    if token:
+        user_id = decode_token(token)
+        doc = await db.users.find_one({"_id": ObjectId(user_id)}, {"achievements": 1}) if user_id else None
+        if not doc:
+            raise HTTPException(status_code=401, detail="Neautorizovan pristup")
+        unlocked = doc.get("achievements", [])
+    return {"achievements": ACHIEVEMENTS, "unlocked": unlocked}
+
+# ==================== STATS ====================
+
+@api_router.get("/stats/{user_id}")
+async def get_user_stats(user_id: str):
+    try:
+        doc = await stats_reads.do(
+            user_id,
+            lambda: ranking_db.users.find_one({"_id": ObjectId(user_id)}, STATS_PROJECTION)
+        )
+    except:
+        raise HTTPException(status_code=400, detail="Neispravan ID korisnika")
+    
+    if not doc:
+        raise HTTPException(status_code=404, detail="Korisnik nije pronadjen")
+    
+    user = SlimUser(doc)
+    return {
+        "username": user.username,
+        "stats": user.stats,
+        "level": user.stats.get("level", 1),
+        "xp": user.stats.get("xp", 0)
+    }
+
+# ==================== XP & LEVELS ====================
+
+XP_PER_ROUND = 10
+XP_PER_SURVIVAL_SECOND = 1
+XP_PER_FREEZE = 15
+XP_PER_UNFREEZE = 20
+XP_PER_WIN = 50
+XP_BOOST_MULTIPLIER = 1.5
+MAX_LEVEL = 100
+
+# LEVEL_THRESHOLDS[i] is the total XP needed to reach level i + 2
+LEVEL_THRESHOLDS = np.cumsum(
+    np.round(100 * np.arange(1, MAX_LEVEL) ** 1.5)
+).astype(np.int64)
+
+# Subscription plans whose features include xp_boost
+XP_BOOST_PLANS = {plan for plan, info in PREMIUM_FEATURES.items() if "xp_boost" in info["features"]}
+
+def levels_for_xp(xp: np.ndarray) -> np.ndarray:
+    """Level for each total XP value, via binary search over the threshold table"""
+    return np.searchsorted(LEVEL_THRESHOLDS, xp, side="right") + 1
+
+def build_round_user_updates(rows: List[Dict], accounts: Dict[str, Dict]):
+    """Aggregate round rows per user and compute XP and levels as one batch.
+
+    Returns the users bulk_write operations, the (room_code, user_id, level)
+    level-ups to announce, and each user's gains for the period leaderboards.
+    """
+    user_ids, inverse = np.unique([row["user_id"] for row in rows], return_inverse=True)
+    n = len(user_ids)
+    
+    def total(key):
+        return np.bincount(inverse, weights=[row[key] for row in rows], minlength=n).astype(np.int64)
+    
+    survival = np.array([row["survival"] for row in rows], dtype=np.int64)
+    play_time = total("play_time")
+    freezes = total("freezes")
+    unfreezes = total("unfreezes")
+    wins = total("won")
+    rounds = np.bincount(inverse, minlength=n)
+    longest = np.zeros(n, dtype=np.int64)
+    np.maximum.at(longest, inverse, survival)
+    survival_total = np.bincount(inverse, weights=survival, minlength=n).astype(np.int64)
+    
+    boost = np.array([
+        XP_BOOST_MULTIPLIER if accounts.get(uid, {}).get("subscription_type") in XP_BOOST_PLANS else 1.0
+        for uid in user_ids
+    ])
+    gained = np.floor((
+        rounds * XP_PER_ROUND
+        + survival_total * XP_PER_SURVIVAL_SECOND
+        + freezes * XP_PER_FREEZE
+        + unfreezes * XP_PER_UNFREEZE
+        + wins * XP_PER_WIN
+    ) * boost).astype(np.int64)
+    
+    current_xp = np.array([accounts.get(uid, {}).get("stats", {}).get("xp", 0) for uid in user_ids], dtype=np.int64)
+    current_level = np.array([accounts.get(uid, {}).get("stats", {}).get("level", 1) for uid in user_ids], dtype=np.int64)
+    new_level = levels_for_xp(current_xp + gained)
+    
+    # Level-ups are announced in the room of the user's latest round
+    last_room = {row["user_id"]: row["room_code"] for row in rows}
+    
+    updates = []
+    level_ups = []
+    gains = {}
+    for i, uid in enumerate(user_ids.tolist()):
+        gains[uid] = {
+            "xp": int(gained[i]), "wins": int(wins[i]), "rounds": int(rounds[i]),
+            "freezes": int(freezes[i]), "unfreezes": int(unfreezes[i]),
+        }
+        inc = {"stats.xp": int(gained[i]), "stats.total_play_time": int(play_time[i])}
+        if wins[i]:
+            inc["stats.games_won"] = int(wins[i])
+            inc["stats.times_as_mraz"] = int(wins[i])
+        updates.append(UpdateOne(
+            {"_id": ObjectId(uid)},
+            {"$inc": inc, "$max": {"stats.longest_survival": int(longest[i]), "stats.level": int(new_level[i])}}
+        ))
+        if new_level[i] > current_level[i]:
+            level_ups.append((last_room[uid], uid, int(new_level[i])))
+    return updates, level_ups, gains
+
+# ==================== PERIOD LEADERBOARDS ====================
+
+# One counter document per user and period bucket. Every round's gains are
+# added to the day, week and season bucket at once, so the longer views are
+# rolled up as they go and never recomputed from history.
+LEADERBOARD_PERIODS = ("day", "week", "season")
+LEADERBOARD_STATS = {"xp": "xp", "wins": "wins", "rounds": "rounds"}  # category -> bucket field
+LEADERBOARD_TOP = 100
+# How long buckets are kept after their period ends; seasons are archived first
+LEADERBOARD_RETENTION = {"day": timedelta(days=14), "week": timedelta(weeks=10), "season": timedelta(days=30)}
+
+def period_key(period: str, at: datetime) -> str:
+    if period == "day":
+        return at.strftime("%Y-%m-%d")
+    if period == "week":
+        year, week, _ = at.isocalendar()
+        return f"{year}-W{week:02d}"
+    return f"{at.year}-Q{(at.month - 1) // 3 + 1}"
+
+def period_end(period: str, at: datetime) -> datetime:
+    start = datetime(at.year, at.month, at.day)
+    if period == "day":
+        return start + timedelta(days=1)
+    if period == "week":
+        return start + timedelta(days=7 - at.weekday())
+    first_month = (at.month - 1) // 3 * 3 + 1
+    return datetime(at.year + (first_month == 10), (first_month + 2) % 12 + 1, 1)
+
+def build_bucket_updates(gains: Dict[str, Dict], usernames: Dict[str, str], at: datetime) -> List[UpdateOne]:
+    updates = []
+    for period in LEADERBOARD_PERIODS:
+        key = period_key(period, at)
+        expires_at = period_end(period, at) + LEADERBOARD_RETENTION[period]
+        for uid, gain in gains.items():
+            fields = {"updated_at": at}
+            if uid in usernames:
+                fields["username"] = usernames[uid]
+            update = {"$inc": gain, "$set": fields, "$setOnInsert": {"expires_at": expires_at}}
+            updates.append(UpdateOne({"period": period, "key": key, "user_id": uid}, update, upsert=True))
+    return updates
+
+def read_period_leaderboard(period: str, key: str, field: str):
+    # Served by the (period, key, field) index: cost depends on LEADERBOARD_TOP only
+    return ranking_db.leaderboard_buckets.find(
+        {"period": period, "key": key},
+        {"_id": 0, "user_id": 1, "username": 1, field: 1}
+    ).sort(field, -1).limit(LEADERBOARD_TOP).to_list(LEADERBOARD_TOP)
+
+current_season = {"key": None}
+
+async def archive_season(season: str) -> bool:
+    """Store the final top of a season as one document; safe to run from every worker"""
+    tops = {}
+    for category, field in LEADERBOARD_STATS.items():
+        docs = await db.leaderboard_buckets.find(
+            {"period": "season", "key": season},
+            {"_id": 0, "user_id": 1, "username": 1, field: 1}
+        ).sort(field, -1).limit(LEADERBOARD_TOP).to_list(LEADERBOARD_TOP)
+        tops[category] = [
+            {"rank": i + 1, "user_id": d["user_id"], "username": d.get("username", ""), "value": d.get(field, 0)}
+            for i, d in enumerate(docs)
+        ]
+    if not any(tops.values()):
+        return False
+    result = await db.leaderboard_seasons.update_one(
+        {"season": season},
+        {"$setOnInsert": {"season": season, "archived_at": datetime.utcnow(), "top": tops}},
+        upsert=True
+    )
+    return result.upserted_id is not None
+
+async def check_season_rollover(at: datetime):
+    season = period_key("season", at)
+    previous = current_season["key"]
+    if previous == season:
+        return
+    current_season["key"] = season
+    if previous is None:
+        # First flush of this worker: the last season may have ended while it was down
+        season_start = datetime(at.year, (at.month - 1) // 3 * 3 + 1, 1)
+        previous = period_key("season", season_start - timedelta(days=1))
+        if await db.leaderboard_seasons.find_one({"season": previous}, {"_id": 1}):
+            return
+    if await archive_season(previous):
+        logger.info(f"Archived leaderboard season {previous}")
+
+
+# ==================== ROUND FINALIZATION ====================
+
+# Per-round bookkeeping kept in memory so that ending a round needs no reads
+round_trackers: Dict[str, Dict] = {}  # room_code -> tracker
+
+# Player rows and room updates waiting for the next batched write
+pending_round_rows: List[Dict] = []
+pending_room_updates: Dict[str, UpdateOne] = {}  # room_code -> status update
+
+ROUND_FLUSH_INTERVAL = float(os.environ.get('ROUND_FLUSH_INTERVAL', '0.5'))
+# Failed writes are retried on later flushes up to this many times, then dropped and logged
+ROUND_FLUSH_MAX_ATTEMPTS = int(os.environ.get('ROUND_FLUSH_MAX_ATTEMPTS', '5'))
+room_update_attempts: Dict[str, int] = {}  # room_code -> failed writes of its queued update
+
+def start_round_tracker(room_code: str, players: List[Dict], mraz_id: str):
+    round_trackers[room_code] = {
+        "started_at": time.time(),
+        "mraz_id": mraz_id,
+        "player_ids": [p["id"] for p in players],
+        "frozen_at": {},   # player_id -> time of the last freeze
+        "freezes": 0,      # freezes made by the Mraz this round
+        "unfreezes": {},   # player_id -> unfreezes made this round
+    }
+    start_trace(room_code)
 
-# ==================== SHOP ROUTES ====================
+def track_freeze(room_code: str, frozen_player_id: str):
+    tracker = round_trackers.get(room_code)
+    if tracker:
+        tracker["frozen_at"][frozen_player_id] = time.time()
+        tracker["freezes"] += 1
 
-@api_router.get("/shop/items")
-async def get_shop_items():
-    return {"items": SHOP_ITEMS}
+def track_unfreeze(room_code: str, frozen_player_id: str, unfreezer_id: Optional[str]):
+    tracker = round_trackers.get(room_code)
+    if tracker:
+        tracker["frozen_at"].pop(frozen_player_id, None)
+        if unfreezer_id is not None:
+            tracker["unfreezes"][unfreezer_id] = tracker["unfreezes"].get(unfreezer_id, 0) + 1
 
-@api_router.get("/shop/premium")
-async def get_premium_plans():
-    return {"plans": PREMIUM_FEATURES}
+def build_round_rows(room: Dict, mraz_id: str) -> List[Dict]:
+    """Per-player results of a finished round, built from in-memory data only"""
+    now = time.time()
+    tracker = round_trackers.pop(room["code"], None)
+    if tracker:
+        started_at = tracker["started_at"]
+        frozen_at = tracker["frozen_at"]
+        freezes = tracker["freezes"]
+        unfreezes = tracker["unfreezes"]
+    else:
+        # Tracker lost (e.g. worker restart) - fall back to the stored start time
+        game_started_at = room.get("game_started_at")
+        started_at = game_started_at.timestamp() if game_started_at else now
+        frozen_at, freezes, unfreezes = {}, 0, {}
+    
+    play_time = max(0, int(now - started_at))
+    rows = []
+    for player in room.get("players", []):
+        player_id = player["id"]
+        is_mraz = player_id == mraz_id
+        survival = 0 if is_mraz else max(0, int(frozen_at.get(player_id, now) - started_at))
+        rows.append({
+            "user_id": player_id,
+            "play_time": play_time,
+            "survival": survival,
+            "freezes": freezes if is_mraz else 0,
+            "unfreezes": unfreezes.get(player_id, 0),
+            "won": is_mraz,
+            "room_code": room["code"],
+            "username": player.get("username"),
+        })
+    return rows
 
-@api_router.post("/shop/purchase")
-async def purchase_item(request: PurchaseRequest, token: str):
-    user = await get_current_user(token)
-    if not user:
-        raise HTTPException(status_code=401, detail="Neautorizovan pristup")
+async def finish_round(room: Dict, mraz_id: str, frozen: List[str], first_frozen: Optional[str]):
+    """Announce the end of a round and queue its writes for the next flush"""
+    room_code = room["code"]
+    round_number = room.get("round_number", 1)
+    winner = next((p for p in room.get("players", []) if p["id"] == mraz_id), None)
     
-    item = next((i for i in SHOP_ITEMS if i["id"] == request.item_id), None)
-    if not item:
-        raise HTTPException(status_code=404, detail="Proizvod nije pronadjen")
+    round_over = {
+        'winner_id': mraz_id,
+        'winner_username': winner["username"] if winner else "Unknown",
+        'frozen_players': frozen,
+        'next_mraz': first_frozen,
+        'round_number': round_number
+    }
+    await sio.emit('round_over', round_over, room=room_code)
+    spectator_event(room_code, 'round_over', round_over)
     
-    # Check if already owned
-    if item["type"] == "power" and request.item_id in user.get("owned_powers", []):
-        raise HTTPException(status_code=400, detail="Vec posedujete ovu moc")
-    if item["type"] == "skin" and request.item_id in user.get("owned_skins", []):
-        raise HTTPException(status_code=400, detail="Vec posedujete ovaj skin")
+    rows = build_round_rows(room, mraz_id)
+    pending_round_rows.extend(row for row in rows if not is_bot(row["user_id"]))
+    for row in rows:
+        publish_game_event("round_finished", room_code=room_code, player_id=row["user_id"],
+                           won=row["won"], survival=row["survival"])
+    finish_trace(room_code, round_number)
+    # Guarded by round number so a restart that lands before the flush is kept
+    pending_room_updates[room_code] = UpdateOne(
+        {"code": room_code, "round_number": round_number},
+        {"$set": {"status": "finished", "finished_at": datetime.utcnow()}}
+    )
+
+def failed_write_indexes(error: Exception, count: int) -> List[int]:
+    """Operations of an unordered bulk_write that did not apply"""
+    if isinstance(error, BulkWriteError):
+        return sorted({e["index"] for e in error.details.get("writeErrors", [])})
+    # Nothing reported per operation (e.g. the connection dropped): retry them all
+    return list(range(count))
+
+def requeue_round_rows(rows: List[Dict]):
+    """Put rows whose write failed back for the next flush, up to ROUND_FLUSH_MAX_ATTEMPTS"""
+    for row in rows:
+        row["attempts"] = row.get("attempts", 0) + 1
+        if row["attempts"] < ROUND_FLUSH_MAX_ATTEMPTS:
+            pending_round_rows.append(row)
+        else:
+            logger.error(f"Dropping round result of {row['user_id']} in {row['room_code']} "
+                         f"after {row['attempts']} failed writes")
+
+def requeue_room_updates(room_updates: Dict[str, UpdateOne]):
+    for room_code, update in room_updates.items():
+        attempts = room_update_attempts.get(room_code, 0) + 1
+        if attempts >= ROUND_FLUSH_MAX_ATTEMPTS:
+            room_update_attempts.pop(room_code, None)
+            logger.error(f"Dropping finish of room {room_code} after {attempts} failed writes")
+            continue
+        # A round that finished since has queued a newer update for the room
+        if room_code not in pending_room_updates:
+            pending_room_updates[room_code] = update
+            room_update_attempts[room_code] = attempts
+
+async def flush_round_results():
+    """Write every queued round result, XP included, with one bulk_write per collection.
+
+    Rows and room updates whose write fails go back on the queue and are
+    retried on the next flush, so a database hiccup delays results instead of
+    losing them.
+    """
+    await flush_traces()
+    if not pending_round_rows and not pending_room_updates:
+        return
+    rows = pending_round_rows[:]
+    room_updates = dict(pending_room_updates)
+    pending_round_rows.clear()
+    pending_room_updates.clear()
     
-    # Check currency
-    if request.currency == "coins":
-        if user.get("coins", 0) < item["price_coins"]:
-            raise HTTPException(status_code=400, detail="Nemate dovoljno novcica")
-        update = {"$inc": {"coins": -item["price_coins"]}}
-    elif request.currency == "gems":
-        if user.get("gems", 0) < item["price_gems"]:
-            raise HTTPException(status_code=400, detail="Nemate dovoljno dragulja")
-        update = {"$inc": {"gems": -item["price_gems"]}}
-    else:
-        # Real money purchase - would integrate with payment gateway
-        update = {}
+    if room_updates:
+        codes = list(room_updates)
+        try:
+            await db.rooms.bulk_write(list(room_updates.values()), ordered=False)
+            failed = []
+        except Exception as e:
+            logger.error(f"Round finalization (rooms) failed: {e}")
+            failed = failed_write_indexes(e, len(codes))
+        failed_codes = {codes[i] for i in failed}
+        for room_code in codes:
+            if room_code not in failed_codes:
+                room_update_attempts.pop(room_code, None)
+            room_reads.forget(room_code)
+        requeue_room_updates({code: room_updates[code] for code in codes if code in failed_codes})
     
-    # Add item to inventory
-    if item["type"] == "power":
-        update["$push"] = {"owned_powers": request.item_id}
-    elif item["type"] == "skin":
-        update["$push"] = {"owned_skins": request.item_id}
+    if not rows:
+        return
+    try:
+        # One read for the XP and subscription of every player in the batch
+        user_ids = list({row["user_id"] for row in rows})
+        accounts = await db.users.find(
+            {"_id": {"$in": [ObjectId(uid) for uid in user_ids]}},
+            {"stats.xp": 1, "stats.level": 1, "subscription_type": 1}
+        ).to_list(len(user_ids))
+        updates, level_ups, gains = build_round_user_updates(rows, {str(a["_id"]): a for a in accounts})
+    except Exception as e:
+        logger.error(f"Round finalization (users) failed for {len(rows)} rows: {e}")
+        requeue_round_rows(rows)
+        return
+    try:
+        await stats_db.users.bulk_write(updates, ordered=False)
+    except Exception as e:
+        # updates follow the order of gains, one per user
+        order = list(gains)
+        failed_users = {order[i] for i in failed_write_indexes(e, len(updates))}
+        logger.error(f"Round finalization (users) failed for {len(failed_users)} of {len(order)} users: {e}")
+        requeue_round_rows([row for row in rows if row["user_id"] in failed_users])
+        gains = {uid: gain for uid, gain in gains.items() if uid not in failed_users}
+        level_ups = [level_up for level_up in level_ups if level_up[1] not in failed_users]
+        if not gains:
+            return
     
-    await db.users.update_one({"_id": user["_id"]}, update)
+    try:
+        now = datetime.utcnow()
+        await check_season_rollover(now)
+        usernames = {row["user_id"]: row["username"] for row in rows if row.get("username")}
+        await stats_db.leaderboard_buckets.bulk_write(build_bucket_updates(gains, usernames, now), ordered=False)
+    except Exception as e:
+        logger.error(f"Round finalization (leaderboards) failed: {e}")
     
-    return {"success": True, "message": f"Uspesno ste kupili {item['name']}!"}
+    for room_code, user_id, level in level_ups:
+        await sio.emit('level_up', {'player_id': user_id, 'level': level}, room=room_code)
 
-@api_router.post("/shop/subscribe")
-async def subscribe(request: SubscriptionRequest, token: str):
-    user = await get_current_user(token)
-    if not user:
-        raise HTTPException(status_code=401, detail="Neautorizovan pristup")
+async def round_finalizer_loop():
+    while True:
+        await asyncio.sleep(ROUND_FLUSH_INTERVAL)
+        await flush_round_results()
+
+# ==================== MATCHMAKING ====================
+
+MATCHMAKING_TICK = float(os.environ.get('MATCHMAKING_TICK', '0.5'))
+MATCHMAKING_LEVEL_BUCKET = 5     # levels per skill bucket
+MATCHMAKING_ROOM_SIZE = 8        # players per room created by matchmaking
+MATCHMAKING_MIN_PLAYERS = 2      # smallest group that gets a new room
+MATCHMAKING_ROOM_SCAN = 200      # open public rooms considered per tick
+
+PRIORITY_LANE = 0
+REGULAR_LANE = 1
+
+# Subscription plans whose features include priority_matching
+PRIORITY_MATCHING_PLANS = {plan for plan, info in PREMIUM_FEATURES.items() if "priority_matching" in info["features"]}
+
+# (bucket, lane) -> heap of (enqueued_at, seq, player_id); removals are lazy
+matchmaking_queues: Dict[tuple, List[tuple]] = {}
+matchmaking_entries: Dict[str, Dict] = {}  # player_id -> queue entry
+matchmaking_bucket_sizes: Dict[int, int] = {}  # bucket -> live entries
+matchmaking_seq = 0
+
+def matchmaking_bucket(level: int) -> int:
+    return max(0, level - 1) // MATCHMAKING_LEVEL_BUCKET
+
+def enqueue_player(player_id: str, sid: str, user: SlimUser) -> Dict:
+    """Put a player in the queue of their skill bucket, O(log n)"""
+    global matchmaking_seq
+    dequeue_player(player_id)
+    matchmaking_seq += 1
+    entry = {
+        "player_id": player_id,
+        "sid": sid,
+        "username": user.username,
+        "equipped_skin": user.equipped_skin,
+        "bucket": matchmaking_bucket(user.stats.get("level", 1)),
+        "lane": PRIORITY_LANE if user.subscription_type in PRIORITY_MATCHING_PLANS else REGULAR_LANE,
+        "seq": matchmaking_seq,
+        "enqueued_at": time.time(),
+    }
+    matchmaking_entries[player_id] = entry
+    matchmaking_bucket_sizes[entry["bucket"]] = matchmaking_bucket_sizes.get(entry["bucket"], 0) + 1
+    heapq.heappush(
+        matchmaking_queues.setdefault((entry["bucket"], entry["lane"]), []),
+        (entry["enqueued_at"], entry["seq"], player_id)
+    )
+    return entry
+
+def dequeue_player(player_id: str) -> Optional[Dict]:
+    """Remove a player from the queue; the stale heap item is skipped on pop"""
+    entry = matchmaking_entries.pop(player_id, None)
+    if entry:
+        matchmaking_bucket_sizes[entry["bucket"]] -= 1
+    return entry
+
+def pop_queued_players(bucket: Optional[int], count: int) -> List[Dict]:
+    """Pop up to count players, priority lane first, oldest first within a lane.
+
+    bucket=None takes players from any bucket, lowest bucket first.
+    """
+    buckets = [bucket] if bucket is not None else sorted({b for b, _ in matchmaking_queues})
+    popped = []
+    for lane in (PRIORITY_LANE, REGULAR_LANE):
+        for b in buckets:
+            heap = matchmaking_queues.get((b, lane))
+            while heap and len(popped) < count:
+                _, seq, player_id = heapq.heappop(heap)
+                entry = matchmaking_entries.get(player_id)
+                if entry and entry["seq"] == seq:
+                    dequeue_player(player_id)
+                    popped.append(entry)
+            if heap is not None and not heap:
+                del matchmaking_queues[(b, lane)]
+    return popped
+
+def requeue_players(entries: List[Dict]):
+    """Put popped players back at their original place when their room could not be written"""
+    for entry in entries:
+        player_id = entry["player_id"]
+        # Re-joined meanwhile, or gone: nobody to match
+        if player_id in matchmaking_entries or not sio.manager.is_connected(entry["sid"], "/"):
+            continue
+        matchmaking_entries[player_id] = entry
+        matchmaking_bucket_sizes[entry["bucket"]] = matchmaking_bucket_sizes.get(entry["bucket"], 0) + 1
+        heapq.heappush(
+            matchmaking_queues.setdefault((entry["bucket"], entry["lane"]), []),
+            (entry["enqueued_at"], entry["seq"], player_id)
+        )
+
+def matchmaking_player(entry: Dict, is_host: bool = False) -> Dict:
+    return {
+        "id": entry["player_id"],
+        "username": entry["username"],
+        "is_host": is_host,
+        "is_ready": False,
+        "is_frozen": False,
+        "equipped_skin": entry["equipped_skin"]
+    }
+
+async def notify_matched(entries: List[Dict], room_code: str):
+    for entry in entries:
+        await sio.emit('matchmaking', {
+            'status': 'matched',
+            'room_code': room_code,
+            'wait_time': round(time.time() - entry["enqueued_at"], 2)
+        }, to=entry["sid"])
+
+async def run_matchmaking_tick():
+    """Match everyone currently queued: fill open public rooms, then create new ones"""
+    if not matchmaking_entries or draining:
+        return
     
-    plan = PREMIUM_FEATURES.get(request.plan)
-    if not plan:
-        raise HTTPException(status_code=404, detail="Plan nije pronadjen")
+    # Fill existing public rooms first, one update per room
+    open_rooms = await db.rooms.find(
+        {"is_private": False, "status": "waiting"},
+        {"code": 1, "players": 1, "max_players": 1, "matchmaking_bucket": 1}
+    ).to_list(MATCHMAKING_ROOM_SCAN)
+    for room in open_rooms:
+        free = room.get("max_players", 10) - len(room.get("players", []))
+        if free <= 0:
+            continue
+        entries = pop_queued_players(room.get("matchmaking_bucket"), free)
+        if not entries:
+            continue
+        new_players = [matchmaking_player(e) for e in entries]
+        try:
+            # Guarded by the room size: join_room may have taken the seats since the scan
+            result = await db.rooms.update_one(
+                {"_id": room["_id"], "status": "waiting",
+                 "$expr": {"$lte": [{"$add": [{"$size": "$players"}, len(new_players)]}, "$max_players"]}},
+                {"$push": {"players": {"$each": new_players}}}
+            )
+        except Exception:
+            requeue_players(entries)
+            raise
+        room_reads.forget(room["code"])
+        if result.matched_count == 0:
+            requeue_players(entries)
+            continue
+        if room["code"] in active_games:
+            active_games[room["code"]]["players"] = room.get("players", []) + new_players
+        await notify_matched(entries, room["code"])
+        if not matchmaking_entries:
+            return
     
-    # In real app, integrate with payment gateway here
-    await db.users.update_one(
-        {"_id": user["_id"]},
-        {
-            "$set": {
-                "is_premium": True,
-                "subscription_type": request.plan,
-                "subscription_started": datetime.utcnow()
-            }
-        }
-    )
+    # Group the rest into new rooms per skill bucket, with one insert per tick
+    new_rooms = []
+    for bucket in sorted({b for b, _ in matchmaking_queues}):
+        while matchmaking_bucket_sizes.get(bucket, 0) >= MATCHMAKING_MIN_PLAYERS:
+            entries = pop_queued_players(bucket, MATCHMAKING_ROOM_SIZE)
+            host = entries[0]
+            new_rooms.append((entries, {
+                "code": generate_room_code(),
+                "name": f"Quick Play {host['username']}",
+                "host_id": host["player_id"],
+                "players": [matchmaking_player(e, is_host=(e is host)) for e in entries],
+                "status": "waiting",
+                "current_mraz": None,
+                "frozen_players": [],
+                "max_players": MATCHMAKING_ROOM_SIZE,
+                "is_private": False,
+                "matchmaking_bucket": bucket,
+                "settings": dict(DEFAULT_ROOM_SETTINGS),
+                "created_at": datetime.utcnow()
+            }))
+    if not new_rooms:
+        return
     
-    return {"success": True, "message": f"Uspesno ste aktivirali {request.plan} pretplatu!"}
+    try:
+        await db.rooms.insert_many([doc for _, doc in new_rooms])
+    except Exception as e:
+        # Ordered insert: the rooms before the failing one were written
+        inserted = e.details.get("nInserted", 0) if isinstance(e, BulkWriteError) else 0
+        logger.error(f"Creating {len(new_rooms) - inserted} matchmaking rooms failed: {e}")
+        for entries, _ in new_rooms[inserted:]:
+            requeue_players(entries)
+        new_rooms = new_rooms[:inserted]
+    for entries, doc in new_rooms:
+        active_games[doc["code"]] = {
+            "id": str(doc["_id"]),
+            "code": doc["code"],
+            "name": doc["name"],
+            "host_id": doc["host_id"],
+            "players": doc["players"],
+            "status": "waiting",
+            "current_mraz": None,
+            "frozen_players": [],
+            "max_players": doc["max_players"],
+            "is_private": False,
+            "settings": doc["settings"],
+            "created_at": doc["created_at"].isoformat()
+        }
+        touch_room(doc["code"])
+        await notify_matched(entries, doc["code"])
 
-@api_router.post("/shop/equip-skin")
-async def equip_skin(skin_id: str, token: str):
-    user = await get_current_user(token)
-    if not user:
-        raise HTTPException(status_code=401, detail="Neautorizovan pristup")
+@metrics_source("matchmaking")
+def matchmaking_metrics() -> Dict:
+    return {
+        "queued": len(matchmaking_entries),
+        "by_bucket": {str(b): n for b, n in matchmaking_bucket_sizes.items() if n},
+    }
+
+async def matchmaking_loop():
+    while True:
+        await asyncio.sleep(MATCHMAKING_TICK)
+        try:
+            await run_matchmaking_tick()
+        except Exception as e:
+            logger.error(f"Matchmaking tick failed: {e}")
+
+# ==================== ROOM LIFECYCLE ====================
+
+ROOM_SWEEP_INTERVAL = float(os.environ.get('ROOM_SWEEP_INTERVAL', '60'))
+ROOM_IDLE_EVICT_SECONDS = int(os.environ.get('ROOM_IDLE_EVICT_SECONDS', '600'))
+ROOM_ARCHIVE_AFTER_SECONDS = int(os.environ.get('ROOM_ARCHIVE_AFTER_SECONDS', '600'))
+ROOM_ABANDONED_AFTER_SECONDS = int(os.environ.get('ROOM_ABANDONED_AFTER_SECONDS', '21600'))
+# Backstop: finished rooms the sweeper never archived expire from db.rooms
+ROOM_FINISHED_TTL_SECONDS = int(os.environ.get('ROOM_FINISHED_TTL_SECONDS', '86400'))
+ROOM_ARCHIVE_BATCH = 500
+
+room_counts_by_status: Dict[str, int] = {}
+rooms_archived_total = 0
+rooms_evicted_total = 0
+
+def touch_room(room_code: str):
+    room_activity[room_code] = time.time()
+
+def add_room_sid(room_code: str, sid: str):
+    room_sids.setdefault(room_code, set()).add(sid)
+    sid_rooms.setdefault(sid, set()).add(room_code)
+    touch_room(room_code)
+
+def remove_room_sid(room_code: str, sid: str):
+    sids = room_sids.get(room_code)
+    if sids is not None:
+        sids.discard(sid)
+        if not sids:
+            del room_sids[room_code]
+    codes = sid_rooms.get(sid)
+    if codes is not None:
+        codes.discard(room_code)
+        if not codes:
+            del sid_rooms[sid]
+    touch_room(room_code)
+
+def has_humans(room_code: str) -> bool:
+    """Whether a player is connected to the room on this worker; bots hold fake sids"""
+    return any(not sid.startswith(BOT_SID_PREFIX) for sid in room_sids.get(room_code, ()))
+
+async def ensure_indexes():
+    await db.rooms.create_index("code")
+    await db.rooms.create_index([("is_private", 1), ("status", 1)])
+    await db.rooms.create_index("finished_at", expireAfterSeconds=ROOM_FINISHED_TTL_SECONDS)
+    await db.room_history.create_index("finished_at")
+    # One history row per room, however many sweepers copy it; older rows have no room_id
+    await db.room_history.create_index("room_id", unique=True, partialFilterExpression={"room_id": {"$exists": True}})
+    await db.location_traces.create_index([("room_code", 1), ("round_number", 1)])
+    await db.leaderboard_buckets.create_index([("period", 1), ("key", 1), ("user_id", 1)], unique=True)
+    for field in LEADERBOARD_STATS.values():
+        await db.leaderboard_buckets.create_index([("period", 1), ("key", 1), (field, -1)])
+    await db.leaderboard_buckets.create_index("expires_at", expireAfterSeconds=0)
+    await db.leaderboard_seasons.create_index("season", unique=True)
+    await db.outbox.create_index([("status", 1), ("lease_until", 1)])
+    await db.outbox.create_index("done_at", expireAfterSeconds=OUTBOX_RETENTION_SECONDS)
+    # Incremental exports by creation time
+    await db.users.create_index("created_at")
+    await db.rooms.create_index("created_at")
+
+async def forget_room(code: str):
+    """Drop every piece of in-process state kept for a room"""
+    bot_room = bot_rooms.pop(code, None)
+    if bot_room is not None:
+        for bot_id in bot_room.ids:
+            bot_players.pop(bot_id, None)
+            player_connections.pop(bot_sid(bot_id), None)
+            remove_room_sid(code, bot_sid(bot_id))
+    active_games.pop(code, None)
+    round_trackers.pop(code, None)
+    room_activity.pop(code, None)
+    rssi_rooms.pop(code, None)
+    movement_rooms.pop(code, None)
+    trace_buffers.pop(code, None)
+    for sid in spectator_sids.pop(code, ()):
+        sid_spectating.pop(sid, None)
+    spectator_events.pop(code, None)
+    spectator_sends.pop(code, None)
+    await sio.close_room(spectator_room(code))
+    room_reads.forget(code)
+    public_room_reads.forget("public")
+
+async def evict_idle_rooms() -> int:
+    """Drop in-memory state of rooms without connected players for a while"""
+    global rooms_evicted_total
+    cutoff = time.time() - ROOM_IDLE_EVICT_SECONDS
+    known = set(active_games) | set(round_trackers) | set(room_activity) | set(bot_rooms) | set(spectator_sids)
+    idle = [
+        code for code in known
+        if not has_humans(code) and room_activity.get(code, 0) < cutoff
+    ]
+    for code in idle:
+        await forget_room(code)
+    rooms_evicted_total += len(idle)
+    return len(idle)
+
+def compact_room(room: Dict, outcome: str) -> Dict:
+    return {
+        "code": room.get("code"),
+        "name": room.get("name"),
+        "host_id": room.get("host_id"),
+        "player_ids": [p["id"] for p in room.get("players", [])],
+        "rounds": room.get("round_number", 0),
+        "outcome": outcome,
+        "created_at": room.get("created_at"),
+        "finished_at": room.get("finished_at") or datetime.utcnow()
+    }
+
+async def archive_rooms() -> int:
+    """Move finished and abandoned rooms from db.rooms into db.room_history"""
+    global rooms_archived_total
+    now = datetime.utcnow()
+    query = {"$or": [
+        {"status": "finished", "finished_at": {"$lt": now - timedelta(seconds=ROOM_ARCHIVE_AFTER_SECONDS)}},
+        {"status": "waiting", "created_at": {"$lt": now - timedelta(seconds=ROOM_ABANDONED_AFTER_SECONDS)}}
+    ]}
+    rooms = await db.rooms.find(
+        query,
+        {"code": 1, "name": 1, "host_id": 1, "players.id": 1, "round_number": 1,
+         "status": 1, "created_at": 1, "finished_at": 1}
+    ).to_list(ROOM_ARCHIVE_BATCH)
+    # Rooms someone is still connected to on this worker stay put
+    rooms = [r for r in rooms if not has_humans(r.get("code"))]
+    if not rooms:
+        return 0
     
-    if skin_id not in user.get("owned_skins", ["default"]):
-        raise HTTPException(status_code=400, detail="Ne posedujete ovaj skin")
+    # Upserted by the room's _id, so an overlapping sweep or a rerun after a
+    # crash between the copy and the delete finds the row already there
+    await db.room_history.bulk_write([
+        UpdateOne(
+            {"room_id": r["_id"]},
+            {"$setOnInsert": compact_room(r, "finished" if r["status"] == "finished" else "abandoned")},
+            upsert=True
+        )
+        for r in rooms
+    ], ordered=False)
+    await db.rooms.delete_many({"_id": {"$in": [r["_id"] for r in rooms]}})
+    for r in rooms:
+        await forget_room(r.get("code"))
+    rooms_archived_total += len(rooms)
+    return len(rooms)
+
+async def refresh_room_counts():
+    counts = await db.rooms.aggregate([
+        {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+    ]).to_list(None)
+    room_counts_by_status.clear()
+    room_counts_by_status.update({c["_id"] or "unknown": c["count"] for c in counts})
+
+async def room_sweeper_loop():
+    while True:
+        await asyncio.sleep(ROOM_SWEEP_INTERVAL)
+        try:
+            await evict_idle_rooms()
+            await archive_rooms()
+            await refresh_room_counts()
+        except Exception as e:
+            logger.error(f"Room sweep failed: {e}")
+
+@metrics_source("rooms")
+def room_metrics() -> Dict:
+    return {
+        "by_status": dict(room_counts_by_status),
+        "in_memory": len(active_games),
+        "with_connections": len(room_sids),
+        "round_trackers": len(round_trackers),
+        "archived_total": rooms_archived_total,
+        "evicted_total": rooms_evicted_total,
+    }
+
+# ==================== POWER ENGINE ====================
+
+# Seconds before the same player can use a power again
+POWER_COOLDOWNS = {
+    "super_freeze": 30,
+    "ultra_thaw": 45,
+    "shield": 40,
+    "second_chance": 30,
+    "ghost_mode": 60,
+}
+DEFAULT_POWER_COOLDOWN = 30
+# How long a one-shot power stays armed before it is wasted
+ARMED_POWER_SECONDS = 60
+
+def build_power_effects() -> Dict[str, tuple]:
+    """power_id -> (effect kind, effect value, seconds active, cooldown)"""
+    effects = {}
+    for item in SHOP_ITEMS:
+        if item["type"] != "power":
+            continue
+        kind, value = next((k, v) for k, v in item["effect"].items() if k != "instant")
+        # Timed effects last for their value; one-shot effects stay armed until used
+        active = value if kind in ("immunity", "ghost") else ARMED_POWER_SECONDS
+        effects[item["id"]] = (kind, value, active, POWER_COOLDOWNS.get(item["id"], DEFAULT_POWER_COOLDOWN))
+    return effects
+
+POWER_EFFECTS = build_power_effects()
+
+power_inventory: Dict[str, frozenset] = {}  # player_id -> owned power ids
+active_effects: Dict[str, Dict[str, tuple]] = {}  # player_id -> effect kind -> (expires_at, power_id)
+power_cooldowns: Dict[str, Dict[str, float]] = {}  # player_id -> power_id -> ready_at
+powers_used_total = 0
+powers_rejected_total = 0
+
+async def load_game_profile(player_id: str):
+    """Cache a player's owned powers, BLE device and achievement progress; called once when they join a game"""
+    try:
+        doc = await db.users.find_one(
+            {"_id": ObjectId(player_id)},
+            {"owned_powers": 1, "ble_device.device_id": 1, **ACHIEVEMENT_PROJECTION}
+        )
+    except Exception:
+        doc = None
+    doc = doc or {}
+    power_inventory[player_id] = frozenset(doc.get("owned_powers", []))
+    device_id = (doc.get("ble_device") or {}).get("device_id")
+    if device_id:
+        register_ble_device(player_id, device_id)
+    if doc:
+        load_achievements(player_id, doc)
+
+def activate_power(player_id: str, power_id: str) -> Optional[str]:
+    """Apply a power for a player; returns the rejection reason, or None on success"""
+    global powers_used_total, powers_rejected_total
+    effect = POWER_EFFECTS.get(power_id)
+    if effect is None:
+        reason = "unknown_power"
+    elif power_id not in power_inventory.get(player_id, ()):
+        reason = "not_owned"
+    elif power_cooldowns.get(player_id, {}).get(power_id, 0) > time.monotonic():
+        reason = "cooldown"
+    else:
+        reason = None
+    if reason:
+        powers_rejected_total += 1
+        return reason
     
-    await db.users.update_one(
-        {"_id": user["_id"]},
-        {"$set": {"equipped_skin": skin_id}}
+    kind, _, active_for, cooldown = effect
+    now = time.monotonic()
+    active_effects.setdefault(player_id, {})[kind] = (now + active_for, power_id)
+    power_cooldowns.setdefault(player_id, {})[power_id] = now + cooldown
+    powers_used_total += 1
+    return None
+
+def effect_active(player_id: str, kind: str) -> bool:
+    effects = active_effects.get(player_id)
+    if not effects or kind not in effects:
+        return False
+    if effects[kind][0] <= time.monotonic():
+        del effects[kind]
+        return False
+    return True
+
+def consume_effect(player_id: str, kind: str) -> bool:
+    """Use up an armed one-shot effect; True if it was active"""
+    if effect_active(player_id, kind):
+        del active_effects[player_id][kind]
+        return True
+    return False
+
+def freeze_protection(player_id: str) -> Optional[str]:
+    """Why a player cannot be frozen right now (shield, ghost, second chance), if at all"""
+    if effect_active(player_id, "immunity"):
+        return "shield"
+    if effect_active(player_id, "ghost"):
+        return "ghost_mode"
+    if consume_effect(player_id, "escape_time"):
+        # The touch is forgiven and the player gets a short window to run
+        _, escape_seconds, _, _ = POWER_EFFECTS["second_chance"]
+        active_effects[player_id]["immunity"] = (time.monotonic() + escape_seconds, "second_chance")
+        return "second_chance"
+    return None
+
+def forget_player_powers(player_id: str):
+    power_inventory.pop(player_id, None)
+    active_effects.pop(player_id, None)
+    power_cooldowns.pop(player_id, None)
+
+async def auto_thaw(room_code: str, player_id: str, delay: float):
+    await asyncio.sleep(delay)
+    await thaw_player(room_code, player_id, None)
+
+@metrics_source("powers")
+def power_metrics() -> Dict:
+    return {
+        "players_cached": len(power_inventory),
+        "players_with_effects": sum(1 for effects in active_effects.values() if effects),
+        "used_total": powers_used_total,
+        "rejected_total": powers_rejected_total,
+    }
+
+# ==================== EVENT SCHEMAS ====================
+
+# Constraints attached to payload fields with Annotated[type, constraint]
+class Pattern:
+    def __init__(self, regex: str):
+        self.match = re.compile(regex).fullmatch
+
+class Range:
+    def __init__(self, low: float, high: float):
+        self.low = low
+        self.high = high
+
+RoomCode = Annotated[str, Pattern(r"[A-Z0-9]{4,12}")]
+PlayerId = Annotated[str, Pattern(r"[0-9a-f]{24}")]
+PowerId = Annotated[str, Pattern(r"[a-z_]{1,32}")]
+Token = Annotated[str, Pattern(r"[\w-]{1,512}\.[\w-]{1,1024}\.[\w-]{1,512}")]
+Latitude = Annotated[float, Range(-90.0, 90.0)]
+Longitude = Annotated[float, Range(-180.0, 180.0)]
+
+_MISSING = object()
+
+def compile_field(annotation) -> Callable[[Any], Any]:
+    """Build a checker returning the accepted value or _MISSING"""
+    constraint = None
+    if get_origin(annotation) is Annotated:
+        annotation, constraint = get_args(annotation)[:2]
+    if get_origin(annotation) is Union:
+        inner = compile_field(next(a for a in get_args(annotation) if a is not type(None)))
+        return lambda value: None if value is None else inner(value)
+    if get_origin(annotation) in (list, List):
+        item = compile_field(get_args(annotation)[0])
+        limit = constraint.high if isinstance(constraint, Range) else None
+        def check_list(value):
+            if type(value) is not list or (limit is not None and len(value) > limit):
+                return _MISSING
+            items = [item(v) for v in value]
+            return _MISSING if _MISSING in items else items
+        return check_list
+    if annotation is float:
+        low, high = (constraint.low, constraint.high) if isinstance(constraint, Range) else (-math.inf, math.inf)
+        def check_float(value):
+            # bool is an int subclass, but true/false is never a coordinate
+            if type(value) not in (int, float):
+                return _MISSING
+            return float(value) if low <= value <= high else _MISSING
+        return check_float
+    if annotation is int:
+        low, high = (constraint.low, constraint.high) if isinstance(constraint, Range) else (-math.inf, math.inf)
+        return lambda value: value if type(value) is int and low <= value <= high else _MISSING
+    if annotation is bool:
+        return lambda value: value if type(value) is bool else _MISSING
+    if annotation is str:
+        if isinstance(constraint, Pattern):
+            match = constraint.match
+            return lambda value: value if type(value) is str and match(value) else _MISSING
+        return lambda value: value if type(value) is str and len(value) <= 256 else _MISSING
+    raise TypeError(f"Unsupported payload field type: {annotation}")
+
+def compile_decoder(schema) -> Callable[[Any], Any]:
+    """Compile a NamedTuple schema into a decoder returning an instance, or None if invalid"""
+    hints = get_type_hints(schema, include_extras=True)
+    fields = tuple(
+        (name, compile_field(hints[name]), schema._field_defaults.get(name, _MISSING))
+        for name in schema._fields
     )
+    make = schema._make
     
-    return {"success": True}
+    def decode(data):
+        if type(data) is not dict:
+            return None
+        values = []
+        for name, check, default in fields:
+            raw = data.get(name, _MISSING)
+            if raw is _MISSING:
+                if default is _MISSING:
+                    return None
+                values.append(default)
+                continue
+            value = check(raw)
+            if value is _MISSING:
+                return None
+            values.append(value)
+        return make(values)
+    return decode
 
-# ==================== BLE DEVICE ====================
+class RoomEvent(NamedTuple):
+    room_code: RoomCode
 
-class BLEDeviceRequest(BaseModel):
-    device_id: str
-    device_name: str
+class SpectateEvent(NamedTuple):
+    room_code: RoomCode
+    token: Token
 
-@api_router.post("/ble/save-device")
-async def save_ble_device(request: BLEDeviceRequest, token: str):
-    """Save connected BLE device to user profile"""
-    user = await get_current_user(token)
-    if not user:
-        raise HTTPException(status_code=401, detail="Neautorizovan pristup")
-    
-    await db.users.update_one(
-        {"_id": user["_id"]},
-        {
-            "$set": {
-                "ble_device": {
-                    "device_id": request.device_id,
-                    "device_name": request.device_name,
-                    "connected_at": datetime.utcnow()
-                }
-            }
-        }
-    )
+class PlayerEvent(NamedTuple):
+    player_id: PlayerId
+
+class AuthPlayerEvent(NamedTuple):
+    player_id: PlayerId
+    token: Token
+
+class JoinGameEvent(NamedTuple):
+    room_code: RoomCode
+    player_id: PlayerId
+    token: Token
+
+class LeaveGameEvent(NamedTuple):
+    room_code: RoomCode
+    player_id: Optional[PlayerId] = None
+
+class PlayerReadyEvent(NamedTuple):
+    room_code: RoomCode
+    player_id: PlayerId
+    is_ready: bool = True
+
+class FreezePlayerEvent(NamedTuple):
+    room_code: RoomCode
+    frozen_player_id: PlayerId
+    mraz_id: PlayerId
+
+class UnfreezePlayerEvent(NamedTuple):
+    room_code: RoomCode
+    frozen_player_id: PlayerId
+    unfreezer_id: PlayerId
+
+class UsePowerEvent(NamedTuple):
+    room_code: RoomCode
+    player_id: PlayerId
+    power_id: PowerId
+
+class ProximityEvent(NamedTuple):
+    room_code: RoomCode
+    player1_id: PlayerId
+    player2_id: PlayerId
+
+DeviceId = Annotated[str, Pattern(r"[0-9A-Za-z:\-]{1,64}")]
+Rssi = Annotated[float, Range(-127.0, 20.0)]
+
+class RssiSamplesEvent(NamedTuple):
+    room_code: RoomCode
+    player_id: PlayerId
+    device_ids: Annotated[List[DeviceId], Range(1, 64)]
+    rssi: Annotated[List[Rssi], Range(1, 64)]
+
+class LocationEvent(NamedTuple):
+    room_code: RoomCode
+    player_id: PlayerId
+    latitude: Latitude
+    longitude: Longitude
+
+# event name -> payload schema, for every validated socket event
+event_schemas: Dict[str, type] = {}
+rejected_events: Dict[str, int] = {}
+
+def sio_event(schema):
+    """Register a Socket.IO handler whose payload is decoded with `schema` first.
+
+    Malformed payloads are dropped before the handler runs; the handler gets
+    the typed NamedTuple instead of the raw dict.
+    """
+    decode = compile_decoder(schema)
     
-    return {"success": True, "message": f"Uređaj {request.device_name} je sačuvan"}
+    def register(handler):
+        name = handler.__name__
+        
+        async def dispatch(sid, data=None):
+            if traffic_recorder is not None and not sid.startswith(BOT_SID_PREFIX):
+                traffic_recorder.sio(name, sid, data)
+            event = decode(data)
+            if event is None:
+                rejected_events[name] = rejected_events.get(name, 0) + 1
+                logger.debug(f"Rejected malformed {name} payload from {sid}")
+                return
+            if slow_handler_threshold <= 0:
+                return await handler(sid, event)
+            return await timed_steps(handler(sid, event), lambda: (name, payload_size(data)))
+        
+        dispatch.__name__ = name
+        dispatch.__doc__ = handler.__doc__
+        dispatch.__wrapped__ = handler
+        event_schemas[name] = schema
+        sio.on(name, dispatch)
+        return dispatch
+    return register
+
+@metrics_source("events")
+def event_metrics() -> Dict:
+    return {"schemas": len(event_schemas), "rejected": dict(rejected_events)}
+
+# ==================== BLE PROXIMITY ====================
+
+RSSI_TICK = float(os.environ.get('RSSI_TICK', '0.2'))
+RSSI_NEAR_DBM = float(os.environ.get('RSSI_NEAR_DBM', '-65'))   # enter proximity at or above
+RSSI_FAR_DBM = float(os.environ.get('RSSI_FAR_DBM', '-75'))     # leave proximity at or below
+RSSI_STALE_SECONDS = 5.0
+RSSI_PROCESS_NOISE = 2.0       # dBm^2 added per tick: how fast the true signal can drift
+RSSI_MEASUREMENT_NOISE = 16.0  # dBm^2: variance of a single raw sample
+RSSI_MAX_PENDING = 4096        # samples buffered per room between ticks
+RSSI_MAX_PLAYERS = 64
+
+ble_devices: Dict[str, str] = {}  # device_id -> player_id
+player_devices: Dict[str, str] = {}  # player_id -> device_id
+
+def register_ble_device(player_id: str, device_id: str):
+    forget_ble_device(player_id)
+    ble_devices[device_id] = player_id
+    player_devices[player_id] = device_id
+
+def forget_ble_device(player_id: str):
+    device_id = player_devices.pop(player_id, None)
+    if device_id is not None and ble_devices.get(device_id) == player_id:
+        del ble_devices[device_id]
+
+class RssiRoom:
+    """Per-room signal state: one Kalman-filtered RSSI per unordered player pair.
+
+    Pairs are stored in fixed-size matrices (upper triangle used), so memory is
+    bounded by the room size no matter how many samples arrive.
+    """
+
+    def __init__(self, capacity: int = 8):
+        self.index: Dict[str, int] = {}
+        self.players: List[str] = []
+        self.pending_pairs: List[int] = []
+        self.pending_rssi: List[float] = []
+        self._allocate(capacity)
+
+    def _allocate(self, capacity: int):
+        old = getattr(self, "estimate", None)
+        self.capacity = capacity
+        estimate = np.full((capacity, capacity), np.nan, dtype=np.float32)
+        variance = np.zeros((capacity, capacity), dtype=np.float32)
+        last_seen = np.zeros((capacity, capacity), dtype=np.float64)
+        near = np.zeros((capacity, capacity), dtype=bool)
+        if old is not None:
+            n = old.shape[0]
+            estimate[:n, :n] = self.estimate
+            variance[:n, :n] = self.variance
+            last_seen[:n, :n] = self.last_seen
+            near[:n, :n] = self.near
+            # Buffered pairs are flat indices into the old matrices
+            self.pending_pairs = [a * capacity + b for a, b in (divmod(k, n) for k in self.pending_pairs)]
+        self.estimate, self.variance, self.last_seen, self.near = estimate, variance, last_seen, near
+
+    def slot(self, player_id: str) -> Optional[int]:
+        i = self.index.get(player_id)
+        if i is None:
+            if len(self.players) >= RSSI_MAX_PLAYERS:
+                return None
+            if len(self.players) == self.capacity:
+                self._allocate(min(self.capacity * 2, RSSI_MAX_PLAYERS))
+            i = self.index[player_id] = len(self.players)
+            self.players.append(player_id)
+        return i
+
+    def add(self, observer: str, targets: List[str], rssi: List[float]):
+        i = self.slot(observer)
+        if i is None:
+            return
+        for target, value in zip(targets, rssi):
+            j = self.slot(target)
+            if j is None or j == i:
+                continue
+            a, b = (i, j) if i < j else (j, i)
+            self.pending_pairs.append(a * self.capacity + b)
+            self.pending_rssi.append(value)
+        # Keep the newest samples if a client floods the room
+        overflow = len(self.pending_pairs) - RSSI_MAX_PENDING
+        if overflow > 0:
+            del self.pending_pairs[:overflow]
+            del self.pending_rssi[:overflow]
+
+    def process(self, now: float):
+        """Fold pending samples into the filters; returns (entered, left) pair lists"""
+        entered, left = [], []
+        if self.pending_pairs:
+            pairs = np.asarray(self.pending_pairs, dtype=np.int64)
+            values = np.asarray(self.pending_rssi, dtype=np.float32)
+            self.pending_pairs, self.pending_rssi = [], []
+            
+            # Average samples of the same pair within the tick: one measurement each
+            flat, inverse, counts = np.unique(pairs, return_inverse=True, return_counts=True)
+            z = (np.bincount(inverse, weights=values) / counts).astype(np.float32)
+            r = RSSI_MEASUREMENT_NOISE / counts
+            
+            est = self.estimate.ravel()
+            var = self.variance.ravel()
+            fresh = np.isnan(est[flat])
+            prior = np.where(fresh, z, est[flat])
+            p = np.where(fresh, RSSI_MEASUREMENT_NOISE, var[flat] + RSSI_PROCESS_NOISE)
+            gain = p / (p + r)
+            est[flat] = prior + gain * (z - prior)
+            var[flat] = (1 - gain) * p
+            self.last_seen.ravel()[flat] = now
+            
+            was_near = self.near.ravel()[flat]
+            now_near = np.where(was_near, est[flat] > RSSI_FAR_DBM, est[flat] >= RSSI_NEAR_DBM)
+            self.near.ravel()[flat] = now_near
+            entered.extend(divmod(int(k), self.capacity) for k in flat[now_near & ~was_near])
+            left.extend(divmod(int(k), self.capacity) for k in flat[was_near & ~now_near])
+        
+        # Pairs that went quiet drop out of proximity and restart their filter
+        stale = (self.last_seen > 0) & (self.last_seen < now - RSSI_STALE_SECONDS)
+        if stale.any():
+            left.extend((int(a), int(b)) for a, b in zip(*np.nonzero(stale & self.near)))
+            self.estimate[stale] = np.nan
+            self.variance[stale] = 0
+            self.near[stale] = False
+            self.last_seen[stale] = 0
+        return entered, left
+
+rssi_rooms: Dict[str, RssiRoom] = {}
+rssi_samples_total = 0
+
+async def process_rssi_rooms():
+    now = time.time()
+    for room_code, room in list(rssi_rooms.items()):
+        entered, left = room.process(now)
+        for a, b in entered:
+            await sio.emit('proximity_event', {
+                'player1_id': room.players[a],
+                'player2_id': room.players[b],
+                'source': 'rssi',
+                'rssi': round(float(room.estimate[a, b]), 1)
+            }, room=room_code)
+        for a, b in left:
+            await sio.emit('proximity_lost', {
+                'player1_id': room.players[a],
+                'player2_id': room.players[b]
+            }, room=room_code)
+
+async def rssi_loop():
+    while True:
+        await asyncio.sleep(RSSI_TICK)
+        try:
+            await process_rssi_rooms()
+        except Exception as e:
+            logger.error(f"RSSI processing failed: {e}")
+
+@metrics_source("ble")
+def ble_metrics() -> Dict:
+    return {
+        "devices": len(ble_devices),
+        "rooms": len(rssi_rooms),
+        "pending_samples": sum(len(r.pending_pairs) for r in rssi_rooms.values()),
+        "samples_total": rssi_samples_total,
+    }
+
+# ==================== MOVEMENT VALIDATION ====================
+
+LOCATION_TICK = float(os.environ.get('LOCATION_TICK', '0.1'))
+LOCATION_MAX_SPEED = float(os.environ.get('LOCATION_MAX_SPEED', '12'))  # m/s, a sprinting human
+LOCATION_MAX_ACCEL = float(os.environ.get('LOCATION_MAX_ACCEL', '8'))   # m/s^2
+LOCATION_MAX_JUMP = float(os.environ.get('LOCATION_MAX_JUMP', '150'))   # m in a single update
+LOCATION_MIN_DT = 0.5            # floor for the time step, absorbs network jitter between updates
+LOCATION_REANCHOR_SECONDS = 30.0 # after this long without an accepted fix, accept a new position
+LOCATION_WINDOW = 8              # accepted fixes kept per player
+LOCATION_MAX_PENDING = 2048      # updates buffered per room between ticks
+SUSPICION_DECAY = 0.995          # per tick
+SUSPICION_WEIGHTS = {"jump": 5.0, "speed": 3.0, "accel": 1.0}
+EARTH_RADIUS_M = 6371000.0
+
+class MovementRoom:
+    """Per-room trajectory windows: a ring buffer of accepted fixes per player.
+
+    Incoming updates are buffered and validated together on each tick, so the
+    cost per update is a handful of vectorised array operations.
+    """
+
+    def __init__(self, capacity: int = 8):
+        self.index: Dict[str, int] = {}
+        self.players: List[str] = []
+        self.capacity = 0
+        self._grow(capacity)
+        self.pending: List[tuple] = []  # (slot, latitude, longitude, received_at, sid)
+
+    def _grow(self, capacity: int):
+        def grown(old, shape, fill=0.0, dtype=np.float64):
+            new = np.full(shape, fill, dtype=dtype)
+            if self.capacity:
+                new[:self.capacity] = old
+            return new
+        window = (capacity, LOCATION_WINDOW)
+        self.lat = grown(getattr(self, "lat", None), window)
+        self.lon = grown(getattr(self, "lon", None), window)
+        self.at = grown(getattr(self, "at", None), window)
+        self.head = grown(getattr(self, "head", None), capacity, 0, np.int64)   # next write position
+        self.count = grown(getattr(self, "count", None), capacity, 0, np.int64)
+        self.speed = grown(getattr(self, "speed", None), capacity)
+        self.suspicion = grown(getattr(self, "suspicion", None), capacity)
+        self.capacity = capacity
+
+    def add(self, player_id: str, sid: str, latitude: float, longitude: float, received_at: float):
+        i = self.index.get(player_id)
+        if i is None:
+            if len(self.players) == self.capacity:
+                self._grow(self.capacity * 2)
+            i = self.index[player_id] = len(self.players)
+            self.players.append(player_id)
+        self.pending.append((i, latitude, longitude, received_at, sid))
+        if len(self.pending) > LOCATION_MAX_PENDING:
+            del self.pending[0]
+
+    def validate(self):
+        """Check all buffered updates at once.
+
+        Returns (accepted, rejected): accepted is a list of (slot, latitude,
+        longitude, flagged) with the newest fix per player, rejected a list of
+        (sid, reason).
+        """
+        self.suspicion *= SUSPICION_DECAY
+        if not self.pending:
+            return [], []
+        batch, self.pending = self.pending, []
+        slot = np.fromiter((b[0] for b in batch), dtype=np.int64, count=len(batch))
+        lat = np.fromiter((b[1] for b in batch), dtype=np.float64, count=len(batch))
+        lon = np.fromiter((b[2] for b in batch), dtype=np.float64, count=len(batch))
+        at = np.fromiter((b[3] for b in batch), dtype=np.float64, count=len(batch))
+        order = np.lexsort((at, slot))
+        slot, lat, lon, at = slot[order], lat[order], lon[order], at[order]
+        
+        # Each update is compared with the player's last *accepted* fix, which
+        # depends on the verdict for their earlier updates in this batch. The
+        # per-player runs are walked one position at a time, all players at once.
+        n = len(slot)
+        first = np.ones(n, dtype=bool)
+        first[1:] = slot[1:] != slot[:-1]
+        run = np.cumsum(first) - 1
+        starts = np.nonzero(first)[0]
+        rank = np.arange(n) - starts[run]
+        run_slot = slot[starts]
+        last = (self.head[run_slot] - 1) % LOCATION_WINDOW
+        ref_lat = self.lat[run_slot, last]
+        ref_lon = self.lon[run_slot, last]
+        ref_at = self.at[run_slot, last]
+        ref_speed = self.speed[run_slot]
+        has_ref = self.count[run_slot] > 0
+        
+        jump = np.zeros(n, dtype=bool)
+        fast = np.zeros(n, dtype=bool)
+        jerky = np.zeros(n, dtype=bool)
+        by_rank = np.argsort(rank, kind="stable")
+        bounds = np.searchsorted(rank[by_rank], np.arange(rank.max() + 2))
+        for r in range(len(bounds) - 1):
+            k = by_rank[bounds[r]:bounds[r + 1]]
+            j = run[k]
+            # Equirectangular distance is accurate to well under a metre at game scale
+            phi = np.radians((lat[k] + ref_lat[j]) / 2)
+            dx = np.radians(lon[k] - ref_lon[j]) * np.cos(phi) * EARTH_RADIUS_M
+            dy = np.radians(lat[k] - ref_lat[j]) * EARTH_RADIUS_M
+            distance = np.hypot(dx, dy)
+            dt = at[k] - ref_at[j]
+            step = np.maximum(dt, LOCATION_MIN_DT)
+            # Without an accepted fix for LOCATION_REANCHOR_SECONDS the player re-anchors
+            checked = has_ref[j] & (dt < LOCATION_REANCHOR_SECONDS)
+            speed = np.where(checked, distance / step, 0.0)
+            accel = np.abs(speed - ref_speed[j]) / step
+            jump[k] = checked & (distance > LOCATION_MAX_JUMP)
+            fast[k] = checked & (speed > LOCATION_MAX_SPEED) & ~jump[k]
+            jerky[k] = checked & (accel > LOCATION_MAX_ACCEL) & ~jump[k] & ~fast[k]
+            
+            ok = ~(jump[k] | fast[k])
+            j, k = j[ok], k[ok]
+            ref_lat[j], ref_lon[j], ref_at[j] = lat[k], lon[k], at[k]
+            ref_speed[j] = speed[ok]
+            has_ref[j] = True
+        
+        np.add.at(self.suspicion, slot,
+                  jump * SUSPICION_WEIGHTS["jump"] + fast * SUSPICION_WEIGHTS["speed"] + jerky * SUSPICION_WEIGHTS["accel"])
+        
+        ok = ~(jump | fast)
+        rejected = [(batch[order[k]][4], "jump" if jump[k] else "speed") for k in np.nonzero(~ok)[0]]
+        if not ok.any():
+            return [], rejected
+        
+        # Append accepted fixes to the ring buffers, in time order per player
+        a_slot = slot[ok]
+        rank = np.arange(len(a_slot)) - np.searchsorted(a_slot, a_slot)
+        pos = (self.head[a_slot] + rank) % LOCATION_WINDOW
+        self.lat[a_slot, pos] = lat[ok]
+        self.lon[a_slot, pos] = lon[ok]
+        self.at[a_slot, pos] = at[ok]
+        added = np.bincount(a_slot, minlength=self.capacity)
+        self.head = (self.head + added) % LOCATION_WINDOW
+        self.count = np.minimum(self.count + added, LOCATION_WINDOW)
+        
+        self.speed[run_slot] = ref_speed
+        newest = np.ones(len(a_slot), dtype=bool)
+        newest[:-1] = a_slot[:-1] != a_slot[1:]
+        accepted = [(int(i), float(y), float(x), bool(f))
+                    for i, y, x, f in zip(a_slot[newest], lat[ok][newest], lon[ok][newest], jerky[ok][newest])]
+        return accepted, rejected
+
+movement_rooms: Dict[str, MovementRoom] = {}
+location_counts = {"accepted": 0, "rejected": 0, "flagged": 0}
+
+async def process_location_rooms():
+    for room_code, room in list(movement_rooms.items()):
+        accepted, rejected = room.validate()
+        location_counts["rejected"] += len(rejected)
+        for sid, reason in rejected:
+            await sio.emit('location_rejected', {'reason': reason}, to=sid)
+        for i, latitude, longitude, flagged in accepted:
+            location_counts["accepted"] += 1
+            location_counts["flagged"] += flagged
+            record_trace(room_code, room.players[i], latitude, longitude)
+            await sio.emit('location_update', {
+                'player_id': room.players[i],
+                'latitude': latitude,
+                'longitude': longitude,
+                'flagged': flagged
+            }, room=room_code)
 
-@api_router.delete("/ble/remove-device")
-async def remove_ble_device(token: str):
-    """Remove BLE device from user profile"""
-    user = await get_current_user(token)
-    if not user:
-        raise HTTPException(status_code=401, detail="Neautorizovan pristup")
-    
-    await db.users.update_one(
-        {"_id": user["_id"]},
-        {"$unset": {"ble_device": ""}}
-    )
-    
-    return {"success": True, "message": "Uređaj je uklonjen"}
+async def location_loop():
+    while True:
+        await asyncio.sleep(LOCATION_TICK)
+        try:
+            await process_location_rooms()
+        except Exception as e:
+            logger.error(f"Location validation failed: {e}")
 
-@api_router.get("/ble/device")
-async def get_ble_device(token: str):
-    """Get saved BLE device for user"""
-    user = await get_current_user(token)
-    if not user:
-        raise HTTPException(status_code=401, detail="Neautorizovan pristup")
-    
-    ble_device = user.get("ble_device")
-    return {"device": ble_device}
+def location_suspicion(room_code: str) -> Dict[str, float]:
+    room = movement_rooms.get(room_code)
+    if room is None:
+        return {}
+    return {pid: round(float(room.suspicion[i]), 2) for i, pid in enumerate(room.players)}
 
-# ==================== GAME TEST ====================
+@metrics_source("movement")
+def movement_metrics() -> Dict:
+    suspects = []
+    for code, room in movement_rooms.items():
+        for i, pid in enumerate(room.players):
+            suspects.append((float(room.suspicion[i]), pid, code))
+    suspects.sort(reverse=True)
+    return {
+        "rooms": len(movement_rooms),
+        "pending": sum(len(r.pending) for r in movement_rooms.values()),
+        **location_counts,
+        "top_suspects": [
+            {"player_id": pid, "room_code": code, "suspicion": round(score, 2)}
+            for score, pid, code in suspects[:5] if score > 0
+        ],
+    }
 
-@api_router.post("/game/freeze-test")
-async def freeze_test(token: str):
-    """Test freeze functionality - simulates a freeze event"""
-    user = await get_current_user(token)
-    if not user:
-        raise HTTPException(status_code=401, detail="Neautorizovan pristup")
-    
-    # Check if user has BLE device connected
-    ble_device = user.get("ble_device")
-    has_ble = ble_device is not None
-    
-    # Log test event
-    test_event = {
-        "user_id": str(user["_id"]),
-        "username": user["username"],
-        "event_type": "freeze_test",
-        "has_ble_device": has_ble,
-        "ble_device_id": ble_device.get("device_id") if ble_device else None,
-        "timestamp": datetime.utcnow()
+# ==================== LOCATION TRACES ====================
+
+TRACE_SCALE = 100000         # coordinates stored in units of 1e-5 degrees (~1.1 m)
+TRACE_MAX_POINTS = 36000     # per player per round, one hour at 10 Hz
+TRACE_ENCODING = "delta-v1"
+
+class TraceBuffer:
+    """Accepted fixes of one round, quantised on append"""
+
+    def __init__(self, started_at: float):
+        self.started_at = started_at
+        self.points: Dict[str, tuple] = {}  # player_id -> (t_ms, lat, lon) int arrays
+
+    def add(self, player_id: str, latitude: float, longitude: float, at: float):
+        points = self.points.get(player_id)
+        if points is None:
+            points = self.points[player_id] = (array('q'), array('q'), array('q'))
+        if len(points[0]) >= TRACE_MAX_POINTS:
+            return
+        points[0].append(round((at - self.started_at) * 1000))
+        points[1].append(round(latitude * TRACE_SCALE))
+        points[2].append(round(longitude * TRACE_SCALE))
+
+trace_buffers: Dict[str, TraceBuffer] = {}  # room_code -> current round
+pending_traces: List[Dict] = []
+
+def encode_deltas(values: array) -> tuple:
+    """Delta-encode an integer series into (first value, dtype, deltas)
+
+    Deltas use the narrowest signed dtype that holds them; the absolute first
+    value is kept apart so it does not force a wide dtype on the whole series.
+    """
+    series = np.asarray(values, dtype=np.int64)
+    deltas = np.diff(series)
+    peak = int(np.abs(deltas).max()) if len(deltas) else 0
+    dtype = next(t for t in ("<i1", "<i2", "<i4", "<i8") if peak <= np.iinfo(t).max)
+    return int(series[0]), dtype, Binary(deltas.astype(dtype).tobytes())
+
+def encode_trace(room_code: str, round_number: int, started_at: float, player_id: str, points: tuple) -> Dict:
+    doc = {
+        "room_code": room_code,
+        "round_number": round_number,
+        "player_id": player_id,
+        "started_at": datetime.utcfromtimestamp(started_at),
+        "encoding": TRACE_ENCODING,
+        "scale": TRACE_SCALE,
+        "points": len(points[0]),
     }
+    for field, values in zip(("t", "lat", "lon"), points):
+        first, dtype, data = encode_deltas(values)
+        doc[field] = {"first": first, "dtype": dtype, "data": data}
+    return doc
+
+def decode_trace(doc: Dict) -> Dict[str, np.ndarray]:
+    """Decode a location_traces document into t (seconds since round start), latitude and longitude arrays"""
+    if doc.get("encoding") != TRACE_ENCODING:
+        raise ValueError(f"Unsupported trace encoding: {doc.get('encoding')}")
     
-    # Optionally store test events in a collection
-    await db.test_events.insert_one(test_event)
+    def series(field: Dict) -> np.ndarray:
+        deltas = np.frombuffer(field["data"], dtype=field["dtype"]).astype(np.int64)
+        values = np.empty(len(deltas) + 1, dtype=np.int64)
+        values[0] = field["first"]
+        np.cumsum(deltas, out=values[1:])
+        values[1:] += field["first"]
+        return values
     
     return {
-        "success": True,
-        "message": "Test freeze event triggered!",
-        "user": user["username"],
-        "has_ble_device": has_ble,
-        "device_name": ble_device.get("device_name") if ble_device else None
+        "t": series(doc["t"]) / 1000.0,
+        "latitude": series(doc["lat"]) / doc["scale"],
+        "longitude": series(doc["lon"]) / doc["scale"],
     }
 
-# ==================== LEADERBOARD ====================
+def start_trace(room_code: str):
+    trace_buffers[room_code] = TraceBuffer(time.time())
 
-@api_router.get("/leaderboard")
-async def get_leaderboard(category: str = "xp"):
-    sort_field = f"stats.{category}" if category != "wins" else "stats.games_won"
-    users = await db.users.find().sort(sort_field, -1).limit(100).to_list(100)
-    
+def record_trace(room_code: str, player_id: str, latitude: float, longitude: float):
+    buffer = trace_buffers.get(room_code)
+    if buffer is not None:
+        buffer.add(player_id, latitude, longitude, time.time())
+
+def finish_trace(room_code: str, round_number: int):
+    """Queue one encoded document per player of the finished round for the next flush"""
+    buffer = trace_buffers.pop(room_code, None)
+    if buffer is None:
+        return
+    for player_id, points in buffer.points.items():
+        if points[0]:
+            pending_traces.append(encode_trace(room_code, round_number, buffer.started_at, player_id, points))
+
+async def flush_traces():
+    if not pending_traces:
+        return
+    docs = pending_traces[:]
+    pending_traces.clear()
+    try:
+        await db.location_traces.insert_many(docs, ordered=False)
+    except Exception as e:
+        logger.error(f"Saving {len(docs)} location traces failed: {e}")
+
+@metrics_source("traces")
+def trace_metrics() -> Dict:
     return {
-        "leaderboard": [
-            {
-                "rank": i + 1,
-                "username": u["username"],
-                "value": u.get("stats", {}).get(category if category != "wins" else "games_won", 0),
-                "level": u.get("stats", {}).get("level", 1)
-            }
-            for i, u in enumerate(users)
+        "recording_rooms": len(trace_buffers),
+        "buffered_points": sum(len(p[0]) for b in trace_buffers.values() for p in b.points.values()),
+        "pending_documents": len(pending_traces),
+    }
+
+# ==================== SPECTATORS ====================
+
+SPECTATOR_TICK = float(os.environ.get('SPECTATOR_TICK', '0.5'))
+SPECTATOR_MAX_EVENTS = 50  # game events carried per snapshot
+
+# Spectators sit in their own Socket.IO room, so player broadcasts never reach them
+spectator_sids: Dict[str, Set[str]] = {}  # room_code -> spectator sids
+sid_spectating: Dict[str, str] = {}  # sid -> room_code
+spectator_events: Dict[str, List[Dict]] = {}  # room_code -> events since the last snapshot
+spectator_sends: Dict[str, asyncio.Task] = {}  # room_code -> fan-out still in flight
+spectator_counts = {"snapshots": 0, "skipped": 0}
+
+def spectator_room(room_code: str) -> str:
+    return f"{room_code}:spectators"
+
+def spectator_event(room_code: str, name: str, data: Dict):
+    """Queue a game event for the next spectator snapshot, if anyone is watching"""
+    if room_code in spectator_sids:
+        events = spectator_events.setdefault(room_code, [])
+        if len(events) < SPECTATOR_MAX_EVENTS:
+            events.append({"event": name, **data})
+
+async def add_spectator(sid: str, room_code: str):
+    await remove_spectator(sid)
+    spectator_sids.setdefault(room_code, set()).add(sid)
+    sid_spectating[sid] = room_code
+    await sio.enter_room(sid, spectator_room(room_code))
+
+async def remove_spectator(sid: str):
+    room_code = sid_spectating.pop(sid, None)
+    if room_code is None:
+        return
+    sids = spectator_sids.get(room_code)
+    if sids is not None:
+        sids.discard(sid)
+        if not sids:
+            del spectator_sids[room_code]
+            spectator_events.pop(room_code, None)
+    await sio.leave_room(sid, spectator_room(room_code))
+
+def build_snapshot(room_code: str) -> Dict:
+    """Latest accepted position of every player plus the round state, from memory only"""
+    positions = []
+    movement = movement_rooms.get(room_code)
+    if movement is not None and movement.players:
+        n = len(movement.players)
+        seen = np.nonzero(movement.count[:n] > 0)[0]
+        last = (movement.head[seen] - 1) % LOCATION_WINDOW
+        lat = np.round(movement.lat[seen, last], 5)
+        lon = np.round(movement.lon[seen, last], 5)
+        positions = [
+            {"player_id": movement.players[i], "latitude": float(y), "longitude": float(x)}
+            for i, y, x in zip(seen, lat, lon)
         ]
+    tracker = round_trackers.get(room_code)
+    return {
+        "room_code": room_code,
+        "t": round(time.time(), 2),
+        "playing": tracker is not None,
+        "mraz_id": tracker["mraz_id"] if tracker else None,
+        "frozen_players": list(tracker["frozen_at"]) if tracker else [],
+        "positions": positions,
+        "events": spectator_events.pop(room_code, []),
+        "spectators": len(spectator_sids.get(room_code, ())),
     }
 
-# ==================== STATS ====================
+async def broadcast_spectator_snapshots():
+    for room_code in list(spectator_sids):
+        # A room whose previous fan-out is still being written out skips a tick
+        # rather than queueing snapshots behind slow spectators
+        sending = spectator_sends.get(room_code)
+        if sending is not None and not sending.done():
+            spectator_counts["skipped"] += 1
+            continue
+        # One snapshot per room and tick; Socket.IO encodes it once for every recipient
+        snapshot = build_snapshot(room_code)
+        spectator_sends[room_code] = asyncio.create_task(
+            sio.emit('spectator_snapshot', snapshot, room=spectator_room(room_code))
+        )
+        spectator_counts["snapshots"] += 1
+    for room_code in [code for code in spectator_sends if code not in spectator_sids]:
+        if spectator_sends[room_code].done():
+            del spectator_sends[room_code]
 
-@api_router.get("/stats/{user_id}")
-async def get_user_stats(user_id: str):
+async def spectator_loop():
+    while True:
+        await asyncio.sleep(SPECTATOR_TICK)
+        try:
+            await broadcast_spectator_snapshots()
+        except Exception as e:
+            logger.error(f"Spectator snapshot failed: {e}")
+
+@metrics_source("spectators")
+def spectator_metrics() -> Dict:
+    return {
+        "rooms": len(spectator_sids),
+        "spectators": len(sid_spectating),
+        **spectator_counts,
+    }
+
+# ==================== GAME EVENTS ====================
+
+# In-process stream of game facts (freezes, thaws, finished rounds) for
+# subscribers that derive state from play. Handlers are synchronous and must
+# stay cheap: they run inline in the socket handler that published the event.
+game_event_handlers: Dict[str, List[Callable[[str, Dict], None]]] = {}
+
+def on_game_event(*names: str):
+    """Subscribe handler(name, data) to the given event names"""
+    def register(handler):
+        for name in names:
+            game_event_handlers.setdefault(name, []).append(handler)
+        return handler
+    return register
+
+def publish_game_event(name: str, **data):
+    for handler in game_event_handlers.get(name, ()):
+        try:
+            handler(name, data)
+        except Exception as e:
+            logger.error(f"Game event handler {handler.__name__} failed on {name}: {e}")
+
+# ==================== ACHIEVEMENTS ====================
+
+ACHIEVEMENT_FLUSH_INTERVAL = float(os.environ.get('ACHIEVEMENT_FLUSH_INTERVAL', '1.0'))
+
+# Each achievement unlocks when one user stat reaches its threshold
+ACHIEVEMENTS = [
+    {"id": "first_game", "name": "Prva igra", "stat": "games_played", "threshold": 1, "reward_coins": 10},
+    {"id": "regular", "name": "Stalni igrac", "stat": "games_played", "threshold": 25, "reward_coins": 50},
+    {"id": "veteran", "name": "Veteran", "stat": "games_played", "threshold": 100, "reward_coins": 200},
+    {"id": "first_win", "name": "Prva pobeda", "stat": "games_won", "threshold": 1, "reward_coins": 25},
+    {"id": "ice_king", "name": "Kralj leda", "stat": "games_won", "threshold": 10, "reward_coins": 100},
+    {"id": "ice_emperor", "name": "Car leda", "stat": "games_won", "threshold": 50, "reward_coins": 300},
+    {"id": "brrr", "name": "Brrr!", "stat": "times_frozen", "threshold": 1, "reward_coins": 5},
+    {"id": "ice_cube", "name": "Kocka leda", "stat": "times_frozen", "threshold": 50, "reward_coins": 50},
+    {"id": "helper", "name": "Pomagac", "stat": "times_unfrozen_others", "threshold": 1, "reward_coins": 10},
+    {"id": "rescuer", "name": "Spasilac", "stat": "times_unfrozen_others", "threshold": 25, "reward_coins": 100},
+    {"id": "hero", "name": "Heroj", "stat": "times_unfrozen_others", "threshold": 100, "reward_coins": 300},
+    {"id": "survivor", "name": "Prezivelac", "stat": "longest_survival", "threshold": 60, "reward_coins": 25},
+    {"id": "untouchable", "name": "Nedodirljiv", "stat": "longest_survival", "threshold": 300, "reward_coins": 150},
+]
+
+# stat -> how game events move it: (event, player field, value field or None for +1, "add" | "max")
+ACHIEVEMENT_TRIGGERS = {
+    "games_played": ("round_started", "player_id", None, "add"),
+    "games_won": ("round_finished", "player_id", "won", "add"),
+    "longest_survival": ("round_finished", "player_id", "survival", "max"),
+    "times_frozen": ("player_frozen", "player_id", None, "add"),
+    "times_unfrozen_others": ("player_unfrozen", "unfreezer_id", None, "add"),
+}
+
+def compile_achievements(rules: List[Dict]):
+    """Per stat: ascending thresholds with their achievements; per event: the stats it moves.
+
+    A player keeps one pointer per stat to the next threshold, so an event
+    costs one comparison per stat it moves however many rules exist.
+    """
+    ladders: Dict[str, tuple] = {}
+    for stat in {rule["stat"] for rule in rules}:
+        steps = sorted((rule["threshold"], rule["id"]) for rule in rules if rule["stat"] == stat)
+        ladders[stat] = ([t for t, _ in steps], [a for _, a in steps])
+    dispatch: Dict[str, List[tuple]] = {}
+    for stat, (event, player_field, value_field, mode) in ACHIEVEMENT_TRIGGERS.items():
+        if stat in ladders:
+            dispatch.setdefault(event, []).append((stat, player_field, value_field, mode))
+    return ladders, dispatch
+
+achievement_ladders, achievement_dispatch = compile_achievements(ACHIEVEMENTS)
+achievements_by_id = {rule["id"]: rule for rule in ACHIEVEMENTS}
+ACHIEVEMENT_PROJECTION = {**{f"stats.{stat}": 1 for stat in achievement_ladders}, "achievements": 1}
+
+# player_id -> {"stats": {stat: value}, "next": {stat: index of the next threshold}}
+achievement_progress: Dict[str, Dict] = {}
+pending_unlocks: List[tuple] = []  # (player_id, achievement_id)
+queued_unlocks: Dict[str, Set[str]] = {}  # player_id -> achievement ids queued and not yet stored
+player_sids: Dict[str, str] = {}  # player_id -> sid of their game connection
+achievements_unlocked_total = 0
+
+def queue_unlock(player_id: str, achievement_id: str):
+    """Queue an unlock once, however often a rejoin re-seeds the player before the flush"""
+    queued = queued_unlocks.setdefault(player_id, set())
+    if achievement_id not in queued:
+        queued.add(achievement_id)
+        pending_unlocks.append((player_id, achievement_id))
+
+def load_achievements(player_id: str, doc: Dict):
+    """Seed progress from the stored stats; thresholds already passed but never awarded unlock now"""
+    unlocked = set(doc.get("achievements", []))
+    stats = doc.get("stats", {})
+    progress = {"stats": {}, "next": {}}
+    for stat, (thresholds, ids) in achievement_ladders.items():
+        value = stats.get(stat, 0)
+        reached = bisect.bisect_right(thresholds, value)
+        progress["stats"][stat] = value
+        progress["next"][stat] = reached
+        for a in ids[:reached]:
+            if a not in unlocked:
+                queue_unlock(player_id, a)
+    achievement_progress[player_id] = progress
+
+def forget_achievements(player_id: str):
+    achievement_progress.pop(player_id, None)
+
+@on_game_event(*achievement_dispatch)
+def advance_achievements(event_name: str, data: Dict):
+    for stat, player_field, value_field, mode in achievement_dispatch.get(event_name, ()):
+        progress = achievement_progress.get(data.get(player_field))
+        if progress is None:
+            continue  # not in a game on this worker
+        value = 1 if value_field is None else int(data.get(value_field) or 0)
+        current = progress["stats"][stat]
+        current = current + value if mode == "add" else max(current, value)
+        progress["stats"][stat] = current
+        
+        thresholds, ids = achievement_ladders[stat]
+        step = progress["next"][stat]
+        while step < len(thresholds) and current >= thresholds[step]:
+            queue_unlock(data[player_field], ids[step])
+            step += 1
+        progress["next"][stat] = step
+
+async def flush_achievements():
+    """Announce queued unlocks to their players and store them with one bulk_write"""
+    global achievements_unlocked_total
+    if not pending_unlocks:
+        return
+    unlocks = pending_unlocks[:]
+    pending_unlocks.clear()
+    
+    by_player: Dict[str, List[str]] = {}
+    for player_id, achievement_id in unlocks:
+        by_player.setdefault(player_id, []).append(achievement_id)
+    
+    # Guarded per achievement, so an unlock sent twice (e.g. from two workers)
+    # is stored and rewarded once
+    updates = [
+        UpdateOne(
+            {"_id": ObjectId(player_id), "achievements": {"$ne": achievement_id}},
+            {"$push": {"achievements": achievement_id}, "$inc": {"coins": achievements_by_id[achievement_id]["reward_coins"]}}
+        )
+        for player_id, achievement_id in unlocks
+    ]
     try:
-        user = await db.users.find_one({"_id": ObjectId(user_id)})
-    except:
-        raise HTTPException(status_code=400, detail="Neispravan ID korisnika")
+        await db.users.bulk_write(updates, ordered=False)
+    except Exception as e:
+        # The writes are guarded, so retrying the whole batch is safe
+        logger.error(f"Saving {len(unlocks)} achievement unlocks failed: {e}")
+        pending_unlocks[:0] = unlocks
+        return
+    # Only now: a rejoin during the write still sees them as queued
+    for player_id, ids in by_player.items():
+        queued = queued_unlocks.get(player_id)
+        if queued is not None:
+            queued.difference_update(ids)
+            if not queued:
+                del queued_unlocks[player_id]
+    achievements_unlocked_total += len(unlocks)
     
-    if not user:
-        raise HTTPException(status_code=404, detail="Korisnik nije pronadjen")
+    for player_id, ids in by_player.items():
+        sid = player_sids.get(player_id)
+        if sid is None:
+            continue
+        await sio.emit('achievement_unlocked', {
+            'achievements': [
+                {'id': a, 'name': achievements_by_id[a]["name"], 'reward_coins': achievements_by_id[a]["reward_coins"]}
+                for a in ids
+            ]
+        }, to=sid)
+
+async def achievements_loop():
+    while True:
+        await asyncio.sleep(ACHIEVEMENT_FLUSH_INTERVAL)
+        try:
+            await flush_achievements()
+        except Exception as e:
+            logger.error(f"Achievement flush failed: {e}")
+
+@metrics_source("achievements")
+def achievement_metrics() -> Dict:
+    return {
+        "rules": len(ACHIEVEMENTS),
+        "tracked_players": len(achievement_progress),
+        "pending_unlocks": len(pending_unlocks),
+        "unlocked_total": achievements_unlocked_total,
+    }
+
+# ==================== BOTS ====================
+
+# Server-side players. Bots of one room are simulated together: positions are
+# NumPy arrays in metres east/north of the room's origin and each tick moves
+# every bot at once, then feeds the results through the same socket handlers
+# a phone would call. They have no user document and never touch user stats.
+BOT_TICK = float(os.environ.get('BOT_TICK', '1.0'))
+BOT_ORIGIN = tuple(float(v) for v in os.environ.get('BOT_ORIGIN', '44.8125,20.4612').split(','))
+BOT_MAX_PER_ROOM = int(os.environ.get('BOT_MAX_PER_ROOM', '16'))
+BOT_MAX_LOAD_ROOMS = int(os.environ.get('BOT_MAX_LOAD_ROOMS', '500'))
+BOT_WALK_SPEED = 1.4      # m/s while wandering
+BOT_RUN_SPEED = 4.0       # m/s fleeing the Mraz or running to a frozen teammate
+BOT_CHASE_SPEED = 6.0     # m/s, faster than the runners so rounds end
+BOT_WANDER_TURN = 0.6     # radians of heading noise per second
+BOT_FLEE_RADIUS = 30.0    # m, runners react to a Mraz this close
+BOT_RESCUE_RADIUS = 60.0  # m, runners only go for a frozen teammate with the Mraz farther than this
+BOT_CATCH_METERS = 3.0    # m, close enough to freeze or unfreeze
+BOT_SPAWN_RADIUS = 40.0   # m around the origin
+BOT_ARENA_RADIUS = 150.0  # m, bots turn back towards the origin beyond this
+BOT_RESTART_DELAY = 5.0   # s between rounds in bot-only rooms
+BOT_ORPHAN_SECONDS = 60.0 # s a room may have no human connections before its bots leave
+BOT_SID_PREFIX = "bot:"
+METRES_PER_DEGREE = math.pi / 180 * EARTH_RADIUS_M
+
+bot_players: Dict[str, str] = {}  # bot_id -> room_code
+bot_rng = np.random.default_rng()
+bot_counts = {"ticks": 0, "location_updates": 0, "freezes": 0, "unfreezes": 0, "rounds_started": 0}
+bot_tick_seconds = 0.0
+
+def bot_sid(bot_id: str) -> str:
+    return BOT_SID_PREFIX + bot_id
+
+def is_bot(player_id: str) -> bool:
+    return player_id in bot_players
+
+class BotRoom:
+    def __init__(self, room_code: str, autoplay: bool, anchored: bool):
+        self.room_code = room_code
+        self.autoplay = autoplay      # bot-only room that starts its own rounds
+        self.anchored = anchored      # origin fixed; rooms with humans wait for a human fix
+        self.origin = BOT_ORIGIN
+        self.ids: List[str] = []
+        self.pos = np.zeros((0, 2))
+        self.heading = np.zeros(0)
+        self.rounds = 0
+        self.idle_since = time.time()
+        self.orphan_since: Optional[float] = None
+
+    def add(self, bot_ids: List[str]):
+        n = len(bot_ids)
+        radius = BOT_SPAWN_RADIUS * np.sqrt(bot_rng.random(n))
+        angle = bot_rng.uniform(0, 2 * np.pi, n)
+        self.ids.extend(bot_ids)
+        self.pos = np.vstack([self.pos, np.stack([radius * np.cos(angle), radius * np.sin(angle)], axis=1)])
+        self.heading = np.concatenate([self.heading, bot_rng.uniform(0, 2 * np.pi, n)])
+
+    def remove(self, bot_ids: Set[str]):
+        keep = np.array([bot_id not in bot_ids for bot_id in self.ids], dtype=bool)
+        self.ids = [bot_id for bot_id in self.ids if bot_id not in bot_ids]
+        self.pos = self.pos[keep]
+        self.heading = self.heading[keep]
+
+    def to_metres(self, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+        lat0, lon0 = self.origin
+        return np.stack([
+            (lon - lon0) * METRES_PER_DEGREE * math.cos(math.radians(lat0)),
+            (lat - lat0) * METRES_PER_DEGREE,
+        ], axis=1)
+
+    def coordinates(self):
+        lat0, lon0 = self.origin
+        lat = lat0 + self.pos[:, 1] / METRES_PER_DEGREE
+        lon = lon0 + self.pos[:, 0] / (METRES_PER_DEGREE * math.cos(math.radians(lat0)))
+        return lat, lon
+
+    def step(self, dt: float, mraz_id: Optional[str], frozen: Set[str], other_ids: List[str], other_pos: np.ndarray):
+        """Move every bot one tick.
+
+        Runners flee a Mraz within BOT_FLEE_RADIUS, run to the nearest frozen
+        teammate while the Mraz is beyond BOT_RESCUE_RADIUS, otherwise wander; a Mraz bot chases the
+        nearest runner; frozen bots stand still. Returns the (bot, target)
+        freezes and unfreezes that are in reach this tick.
+        """
+        n = len(self.ids)
+        if n == 0:
+            return [], []
+        ids = self.ids + other_ids
+        pos = np.vstack([self.pos, other_pos]) if other_ids else self.pos
+        is_mraz = np.array([pid == mraz_id for pid in ids], dtype=bool)
+        is_frozen = np.array([pid in frozen for pid in ids], dtype=bool)
+        runner = ~is_mraz & ~is_frozen
+        rows = np.arange(n)
+        
+        delta = pos[None, :, :] - self.pos[:, None, :]  # bot -> every player
+        dist = np.hypot(delta[..., 0], delta[..., 1])
+        dist[rows, rows] = np.inf
+        
+        def nearest(mask):
+            masked = np.where(mask[None, :], dist, np.inf)
+            j = masked.argmin(axis=1)
+            return j, masked[rows, j]
+        
+        def towards(j, speed):
+            v = delta[rows, j]
+            return v / np.maximum(np.hypot(v[:, 0], v[:, 1]), 1e-9)[:, None] * speed
+        
+        self.heading += bot_rng.normal(0, BOT_WANDER_TURN * math.sqrt(dt), n)
+        velocity = BOT_WALK_SPEED * np.stack([np.cos(self.heading), np.sin(self.heading)], axis=1)
+        catches, rescues = [], []
+        if mraz_id is not None:
+            prey, prey_dist = nearest(runner)
+            hunter, hunter_dist = nearest(is_mraz)
+            friend, friend_dist = nearest(is_frozen)
+            chase = is_mraz[:n] & np.isfinite(prey_dist)
+            flee = runner[:n] & (hunter_dist < BOT_FLEE_RADIUS)
+            rescue = runner[:n] & (hunter_dist > BOT_RESCUE_RADIUS) & np.isfinite(friend_dist)
+            velocity = np.where(chase[:, None], towards(prey, BOT_CHASE_SPEED), velocity)
+            velocity = np.where(flee[:, None], -towards(hunter, BOT_RUN_SPEED), velocity)
+            velocity = np.where(rescue[:, None], towards(friend, BOT_RUN_SPEED), velocity)
+            velocity[is_frozen[:n]] = 0.0
+            
+            for i in np.nonzero(chase & (prey_dist <= BOT_CATCH_METERS))[0]:
+                catches.append((self.ids[i], ids[prey[i]]))
+            rescued = set()
+            for i in np.nonzero(rescue & (friend_dist <= BOT_CATCH_METERS))[0]:
+                if ids[friend[i]] not in rescued:
+                    rescued.add(ids[friend[i]])
+                    rescues.append((self.ids[i], ids[friend[i]]))
+        
+        # Turn back towards the origin when leaving the arena
+        radius = np.hypot(self.pos[:, 0], self.pos[:, 1])
+        outside = radius > BOT_ARENA_RADIUS
+        if outside.any():
+            home = -self.pos[outside] / radius[outside, None]
+            speed = np.maximum(np.hypot(velocity[outside, 0], velocity[outside, 1]), BOT_WALK_SPEED)
+            velocity[outside] = home * speed[:, None]
+        moving = (velocity != 0).any(axis=1)
+        self.heading[moving] = np.arctan2(velocity[moving, 1], velocity[moving, 0])
+        self.pos = self.pos + velocity * dt
+        return catches, rescues
+
+bot_rooms: Dict[str, BotRoom] = {}
+
+def new_bot_player(skins: List[str]) -> Dict:
+    return {
+        "id": str(ObjectId()),
+        "username": "Bot " + "".join(random.choices(string.ascii_uppercase, k=4)),
+        "is_host": False,
+        "is_ready": True,
+        "is_frozen": False,
+        "equipped_skin": random.choice(skins),
+        "is_bot": True,
+    }
+
+async def add_bots(room: Dict, count: int, autoplay: bool = False) -> List[Dict]:
+    """Seat `count` bots in a room, as join_room and join_game would for a human"""
+    room_code = room["code"]
+    bots = [new_bot_player(["default"]) for _ in range(count)]
+    await db.rooms.update_one({"_id": room["_id"]}, {"$push": {"players": {"$each": bots}}})
+    room_reads.forget(room_code)
+    if room_code in active_games:
+        active_games[room_code]["players"] = room.get("players", []) + bots
     
+    bot_room = bot_rooms.get(room_code)
+    if bot_room is None:
+        humans = any(not p.get("is_bot") for p in room.get("players", []))
+        bot_room = bot_rooms[room_code] = BotRoom(room_code, autoplay, anchored=not humans)
+    bot_room.add([b["id"] for b in bots])
+    for bot in bots:
+        bot_players[bot["id"]] = room_code
+        player_connections[bot_sid(bot["id"])] = bot["id"]
+        add_room_sid(room_code, bot_sid(bot["id"]))
+        user_cards.prime(bot["id"], bot)
+        await sio.emit('player_joined', {'player_id': bot["id"]}, room=room_code)
+    return bots
+
+async def remove_bots(room_code: str) -> int:
+    bot_room = bot_rooms.pop(room_code, None)
+    if bot_room is None:
+        return 0
+    for bot_id in bot_room.ids:
+        bot_players.pop(bot_id, None)
+        player_connections.pop(bot_sid(bot_id), None)
+        remove_room_sid(room_code, bot_sid(bot_id))
+        await sio.emit('player_left', {'player_id': bot_id}, room=room_code)
+    await db.rooms.update_one({"code": room_code}, {"$pull": {"players": {"is_bot": True}}})
+    room_reads.forget(room_code)
+    if room_code in active_games:
+        active_games[room_code]["players"] = [p for p in active_games[room_code]["players"] if not p.get("is_bot")]
+    return len(bot_room.ids)
+
+def human_positions(room_code: str, bot_room: BotRoom, tracker: Dict):
+    """Latest accepted fix of every human in the round, in the bot room's metres"""
+    movement = movement_rooms.get(room_code)
+    if movement is None:
+        return [], np.zeros((0, 2))
+    slots = [(pid, movement.index[pid]) for pid in tracker["player_ids"]
+             if pid not in bot_players and pid in movement.index]
+    slots = [(pid, i) for pid, i in slots if movement.count[i] > 0]
+    if not slots:
+        return [], np.zeros((0, 2))
+    index = np.array([i for _, i in slots])
+    last = (movement.head[index] - 1) % LOCATION_WINDOW
+    lat, lon = movement.lat[index, last], movement.lon[index, last]
+    if not bot_room.anchored:
+        # Bots spawn around the humans they play with
+        bot_room.origin = (float(lat.mean()), float(lon.mean()))
+        bot_room.anchored = True
+    return [pid for pid, _ in slots], bot_room.to_metres(lat, lon)
+
+async def idle_bot_room(room_code: str, bot_room: BotRoom, now: float):
+    """Between rounds: bot-only rooms start the next one, others just wait for their host.
+
+    No new rounds while draining, so the drain only waits for rounds already running.
+    """
+    if bot_room.autoplay and bot_room.ids and not draining and now - bot_room.idle_since >= BOT_RESTART_DELAY:
+        host = bot_sid(bot_room.ids[0])
+        if bot_room.rounds == 0:
+            await start_game(host, {"room_code": room_code})
+        else:
+            await restart_round(host, {"room_code": room_code})
+        bot_room.rounds += 1
+        bot_counts["rounds_started"] += 1
+    if not bot_room.autoplay:
+        if has_humans(room_code):
+            bot_room.orphan_since = None
+        elif bot_room.orphan_since is None:
+            bot_room.orphan_since = now
+        elif now - bot_room.orphan_since >= BOT_ORPHAN_SECONDS:
+            await remove_bots(room_code)
+
+async def run_bot_tick(dt: float):
+    now = time.time()
+    for room_code, bot_room in list(bot_rooms.items()):
+        if bot_room.autoplay:
+            touch_room(room_code)  # bot-only rooms are live for as long as their bots play
+        tracker = round_trackers.get(room_code)
+        if tracker is None:
+            await idle_bot_room(room_code, bot_room, now)
+            mraz_id, frozen, other_ids, other_pos = None, set(), [], np.zeros((0, 2))
+        else:
+            bot_room.idle_since = now
+            mraz_id, frozen = tracker["mraz_id"], set(tracker["frozen_at"])
+            other_ids, other_pos = human_positions(room_code, bot_room, tracker)
+        if room_code not in bot_rooms or not bot_room.anchored:
+            continue
+        
+        catches, rescues = bot_room.step(dt, mraz_id, frozen, other_ids, other_pos)
+        lat, lon = bot_room.coordinates()
+        for bot_id, latitude, longitude in zip(bot_room.ids, lat.tolist(), lon.tolist()):
+            await update_location(bot_sid(bot_id), {
+                "room_code": room_code, "player_id": bot_id, "latitude": latitude, "longitude": longitude
+            })
+        bot_counts["location_updates"] += len(bot_room.ids)
+        for bot_id, target in catches:
+            await freeze_player(bot_sid(bot_id), {"room_code": room_code, "frozen_player_id": target, "mraz_id": bot_id})
+            bot_counts["freezes"] += 1
+        for bot_id, target in rescues:
+            await unfreeze_player(bot_sid(bot_id), {"room_code": room_code, "frozen_player_id": target, "unfreezer_id": bot_id})
+            bot_counts["unfreezes"] += 1
+    bot_counts["ticks"] += 1
+
+async def bot_loop():
+    global bot_tick_seconds
+    last = time.perf_counter()
+    while True:
+        await asyncio.sleep(BOT_TICK)
+        started = time.perf_counter()
+        # Bots move by the time that actually passed, so a late tick never
+        # looks like a speeding phone to movement validation
+        dt, last = min(started - last, 5 * BOT_TICK), started
+        if not bot_rooms:
+            continue
+        try:
+            await run_bot_tick(dt)
+        except Exception as e:
+            logger.error(f"Bot tick failed: {e}")
+        bot_tick_seconds = time.perf_counter() - started
+
+@metrics_source("bots")
+def bot_metrics() -> Dict:
     return {
-        "username": user["username"],
-        "stats": user.get("stats", {}),
-        "level": user.get("stats", {}).get("level", 1),
-        "xp": user.get("stats", {}).get("xp", 0)
+        "rooms": len(bot_rooms),
+        "bots": len(bot_players),
+        "last_tick_ms": round(bot_tick_seconds * 1000, 2),
+        **bot_counts,
     }
 
+@api_router.post("/rooms/{room_code}/bots")
+async def add_room_bots(room_code: str, token: str, count: int = 1):
+    """Host fills their waiting room with bots"""
+    user = await get_current_user(token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Neautorizovan pristup")
+    room = await db.rooms.find_one({"code": room_code.upper(), "status": "waiting"})
+    if not room:
+        raise HTTPException(status_code=404, detail="Soba nije pronadjena ili je igra vec pocela")
+    if room.get("host_id") != str(user.id):
+        raise HTTPException(status_code=403, detail="Samo domacin moze dodati botove")
+    existing = sum(1 for p in room["players"] if p.get("is_bot"))
+    free = min(room.get("max_players", 10) - len(room["players"]), BOT_MAX_PER_ROOM - existing)
+    if count < 1 or count > free:
+        raise HTTPException(status_code=400, detail="Soba je puna")
+    bots = await add_bots(room, count)
+    return {"bots": bots}
+
+@api_router.delete("/rooms/{room_code}/bots")
+async def remove_room_bots(room_code: str, token: str):
+    user = await get_current_user(token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Neautorizovan pristup")
+    room = await db.rooms.find_one({"code": room_code.upper()}, {"host_id": 1})
+    if not room:
+        raise HTTPException(status_code=404, detail="Soba nije pronadjena")
+    if room.get("host_id") != str(user.id):
+        raise HTTPException(status_code=403, detail="Samo domacin moze ukloniti botove")
+    return {"removed": await remove_bots(room_code.upper())}
+
+@api_router.post("/admin/bots/load")
+async def start_bot_load(token: str, rooms: int = 10, bots_per_room: int = 8):
+    """Load generator: bot-only rooms that play rounds back to back on this worker"""
+    await require_admin(token)
+    if rooms < 1 or not 2 <= bots_per_room <= BOT_MAX_PER_ROOM:
+        raise HTTPException(status_code=400, detail="Neispravni parametri")
+    load_rooms = sum(1 for r in bot_rooms.values() if r.autoplay)
+    if load_rooms + rooms > BOT_MAX_LOAD_ROOMS:
+        raise HTTPException(status_code=400, detail="Previse soba sa botovima")
+    docs = [{
+        "code": generate_room_code(),
+        "name": "Bot load",
+        "host_id": None,
+        "players": [],
+        "status": "waiting",
+        "current_mraz": None,
+        "frozen_players": [],
+        "max_players": bots_per_room,
+        "is_private": True,
+        "settings": dict(DEFAULT_ROOM_SETTINGS),
+        "created_at": datetime.utcnow()
+    } for _ in range(rooms)]
+    result = await db.rooms.insert_many(docs)
+    for doc, room_id in zip(docs, result.inserted_ids):
+        doc["_id"] = room_id
+        bots = await add_bots(doc, bots_per_room, autoplay=True)
+        await db.rooms.update_one({"_id": room_id}, {"$set": {"host_id": bots[0]["id"]}})
+    return {"rooms": [doc["code"] for doc in docs], "bots": rooms * bots_per_room}
+
+@api_router.delete("/admin/bots/load")
+async def stop_bot_load(token: str):
+    await require_admin(token)
+    codes = [code for code, r in bot_rooms.items() if r.autoplay]
+    removed = 0
+    for code in codes:
+        removed += await remove_bots(code)
+    return {"rooms": len(codes), "bots": removed}
+
 # ==================== SOCKET.IO EVENTS ====================
 
 @sio.event
@@ -783,48 +4598,122 @@ async def connect(sid, environ):
 @sio.event
 async def disconnect(sid):
     logging.info(f"Client disconnected: {sid}")
+    if traffic_recorder is not None:
+        traffic_recorder.sio("disconnect", sid, None)
+    for room_code in list(sid_rooms.get(sid, ())):
+        remove_room_sid(room_code, sid)
+    await remove_spectator(sid)
     # Remove from active games
     if sid in player_connections:
-        del player_connections[sid]
+        player_id = player_connections.pop(sid)
+        entry = matchmaking_entries.get(player_id)
+        if entry and entry["sid"] == sid:
+            dequeue_player(player_id)
+        if player_sids.get(player_id) == sid:
+            del player_sids[player_id]
+        if player_id not in player_connections.values():
+            forget_player_powers(player_id)
+            forget_ble_device(player_id)
+            forget_achievements(player_id)
 
-@sio.event
-async def join_game(sid, data):
+@sio_event(JoinGameEvent)
+async def join_game(sid, event: JoinGameEvent):
     """Player joins a game room via socket"""
-    room_code = data.get("room_code")
-    player_id = data.get("player_id")
+    room_code = event.room_code
+    player_id = event.player_id
+    # Powers, locations and notifications trust this binding from here on
+    if decode_token(event.token) != player_id:
+        await sio.emit('join_rejected', {'room_code': room_code, 'message': 'Neautorizovan pristup'}, to=sid)
+        return
     
-    if room_code and player_id:
-        player_connections[sid] = player_id
-        await sio.enter_room(sid, room_code)
-        await sio.emit('player_joined', {'player_id': player_id}, room=room_code)
-        logging.info(f"Player {player_id} joined room {room_code}")
+    player_connections[sid] = player_id
+    player_sids[player_id] = sid
+    add_room_sid(room_code, sid)
+    await load_game_profile(player_id)
+    await sio.enter_room(sid, room_code)
+    await sio.emit('player_joined', {'player_id': player_id}, room=room_code)
+    logging.info(f"Player {player_id} joined room {room_code}")
 
-@sio.event
-async def leave_game(sid, data):
+@sio_event(SpectateEvent)
+async def spectate(sid, event: SpectateEvent):
+    """Watch a room: receives downsampled snapshots instead of the player stream"""
+    code = event.room_code
+    user_id = decode_token(event.token)
+    if not user_id:
+        await sio.emit('spectate_rejected', {'room_code': code, 'message': 'Neautorizovan pristup'}, to=sid)
+        return
+    room = await room_reads.do(code, lambda: db.rooms.find_one({"code": code}))
+    if not room:
+        await sio.emit('spectate_rejected', {'room_code': code, 'message': 'Soba nije pronadjena'}, to=sid)
+        return
+    # Private games are only watched by their own players
+    if room.get("is_private") and not any(p["id"] == user_id for p in room.get("players", [])):
+        await sio.emit('spectate_rejected', {'room_code': code, 'message': 'Soba je privatna'}, to=sid)
+        return
+    await add_spectator(sid, code)
+    await sio.emit('spectating', {'room_code': event.room_code}, to=sid)
+
+@sio_event(RoomEvent)
+async def stop_spectating(sid, event: RoomEvent):
+    """Stop watching a room"""
+    await remove_spectator(sid)
+
+@sio_event(AuthPlayerEvent)
+async def matchmaking_join(sid, event: AuthPlayerEvent):
+    """Player enters the quick play queue"""
+    player_id = event.player_id
+    if decode_token(event.token) != player_id:
+        await sio.emit('matchmaking', {'status': 'error', 'message': 'Neautorizovan pristup'}, to=sid)
+        return
+    
+    doc = await db.users.find_one({"_id": ObjectId(player_id)}, MATCHMAKING_PROJECTION)
+    if not doc:
+        await sio.emit('matchmaking', {'status': 'error', 'message': 'Korisnik nije pronadjen'}, to=sid)
+        return
+    
+    player_connections[sid] = player_id
+    entry = enqueue_player(player_id, sid, SlimUser(doc))
+    await sio.emit('matchmaking', {
+        'status': 'queued',
+        'priority': entry["lane"] == PRIORITY_LANE
+    }, to=sid)
+
+@sio_event(PlayerEvent)
+async def matchmaking_leave(sid, event: PlayerEvent):
+    """Player leaves the quick play queue"""
+    player_id = event.player_id
+    # Only the connection that queued the player may take them out
+    entry = matchmaking_entries.get(player_id)
+    if entry and entry["sid"] == sid:
+        dequeue_player(player_id)
+        await sio.emit('matchmaking', {'status': 'cancelled'}, to=sid)
+
+@sio_event(LeaveGameEvent)
+async def leave_game(sid, event: LeaveGameEvent):
     """Player leaves a game room"""
-    room_code = data.get("room_code")
-    player_id = data.get("player_id")
+    room_code = event.room_code
+    player_id = event.player_id
     
-    if room_code:
-        await sio.leave_room(sid, room_code)
-        await sio.emit('player_left', {'player_id': player_id}, room=room_code)
+    remove_room_sid(room_code, sid)
+    await sio.leave_room(sid, room_code)
+    await sio.emit('player_left', {'player_id': player_id}, room=room_code)
 
-@sio.event
-async def player_ready(sid, data):
+@sio_event(PlayerReadyEvent)
+async def player_ready(sid, event: PlayerReadyEvent):
     """Player marks themselves as ready"""
-    room_code = data.get("room_code")
-    player_id = data.get("player_id")
-    is_ready = data.get("is_ready", True)
+    room_code = event.room_code
+    player_id = event.player_id
+    is_ready = event.is_ready
     
     await sio.emit('player_ready_update', {
         'player_id': player_id,
         'is_ready': is_ready
     }, room=room_code)
 
-@sio.event
-async def start_game(sid, data):
+@sio_event(RoomEvent)
+async def start_game(sid, event: RoomEvent):
     """Host starts the game"""
-    room_code = data.get("room_code")
+    room_code = event.room_code
     
     # Update room status in DB
     room = await db.rooms.find_one({"code": room_code})
@@ -853,30 +4742,39 @@ async def start_game(sid, data):
                         "game_started_at": datetime.utcnow(),
                         "round_number": room.get("round_number", 0) + 1,
                         "first_frozen": None
-                    }
+                    },
+                    "$unset": {"finished_at": ""}
                 }
             )
             
-            # Increment games_played for all players
+            start_round_tracker(room_code, players, mraz["id"])
+            
+            # Increment games_played for all players (bots have no stats)
+            await stats_db.users.update_many(
+                {"_id": {"$in": [ObjectId(player["id"]) for player in players if not is_bot(player["id"])]}},
+                {"$inc": {"stats.games_played": 1}}
+            )
             for player in players:
-                await db.users.update_one(
-                    {"_id": ObjectId(player["id"])},
-                    {"$inc": {"stats.games_played": 1}}
-                )
+                publish_game_event("round_started", room_code=room_code, player_id=player["id"])
+            room_reads.forget(room_code)
             
-            await sio.emit('game_started', {
+            game_started = {
                 'mraz_id': mraz["id"],
                 'mraz_username': mraz["username"],
                 'player_statuses': player_statuses,
                 'round_number': room.get("round_number", 0) + 1
-            }, room=room_code)
+            }
+            await sio.emit('game_started', game_started, room=room_code)
+            spectator_event(room_code, 'game_started', game_started)
 
-@sio.event
-async def freeze_player(sid, data):
+@sio_event(FreezePlayerEvent)
+async def freeze_player(sid, event: FreezePlayerEvent):
     """Mraz freezes a player"""
-    room_code = data.get("room_code")
-    frozen_player_id = data.get("frozen_player_id")
-    mraz_id = data.get("mraz_id")
+    room_code = event.room_code
+    frozen_player_id = event.frozen_player_id
+    mraz_id = event.mraz_id
+    if player_connections.get(sid) != mraz_id:
+        return  # only for the connection that joined as the Mraz
     
     room = await db.rooms.find_one({"code": room_code})
     if not room:
@@ -886,9 +4784,21 @@ async def freeze_player(sid, data):
     if room.get("current_mraz") != mraz_id:
         return  # Only Mraz can freeze
     
-    # Verify player is not already frozen
+    # Verify player is in the room and not already frozen
     if frozen_player_id in room.get("frozen_players", []):
         return
+    if not any(p["id"] == frozen_player_id for p in room.get("players", [])):
+        return
+    
+    # Powers are only spent on a freeze that would otherwise go through
+    protection = freeze_protection(frozen_player_id)
+    if protection:
+        await sio.emit('freeze_blocked', {
+            'frozen_player_id': frozen_player_id,
+            'mraz_id': mraz_id,
+            'power_id': protection
+        }, room=room_code)
+        return
     
     # Store first frozen player for next round's Mraz
     first_frozen = room.get("first_frozen")
@@ -909,15 +4819,26 @@ async def freeze_player(sid, data):
     )
     
     # Update player stats
-    await db.users.update_one(
-        {"_id": ObjectId(frozen_player_id)},
-        {"$inc": {"stats.times_frozen": 1}}
-    )
+    if not is_bot(frozen_player_id):
+        await stats_db.users.update_one(
+            {"_id": ObjectId(frozen_player_id)},
+            {"$inc": {"stats.times_frozen": 1}}
+        )
+    track_freeze(room_code, frozen_player_id)
+    room_reads.forget(room_code)
+    publish_game_event("player_frozen", room_code=room_code, player_id=frozen_player_id, mraz_id=mraz_id)
     
-    await sio.emit('player_frozen', {
+    frozen_event = {
         'frozen_player_id': frozen_player_id,
-        'mraz_id': mraz_id
-    }, room=room_code)
+        'mraz_id': mraz_id,
+        'power_id': "super_freeze" if consume_effect(mraz_id, "range") else None
+    }
+    await sio.emit('player_frozen', frozen_event, room=room_code)
+    spectator_event(room_code, 'player_frozen', frozen_event)
+    
+    if consume_effect(frozen_player_id, "auto_thaw"):
+        _, thaw_after, _, _ = POWER_EFFECTS["ultra_thaw"]
+        asyncio.create_task(auto_thaw(room_code, frozen_player_id, thaw_after))
     
     # Check if all players are frozen
     room = await db.rooms.find_one({"code": room_code})
@@ -926,47 +4847,33 @@ async def freeze_player(sid, data):
         frozen = room.get("frozen_players", [])
         
         if set(non_mraz_players) <= set(frozen):
-            # All players frozen - game over
-            # Increment games_won for Mraz
-            await db.users.update_one(
-                {"_id": ObjectId(mraz_id)},
-                {"$inc": {"stats.games_won": 1, "stats.times_as_mraz": 1}}
-            )
-            
-            # Update room status
-            await db.rooms.update_one(
-                {"code": room_code},
-                {"$set": {"status": "finished"}}
-            )
-            
-            # Get winner info
-            winner_user = await db.users.find_one({"_id": ObjectId(mraz_id)})
-            
-            await sio.emit('round_over', {
-                'winner_id': mraz_id,
-                'winner_username': winner_user["username"] if winner_user else "Unknown",
-                'frozen_players': frozen,
-                'next_mraz': first_frozen,
-                'round_number': room.get("round_number", 1)
-            }, room=room_code)
+            # All players frozen - game over, stats are written by the finalizer
+            await finish_round(room, mraz_id, frozen, first_frozen)
 
-@sio.event
-async def unfreeze_player(sid, data):
+@sio_event(UnfreezePlayerEvent)
+async def unfreeze_player(sid, event: UnfreezePlayerEvent):
     """Player unfreezes another player"""
-    room_code = data.get("room_code")
-    frozen_player_id = data.get("frozen_player_id")
-    unfreezer_id = data.get("unfreezer_id")
+    room_code = event.room_code
+    frozen_player_id = event.frozen_player_id
+    unfreezer_id = event.unfreezer_id
+    if player_connections.get(sid) != unfreezer_id:
+        return
     
+    await thaw_player(room_code, frozen_player_id, unfreezer_id)
+
+async def thaw_player(room_code: str, frozen_player_id: str, unfreezer_id: Optional[str]):
+    """Unfreeze a player; unfreezer_id None means they thawed themselves with Ultra Thaw"""
     room = await db.rooms.find_one({"code": room_code})
     if not room:
         return
     
-    # Verify unfreezer is not Mraz and is active
-    if unfreezer_id == room.get("current_mraz"):
-        return  # Mraz cannot unfreeze
-    
-    if unfreezer_id in room.get("frozen_players", []):
-        return  # Frozen players cannot unfreeze
+    if unfreezer_id is not None:
+        # Verify unfreezer is not Mraz and is active
+        if unfreezer_id == room.get("current_mraz"):
+            return  # Mraz cannot unfreeze
+        
+        if unfreezer_id in room.get("frozen_players", []):
+            return  # Frozen players cannot unfreeze
     
     # Verify target is actually frozen
     if frozen_player_id not in room.get("frozen_players", []):
@@ -982,20 +4889,28 @@ async def unfreeze_player(sid, data):
     )
     
     # Update stats
-    await db.users.update_one(
-        {"_id": ObjectId(unfreezer_id)},
-        {"$inc": {"stats.times_unfrozen_others": 1}}
-    )
+    if unfreezer_id is not None and not is_bot(unfreezer_id):
+        await stats_db.users.update_one(
+            {"_id": ObjectId(unfreezer_id)},
+            {"$inc": {"stats.times_unfrozen_others": 1}}
+        )
+    track_unfreeze(room_code, frozen_player_id, unfreezer_id)
+    room_reads.forget(room_code)
+    if unfreezer_id is not None:
+        publish_game_event("player_unfrozen", room_code=room_code, player_id=frozen_player_id, unfreezer_id=unfreezer_id)
     
-    await sio.emit('player_unfrozen', {
+    unfrozen_event = {
         'unfrozen_player_id': frozen_player_id,
-        'unfreezer_id': unfreezer_id
-    }, room=room_code)
+        'unfreezer_id': unfreezer_id,
+        'power_id': "ultra_thaw" if unfreezer_id is None else None
+    }
+    await sio.emit('player_unfrozen', unfrozen_event, room=room_code)
+    spectator_event(room_code, 'player_unfrozen', unfrozen_event)
 
-@sio.event
-async def restart_round(sid, data):
+@sio_event(RoomEvent)
+async def restart_round(sid, event: RoomEvent):
     """Restart a new round in the same room"""
-    room_code = data.get("room_code")
+    room_code = event.room_code
     
     room = await db.rooms.find_one({"code": room_code})
     if not room:
@@ -1018,6 +4933,8 @@ async def restart_round(sid, data):
         else:
             player_statuses[player["id"]] = "active"
     
+    start_round_tracker(room_code, players, next_mraz_id)
+    
     # Update room
     await db.rooms.update_one(
         {"code": room_code},
@@ -1030,64 +4947,103 @@ async def restart_round(sid, data):
                 "game_started_at": datetime.utcnow(),
                 "first_frozen": None
             },
+            "$unset": {"finished_at": ""},
             "$inc": {"round_number": 1}
         }
     )
     
     # Get new round number
+    room_reads.forget(room_code)
     updated_room = await db.rooms.find_one({"code": room_code})
     
-    # Get mraz username
-    mraz_user = await db.users.find_one({"_id": ObjectId(next_mraz_id)})
+    # Get mraz username, from the room roster when possible
+    mraz = next((p for p in players if p["id"] == next_mraz_id), None)
+    mraz_user = mraz or await user_cards.load(next_mraz_id)
     
-    await sio.emit('game_started', {
+    game_started = {
         'mraz_id': next_mraz_id,
         'mraz_username': mraz_user["username"] if mraz_user else "Unknown",
         'player_statuses': player_statuses,
         'round_number': updated_room.get("round_number", 1)
-    }, room=room_code)
+    }
+    await sio.emit('game_started', game_started, room=room_code)
+    spectator_event(room_code, 'game_started', game_started)
 
-@sio.event
-async def use_power(sid, data):
+@sio_event(UsePowerEvent)
+async def use_power(sid, event: UsePowerEvent):
     """Player uses a special power"""
-    room_code = data.get("room_code")
-    player_id = data.get("player_id")
-    power_id = data.get("power_id")
+    room_code = event.room_code
+    player_id = event.player_id
+    power_id = event.power_id
+    
+    # Players can only use powers for the connection they joined with
+    if player_connections.get(sid) != player_id:
+        reason = "not_joined"
+    else:
+        reason = activate_power(player_id, power_id)
+    if reason:
+        await sio.emit('power_rejected', {'power_id': power_id, 'reason': reason}, to=sid)
+        return
     
+    kind, _, active_for, _ = POWER_EFFECTS[power_id]
     await sio.emit('power_used', {
         'player_id': player_id,
-        'power_id': power_id
+        'power_id': power_id,
+        'duration': active_for if kind in ("immunity", "ghost") else None
     }, room=room_code)
 
-@sio.event
-async def proximity_detected(sid, data):
+@sio_event(ProximityEvent)
+async def proximity_detected(sid, event: ProximityEvent):
     """Two devices detected proximity (Bluetooth)"""
-    room_code = data.get("room_code")
-    player1_id = data.get("player1_id")
-    player2_id = data.get("player2_id")
+    room_code = event.room_code
+    player1_id = event.player1_id
+    player2_id = event.player2_id
     
     await sio.emit('proximity_event', {
         'player1_id': player1_id,
         'player2_id': player2_id
     }, room=room_code)
 
-@sio.event
-async def update_location(sid, data):
-    """Player updates their location (for proximity detection)"""
-    room_code = data.get("room_code")
-    player_id = data.get("player_id")
-    latitude = data.get("latitude")
-    longitude = data.get("longitude")
-    
-    await sio.emit('location_update', {
-        'player_id': player_id,
-        'latitude': latitude,
-        'longitude': longitude
-    }, room=room_code)
+@sio_event(RssiSamplesEvent)
+async def rssi_samples(sid, event: RssiSamplesEvent):
+    """Raw RSSI readings of nearby BLE devices, as seen by one player's phone"""
+    global rssi_samples_total
+    if len(event.device_ids) != len(event.rssi) or player_connections.get(sid) != event.player_id:
+        return
+    
+    targets, values = [], []
+    for device_id, rssi in zip(event.device_ids, event.rssi):
+        target = ble_devices.get(device_id)
+        if target is not None:
+            targets.append(target)
+            values.append(rssi)
+    if targets:
+        room = rssi_rooms.get(event.room_code)
+        if room is None:
+            room = rssi_rooms[event.room_code] = RssiRoom()
+        room.add(event.player_id, targets, values)
+        rssi_samples_total += len(targets)
+
+@sio_event(LocationEvent)
+async def update_location(sid, event: LocationEvent):
+    """Player updates their location (for proximity detection)
+
+    Updates are validated and broadcast by the movement tick.
+    """
+    if player_connections.get(sid) != event.player_id:
+        return
+    room = movement_rooms.get(event.room_code)
+    if room is None:
+        room = movement_rooms[event.room_code] = MovementRoom()
+    room.add(event.player_id, sid, event.latitude, event.longitude, time.time())
 
 # Include router
 app.include_router(api_router)
 
+app.add_middleware(TrafficRecorderMiddleware)
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(SlowRouteMiddleware)
+
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -1104,11 +5060,103 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# ==================== STARTUP AND DRAIN ====================
+
+MONGO_WARM_CONNECTIONS = int(os.environ.get('MONGO_WARM_CONNECTIONS', str(max(MONGO_MIN_POOL_SIZE, 10))))
+DRAIN_TIMEOUT = float(os.environ.get('DRAIN_TIMEOUT', '30'))
+
+# phase -> milliseconds spent in it during the last startup
+startup_timings: Dict[str, float] = {}
+
+async def warm_mongo_pool():
+    """Open connections ahead of traffic; concurrent pings each check out their own"""
+    count = min(MONGO_WARM_CONNECTIONS, MONGO_MAX_POOL_SIZE)
+    await asyncio.gather(*(db.command("ping") for _ in range(count)))
+
+async def warm_hash_executor():
+    """Start every hashing thread now instead of on the first logins"""
+    barrier = threading.Barrier(HASH_WORKERS)
+    await asyncio.gather(*(run_hashing(barrier.wait, 5) for _ in range(HASH_WORKERS)))
+
+async def warm_leaderboards():
+    for stat in ("xp", "games_won"):
+        await leaderboard_reads.do(stat, lambda: read_leaderboard(stat))
+
+async def warm_up():
+    """Everything a worker does before it reports ready; each phase is timed"""
+    phases = [
+        ("mongo_pool", warm_mongo_pool),
+        ("indexes", ensure_indexes),
+        ("catalogue", load_catalogue),
+        ("leaderboard", warm_leaderboards),
+        ("hash_executor", warm_hash_executor),
+    ]
+    for name, phase in phases:
+        started = time.perf_counter()
+        try:
+            result = phase()
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception as e:
+            logger.error(f"Warm-up phase {name} failed: {e}")
+        startup_timings[name] = round((time.perf_counter() - started) * 1000, 1)
+
+async def drain(timeout: float = DRAIN_TIMEOUT):
+    """Stop taking new work, let running rounds end, then flush buffered writes"""
+    global server_ready, draining
+    server_ready = False
+    draining = True
+    deadline = time.monotonic() + timeout
+    logger.info(f"Draining: {len(round_trackers)} rounds in progress, waiting up to {timeout:.0f}s")
+    while round_trackers and time.monotonic() < deadline:
+        await asyncio.sleep(0.5)
+    if round_trackers:
+        logger.warning(f"Drain timed out with {len(round_trackers)} rounds still running")
+    await flush_round_results()
+    await flush_achievements()
+    await drain_outbox(deadline)
+
+@metrics_source("startup")
+def startup_metrics() -> Dict:
+    return {
+        "phases_ms": dict(startup_timings),
+        "ready": server_ready,
+        "draining": draining,
+        "uptime": int(time.time() - SERVER_START_TIME),
+    }
+
+@app.on_event("startup")
+async def start_background_tasks():
+    global server_ready
+    started = time.perf_counter()
+    await warm_up()
+    await probe_health(0.0)
+    asyncio.create_task(health_probe_loop())
+    asyncio.create_task(room_sweeper_loop())
+    asyncio.create_task(round_finalizer_loop())
+    asyncio.create_task(matchmaking_loop())
+    asyncio.create_task(rssi_loop())
+    asyncio.create_task(location_loop())
+    asyncio.create_task(spectator_loop())
+    asyncio.create_task(achievements_loop())
+    asyncio.create_task(bot_loop())
+    asyncio.create_task(outbox_loop())
+    if traffic_recorder is not None:
+        asyncio.create_task(traffic_recorder_loop())
+    startup_timings["total"] = round((time.perf_counter() - started) * 1000, 1)
+    server_ready = True
+    logger.info(f"Ready in {startup_timings['total']:.0f}ms")
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await flush_round_results()
+    await drain_outbox(time.monotonic() + 5)
+    if traffic_recorder is not None:
+        traffic_recorder.close()
     client.close()
+    hash_executor.shutdown(wait=False)
 
-# For running with socket.io
+# For running with socket.io; see launcher.py for production
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(socket_app, host="0.0.0.0", port=8001)
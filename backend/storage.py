@@ -0,0 +1,751 @@
+"""In-process storage engine with the Motor API surface used by server.py.
+
+Selected with STORAGE_ENGINE=memory. Documents live in plain dicts and the
+engine implements the query, update and aggregation operators the game uses,
+so the server, tests and benchmarks can run without a MongoDB deployment.
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+_MISSING = object()
+
+# ==================== DOCUMENT HELPERS ====================
+
+def _clone(value):
+    """Copy a document the way a BSON round trip would, without deepcopy's overhead"""
+    if isinstance(value, dict):
+        return {k: _clone(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_clone(v) for v in value]
+    return value
+
+def _get_values(doc, path: List[str]) -> List[Any]:
+    """All values reachable by a dotted path, descending into arrays like MongoDB"""
+    if not path:
+        return [doc]
+    if isinstance(doc, dict):
+        if path[0] not in doc:
+            return []
+        return _get_values(doc[path[0]], path[1:])
+    if isinstance(doc, list):
+        if path[0].isdigit() and int(path[0]) < len(doc):
+            return _get_values(doc[int(path[0])], path[1:])
+        values = []
+        for item in doc:
+            if isinstance(item, (dict, list)):
+                values.extend(_get_values(item, path))
+        return values
+    return []
+
+def _get_field(doc: Dict, key: str, default=None):
+    current = doc
+    for part in key.split("."):
+        if isinstance(current, dict) and part in current:
+            current = current[part]
+        elif isinstance(current, list) and part.isdigit() and int(part) < len(current):
+            current = current[int(part)]
+        else:
+            return default
+    return current
+
+def _hashable(value):
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return repr(value)
+
+def _index_key(doc: Dict, fields: List[str]) -> tuple:
+    """Hashable key of a document's values for the given index fields"""
+    return tuple(_hashable(_get_field(doc, field)) for field in fields)
+
+def _parent(doc: Dict, key: str, create: bool):
+    parts = key.split(".")
+    current = doc
+    for part in parts[:-1]:
+        if isinstance(current, list) and part.isdigit():
+            current = current[int(part)]
+            continue
+        if part not in current or not isinstance(current[part], (dict, list)):
+            if not create:
+                return None, parts[-1]
+            current[part] = {}
+        current = current[part]
+    return current, parts[-1]
+
+def _set_field(doc: Dict, key: str, value):
+    parent, last = _parent(doc, key, create=True)
+    if isinstance(parent, list):
+        parent[int(last)] = value
+    else:
+        parent[last] = value
+
+def _unset_field(doc: Dict, key: str):
+    parent, last = _parent(doc, key, create=False)
+    if isinstance(parent, dict):
+        parent.pop(last, None)
+
+_TYPE_ORDER = {type(None): 0, int: 1, float: 1, bool: 1, str: 2, dict: 3, list: 4, ObjectId: 5, datetime: 7}
+
+def _sort_key(value):
+    if value is _MISSING:
+        return (0, 0)
+    rank = _TYPE_ORDER.get(type(value), 9)
+    if rank in (0, 3, 4, 9):
+        return (rank, str(value))
+    return (rank, value)
+
+def _compare(a, b) -> Optional[int]:
+    """-1/0/1 for values of comparable types, None when the types differ"""
+    if isinstance(a, bool) or isinstance(b, bool):
+        if type(a) is not type(b):
+            return None
+    elif isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return (a > b) - (a < b)
+    if type(a) is not type(b):
+        return None
+    try:
+        return (a > b) - (a < b)
+    except TypeError:
+        return None
+
+# ==================== QUERY MATCHING ====================
+
+def _candidates(doc: Dict, key: str) -> List[Any]:
+    """Values compared against a condition: the field itself plus array elements"""
+    values = _get_values(doc, key.split("."))
+    expanded = []
+    for value in values:
+        expanded.append(value)
+        if isinstance(value, list):
+            expanded.extend(value)
+    return expanded
+
+def _match_operator(doc: Dict, key: str, op: str, arg) -> bool:
+    values = _candidates(doc, key)
+    if op == "$eq":
+        return arg in values if values else arg is None
+    if op == "$ne":
+        return not _match_operator(doc, key, "$eq", arg)
+    if op == "$in":
+        if not values:
+            return None in arg
+        return any(v in arg for v in values)
+    if op == "$nin":
+        return not _match_operator(doc, key, "$in", arg)
+    if op == "$exists":
+        return bool(_get_values(doc, key.split("."))) == bool(arg)
+    if op in ("$gt", "$gte", "$lt", "$lte"):
+        for value in values:
+            result = _compare(value, arg)
+            if result is None:
+                continue
+            if (op == "$gt" and result > 0) or (op == "$gte" and result >= 0) \
+                    or (op == "$lt" and result < 0) or (op == "$lte" and result <= 0):
+                return True
+        return False
+    if op == "$size":
+        return any(isinstance(v, list) and len(v) == arg for v in _get_values(doc, key.split(".")))
+    if op == "$elemMatch":
+        return any(
+            isinstance(v, list) and any(isinstance(item, dict) and matches(item, arg) for item in v)
+            for v in _get_values(doc, key.split("."))
+        )
+    if op == "$not":
+        return not _match_condition(doc, key, arg)
+    raise NotImplementedError(f"Query operator {op} is not supported by the memory engine")
+
+def _match_condition(doc: Dict, key: str, condition) -> bool:
+    if isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition):
+        return all(_match_operator(doc, key, op, arg) for op, arg in condition.items())
+    return _match_operator(doc, key, "$eq", condition)
+
+_EXPR_COMPARISONS = {
+    "$eq": lambda c: c == 0, "$ne": lambda c: c != 0,
+    "$gt": lambda c: c > 0, "$gte": lambda c: c >= 0,
+    "$lt": lambda c: c < 0, "$lte": lambda c: c <= 0,
+}
+
+def _evaluate(doc: Dict, expr):
+    """Value of an aggregation expression, for $expr queries"""
+    if isinstance(expr, str) and expr.startswith("$"):
+        return _get_field(doc, expr[1:])
+    if isinstance(expr, list):
+        return [_evaluate(doc, e) for e in expr]
+    if not (isinstance(expr, dict) and len(expr) == 1 and next(iter(expr)).startswith("$")):
+        return expr
+    (op, args), = expr.items()
+    args = _evaluate(doc, args)
+    if op in _EXPR_COMPARISONS:
+        a, b = args
+        return _EXPR_COMPARISONS[op]((_sort_key(a) > _sort_key(b)) - (_sort_key(a) < _sort_key(b)))
+    if op == "$add":
+        return sum(args)
+    if op == "$size":
+        return len(args[0] if isinstance(args, list) and len(args) == 1 and isinstance(args[0], list) else args)
+    if op == "$and":
+        return all(args)
+    if op == "$or":
+        return any(args)
+    raise NotImplementedError(f"Expression operator {op} is not supported by the memory engine")
+
+def matches(doc: Dict, query: Optional[Dict]) -> bool:
+    for key, condition in (query or {}).items():
+        if key == "$expr":
+            if not _evaluate(doc, condition):
+                return False
+        elif key == "$or":
+            if not any(matches(doc, q) for q in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, q) for q in condition):
+                return False
+        elif key == "$nor":
+            if any(matches(doc, q) for q in condition):
+                return False
+        elif not _match_condition(doc, key, condition):
+            return False
+    return True
+
+# ==================== UPDATES ====================
+
+def _pull_matches(item, condition) -> bool:
+    if isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition):
+        return matches({"v": item}, {"v": condition})
+    if isinstance(condition, dict) and isinstance(item, dict):
+        return matches(item, condition)
+    return item == condition
+
+def apply_update(doc: Dict, update: Dict, inserting: bool = False):
+    if not any(k.startswith("$") for k in update):
+        # Replacement document
+        _id = doc.get("_id")
+        doc.clear()
+        doc.update(_clone(update))
+        if _id is not None:
+            doc["_id"] = _id
+        return
+    for op, fields in update.items():
+        for key, arg in fields.items():
+            current = _get_field(doc, key, _MISSING)
+            if op == "$set":
+                _set_field(doc, key, _clone(arg))
+            elif op == "$setOnInsert":
+                if inserting:
+                    _set_field(doc, key, _clone(arg))
+            elif op == "$unset":
+                _unset_field(doc, key)
+            elif op == "$inc":
+                _set_field(doc, key, (0 if current in (_MISSING, None) else current) + arg)
+            elif op == "$max":
+                if current is _MISSING or (_compare(arg, current) or 0) > 0:
+                    _set_field(doc, key, _clone(arg))
+            elif op == "$min":
+                if current is _MISSING or (_compare(arg, current) or 0) < 0:
+                    _set_field(doc, key, _clone(arg))
+            elif op in ("$push", "$addToSet"):
+                items = arg["$each"] if isinstance(arg, dict) and "$each" in arg else [arg]
+                target = [] if current is _MISSING else current
+                for item in items:
+                    if op == "$push" or item not in target:
+                        target.append(_clone(item))
+                if isinstance(arg, dict) and "$slice" in arg:
+                    limit = arg["$slice"]
+                    target[:] = target[limit:] if limit < 0 else target[:limit]
+                _set_field(doc, key, target)
+            elif op == "$pull":
+                if isinstance(current, list):
+                    current[:] = [item for item in current if not _pull_matches(item, arg)]
+            else:
+                raise NotImplementedError(f"Update operator {op} is not supported by the memory engine")
+
+def _upsert_seed(query: Dict) -> Dict:
+    """Start an upserted document from the equality fields of its query"""
+    doc = {}
+    for key, condition in query.items():
+        if key.startswith("$"):
+            continue
+        if isinstance(condition, dict) and any(k.startswith("$") for k in condition):
+            if "$eq" in condition:
+                _set_field(doc, key, _clone(condition["$eq"]))
+            continue
+        _set_field(doc, key, _clone(condition))
+    return doc
+
+# ==================== PROJECTION & SORT ====================
+
+def _project(doc: Dict, projection) -> Dict:
+    if not projection:
+        return _clone(doc)
+    if isinstance(projection, (list, tuple)):
+        projection = {key: 1 for key in projection}
+    include_id = projection.get("_id", 1)
+    fields = {k: v for k, v in projection.items() if k != "_id"}
+    if fields and all(fields.values()):
+        result = {}
+        for key in fields:
+            _copy_path(doc, result, key.split("."))
+    else:
+        result = _clone(doc)
+        for key in fields:
+            _unset_field(result, key)
+    if include_id and "_id" in doc:
+        result["_id"] = doc["_id"]
+    elif not include_id:
+        result.pop("_id", None)
+    return result
+
+def _copy_path(source, target: Dict, path: List[str]):
+    head = path[0]
+    if not isinstance(source, dict) or head not in source:
+        return
+    value = source[head]
+    if len(path) == 1:
+        target[head] = _clone(value)
+    elif isinstance(value, dict):
+        _copy_path(value, target.setdefault(head, {}), path[1:])
+    elif isinstance(value, list):
+        items = target.setdefault(head, [{} for _ in value])
+        for item, out in zip(value, items):
+            if isinstance(item, dict):
+                _copy_path(item, out, path[1:])
+
+def _normalize_sort(key_or_list, direction=None) -> List[tuple]:
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction or 1)]
+    if isinstance(key_or_list, dict):
+        return list(key_or_list.items())
+    return list(key_or_list)
+
+def _sort_docs(docs: List[Dict], sort: List[tuple]) -> List[Dict]:
+    for key, direction in reversed(sort):
+        docs.sort(key=lambda d: _sort_key(_get_field(d, key, _MISSING)), reverse=direction < 0)
+    return docs
+
+# ==================== RESULTS ====================
+
+class InsertOneResult:
+    def __init__(self, inserted_id):
+        self.inserted_id = inserted_id
+        self.acknowledged = True
+
+class InsertManyResult:
+    def __init__(self, inserted_ids):
+        self.inserted_ids = inserted_ids
+        self.acknowledged = True
+
+class UpdateResult:
+    def __init__(self, matched_count=0, modified_count=0, upserted_id=None):
+        self.matched_count = matched_count
+        self.modified_count = modified_count
+        self.upserted_id = upserted_id
+        self.acknowledged = True
+
+class DeleteResult:
+    def __init__(self, deleted_count=0):
+        self.deleted_count = deleted_count
+        self.acknowledged = True
+
+class BulkWriteResult:
+    def __init__(self):
+        self.inserted_count = 0
+        self.matched_count = 0
+        self.modified_count = 0
+        self.deleted_count = 0
+        self.upserted_count = 0
+        self.upserted_ids = {}
+        self.acknowledged = True
+
+# ==================== CURSORS ====================
+
+class MemoryCursor:
+    """Lazy cursor supporting the chaining and consumption styles Motor offers"""
+
+    def __init__(self, producer):
+        self._producer = producer
+        self._sort: List[tuple] = []
+        self._skip = 0
+        self._limit = 0
+        self._docs: Optional[List[Dict]] = None
+        self._pos = 0  # next document to hand out
+
+    def sort(self, key_or_list, direction=None):
+        self._sort = _normalize_sort(key_or_list, direction)
+        return self
+
+    def skip(self, count: int):
+        self._skip = count
+        return self
+
+    def limit(self, count: int):
+        self._limit = count
+        return self
+
+    def batch_size(self, size: int):
+        return self
+
+    def _materialize(self) -> List[Dict]:
+        if self._docs is None:
+            docs = self._producer(self._sort)
+            docs = docs[self._skip:]
+            if self._limit:
+                docs = docs[:self._limit]
+            self._docs = docs
+        return self._docs
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict]:
+        docs = self._materialize()
+        end = len(docs) if length is None else min(self._pos + length, len(docs))
+        result = docs[self._pos:end]
+        self._pos = end
+        return result
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        docs = self._materialize()
+        if self._pos >= len(docs):
+            raise StopAsyncIteration
+        self._pos += 1
+        return docs[self._pos - 1]
+
+# ==================== COLLECTIONS ====================
+
+class MemoryCollection:
+    def __init__(self, database: "MemoryDatabase", name: str):
+        self.database = database
+        self.name = name
+        self._docs: Dict[Any, Dict] = {}
+        # Unique indexes as (fields, key tuple -> _id) so equality lookups and
+        # duplicate checks on them do not scan the collection
+        self._unique: List[tuple] = []
+        # fields -> partialFilterExpression of unique indexes that only cover some documents
+        self._partial: Dict[tuple, Dict] = {}
+        self.indexes: Dict[str, Dict] = {}
+
+    def with_options(self, **kwargs) -> "MemoryCollection":
+        return self
+
+    # -------- reads --------
+
+    def _scan(self, query: Optional[Dict]) -> List[Dict]:
+        query = query or {}
+        _id = query.get("_id")
+        if _id is None or isinstance(_id, dict):
+            _id = self._unique_lookup(query)
+        if _id is not None and not isinstance(_id, dict):
+            doc = self._docs.get(_id)
+            return [doc] if doc is not None and matches(doc, query) else []
+        return [doc for doc in self._docs.values() if matches(doc, query)]
+
+    def _unique_lookup(self, query: Dict):
+        """_id of the document a plain equality query on a unique index selects, or None"""
+        for fields, entries in self._unique:
+            if tuple(fields) in self._partial:
+                continue
+            if all(f in query and not isinstance(query[f], (dict, list)) for f in fields):
+                return entries.get(tuple(_hashable(query[f]) for f in fields), _MISSING)
+        return None
+
+    async def find_one(self, query: Optional[Dict] = None, projection=None, sort=None, **kwargs):
+        docs = self._scan(query)
+        if sort:
+            docs = _sort_docs(docs, _normalize_sort(sort))
+        return _project(docs[0], projection) if docs else None
+
+    def find(self, query: Optional[Dict] = None, projection=None, sort=None, limit: int = 0, **kwargs) -> MemoryCursor:
+        def produce(order):
+            docs = self._scan(query)
+            if order:
+                docs = _sort_docs(docs, order)
+            return [_project(doc, projection) for doc in docs]
+        cursor = MemoryCursor(produce)
+        if sort:
+            cursor.sort(sort)
+        if limit:
+            cursor.limit(limit)
+        return cursor
+
+    async def count_documents(self, query: Optional[Dict] = None, **kwargs) -> int:
+        return len(self._scan(query))
+
+    async def estimated_document_count(self, **kwargs) -> int:
+        return len(self._docs)
+
+    async def distinct(self, key: str, query: Optional[Dict] = None, **kwargs) -> List[Any]:
+        values = []
+        for doc in self._scan(query):
+            for value in _candidates(doc, key):
+                if not isinstance(value, list) and value not in values:
+                    values.append(value)
+        return values
+
+    def aggregate(self, pipeline: List[Dict], **kwargs) -> MemoryCursor:
+        def produce(order):
+            docs = [_clone(doc) for doc in self._docs.values()]
+            for stage in pipeline:
+                docs = _run_stage(docs, stage)
+            return _sort_docs(docs, order) if order else docs
+        return MemoryCursor(produce)
+
+    # -------- writes --------
+
+    def _covers(self, fields: List[str], doc: Dict) -> bool:
+        partial = self._partial.get(tuple(fields))
+        return partial is None or matches(doc, partial)
+
+    def _check_unique(self, doc: Dict, ignore_id=None):
+        for fields, entries in self._unique:
+            if not self._covers(fields, doc):
+                continue
+            other = entries.get(_index_key(doc, fields), ignore_id)
+            if other != ignore_id:
+                raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: {fields}")
+
+    def _index(self, doc: Dict):
+        for fields, entries in self._unique:
+            if self._covers(fields, doc):
+                entries[_index_key(doc, fields)] = doc["_id"]
+
+    def _unindex(self, doc: Dict):
+        for fields, entries in self._unique:
+            key = _index_key(doc, fields)
+            if self._covers(fields, doc) and entries.get(key) == doc["_id"]:
+                del entries[key]
+
+    def _insert(self, document: Dict):
+        doc = _clone(document)
+        if "_id" not in doc:
+            doc["_id"] = ObjectId()
+        # Motor sets _id on the caller's document as well
+        document["_id"] = doc["_id"]
+        if doc["_id"] in self._docs:
+            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: _id_")
+        self._check_unique(doc)
+        self._docs[doc["_id"]] = doc
+        self._index(doc)
+        return doc["_id"]
+
+    def _update(self, query: Dict, update: Dict, upsert: bool, many: bool) -> UpdateResult:
+        targets = self._scan(query)
+        if not many:
+            targets = targets[:1]
+        if not targets:
+            if not upsert:
+                return UpdateResult()
+            doc = _upsert_seed(query)
+            apply_update(doc, update, inserting=True)
+            return UpdateResult(upserted_id=self._insert(doc))
+        modified = 0
+        for doc in targets:
+            before = _clone(doc)
+            apply_update(doc, update)
+            if doc != before:
+                try:
+                    self._check_unique(doc, ignore_id=doc["_id"])
+                except DuplicateKeyError:
+                    doc.clear()
+                    doc.update(before)
+                    raise
+                self._unindex(before)
+                self._index(doc)
+                modified += 1
+        return UpdateResult(len(targets), modified)
+
+    def _delete(self, query: Dict, many: bool) -> DeleteResult:
+        targets = self._scan(query)
+        if not many:
+            targets = targets[:1]
+        for doc in targets:
+            self._unindex(doc)
+            del self._docs[doc["_id"]]
+        return DeleteResult(len(targets))
+
+    async def insert_one(self, document: Dict, **kwargs) -> InsertOneResult:
+        return InsertOneResult(self._insert(document))
+
+    async def insert_many(self, documents: List[Dict], ordered: bool = True, **kwargs) -> InsertManyResult:
+        return InsertManyResult([self._insert(doc) for doc in documents])
+
+    async def update_one(self, query: Dict, update: Dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        return self._update(query, update, upsert, many=False)
+
+    async def update_many(self, query: Dict, update: Dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        return self._update(query, update, upsert, many=True)
+
+    async def replace_one(self, query: Dict, replacement: Dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        return self._update(query, replacement, upsert, many=False)
+
+    async def find_one_and_update(self, query: Dict, update: Dict, projection=None, upsert: bool = False,
+                                  return_document: bool = False, **kwargs):
+        targets = self._scan(query)
+        before = _project(targets[0], projection) if targets else None
+        result = self._update(query, update, upsert, many=False)
+        if not return_document:
+            return before
+        _id = targets[0]["_id"] if targets else result.upserted_id
+        return _project(self._docs[_id], projection) if _id in self._docs else None
+
+    async def delete_one(self, query: Dict, **kwargs) -> DeleteResult:
+        return self._delete(query, many=False)
+
+    async def delete_many(self, query: Dict, **kwargs) -> DeleteResult:
+        return self._delete(query, many=True)
+
+    async def bulk_write(self, requests: List, ordered: bool = True, **kwargs) -> BulkWriteResult:
+        result = BulkWriteResult()
+        for index, request in enumerate(requests):
+            if isinstance(request, InsertOne):
+                self._insert(request._doc)
+                result.inserted_count += 1
+            elif isinstance(request, (UpdateOne, UpdateMany, ReplaceOne)):
+                outcome = self._update(
+                    request._filter, request._doc, request._upsert,
+                    many=isinstance(request, UpdateMany)
+                )
+                result.matched_count += outcome.matched_count
+                result.modified_count += outcome.modified_count
+                if outcome.upserted_id is not None:
+                    result.upserted_count += 1
+                    result.upserted_ids[index] = outcome.upserted_id
+            elif isinstance(request, (DeleteOne, DeleteMany)):
+                result.deleted_count += self._delete(request._filter, many=isinstance(request, DeleteMany)).deleted_count
+            else:
+                raise NotImplementedError(f"Bulk operation {type(request).__name__} is not supported")
+        return result
+
+    # -------- indexes --------
+
+    async def create_index(self, keys, unique: bool = False, name: Optional[str] = None, **kwargs) -> str:
+        keys = _normalize_sort(keys, 1)
+        name = name or "_".join(f"{k}_{d}" for k, d in keys)
+        self.indexes[name] = {"keys": keys, "unique": unique, **kwargs}
+        if unique and not any(fields == [k for k, _ in keys] for fields, _ in self._unique):
+            fields = [k for k, _ in keys]
+            if kwargs.get("partialFilterExpression"):
+                self._partial[tuple(fields)] = kwargs["partialFilterExpression"]
+            self._unique.append((fields, {
+                _index_key(doc, fields): _id for _id, doc in self._docs.items() if self._covers(fields, doc)
+            }))
+        return name
+
+    async def drop(self):
+        self._docs.clear()
+        for _, entries in self._unique:
+            entries.clear()
+
+# ==================== AGGREGATION ====================
+
+def _expression(doc: Dict, expr):
+    if isinstance(expr, str) and expr.startswith("$"):
+        return _get_field(doc, expr[1:])
+    if isinstance(expr, dict):
+        return {k: _expression(doc, v) for k, v in expr.items()}
+    return expr
+
+def _run_stage(docs: List[Dict], stage: Dict) -> List[Dict]:
+    (name, spec), = stage.items()
+    if name == "$match":
+        return [d for d in docs if matches(d, spec)]
+    if name == "$sort":
+        return _sort_docs(docs, list(spec.items()))
+    if name == "$limit":
+        return docs[:spec]
+    if name == "$skip":
+        return docs[spec:]
+    if name == "$project":
+        return [_project(d, spec) for d in docs]
+    if name == "$count":
+        return [{spec: len(docs)}]
+    if name == "$group":
+        groups: Dict[Any, Dict] = {}
+        for doc in docs:
+            key = _expression(doc, spec["_id"])
+            hashable = repr(key)
+            group = groups.setdefault(hashable, {"_id": key})
+            for field, accumulator in spec.items():
+                if field == "_id":
+                    continue
+                (op, arg), = accumulator.items()
+                value = _expression(doc, arg)
+                if op == "$sum":
+                    group[field] = group.get(field, 0) + (value or 0)
+                elif op == "$max":
+                    if field not in group or (value is not None and (_compare(value, group[field]) or 0) > 0):
+                        group[field] = value
+                elif op == "$min":
+                    if field not in group or (value is not None and (_compare(value, group[field]) or 0) < 0):
+                        group[field] = value
+                elif op == "$first":
+                    group.setdefault(field, value)
+                elif op == "$last":
+                    group[field] = value
+                elif op == "$push":
+                    group.setdefault(field, []).append(value)
+                elif op == "$avg":
+                    total, count = group.get(f"__{field}", (0, 0))
+                    group[f"__{field}"] = (total + (value or 0), count + 1)
+                    group[field] = (total + (value or 0)) / (count + 1)
+                else:
+                    raise NotImplementedError(f"Accumulator {op} is not supported by the memory engine")
+        return [{k: v for k, v in g.items() if not k.startswith("__")} for g in groups.values()]
+    raise NotImplementedError(f"Aggregation stage {name} is not supported by the memory engine")
+
+# ==================== DATABASE & CLIENT ====================
+
+class MemoryDatabase:
+    def __init__(self, client: "MemoryClient", name: str):
+        self.client = client
+        self.name = name
+        self._collections: Dict[str, MemoryCollection] = {}
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        if name not in self._collections:
+            self._collections[name] = MemoryCollection(self, name)
+        return self._collections[name]
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_collection(self, name: str, **kwargs) -> MemoryCollection:
+        return self[name]
+
+    def with_options(self, **kwargs) -> "MemoryDatabase":
+        return self
+
+    async def list_collection_names(self) -> List[str]:
+        return list(self._collections)
+
+    async def command(self, command, *args, **kwargs) -> Dict:
+        name = command if isinstance(command, str) else next(iter(command))
+        if name == "ping":
+            return {"ok": 1.0}
+        if name == "dbStats":
+            return {"ok": 1.0, "collections": len(self._collections),
+                    "objects": sum(len(c._docs) for c in self._collections.values())}
+        raise NotImplementedError(f"Command {name} is not supported by the memory engine")
+
+class MemoryClient:
+    """Drop-in stand-in for AsyncIOMotorClient; databases with options share data"""
+
+    def __init__(self):
+        self._databases: Dict[str, MemoryDatabase] = {}
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        if name not in self._databases:
+            self._databases[name] = MemoryDatabase(self, name)
+        return self._databases[name]
+
+    def get_database(self, name: str, **kwargs) -> MemoryDatabase:
+        return self[name]
+
+    def close(self):
+        pass
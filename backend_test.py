@@ -4,13 +4,14 @@ Backend API Testing for Zaledjen-Odledjen Game
 Testing the new Test Freeze functionality endpoint
 """
 
+import os
 import requests
 import json
 import sys
 from datetime import datetime
 
 # Backend URL from environment
-BACKEND_URL = "https://freezetag-game.preview.emergentagent.com/api"
+BACKEND_URL = os.environ.get("BACKEND_URL", "https://freezetag-game.preview.emergentagent.com/api")
 
 class TestResults:
     def __init__(self):
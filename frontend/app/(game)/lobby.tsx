@@ -82,11 +82,13 @@ export default function LobbyScreen() {
       transports: ['websocket', 'polling'],
     });
 
-    socketRef.current.on('connect', () => {
+    socketRef.current.on('connect', async () => {
       console.log('Socket connected');
+      const token = await AsyncStorage.getItem('authToken');
       socketRef.current?.emit('join_game', {
         room_code: code,
         player_id: userData.id,
+        token,
       });
     });
 
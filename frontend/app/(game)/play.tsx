@@ -81,11 +81,13 @@ export default function PlayScreen() {
       transports: ['websocket', 'polling'],
     });
 
-    socketRef.current.on('connect', () => {
+    socketRef.current.on('connect', async () => {
       console.log('Game socket connected');
+      const token = await AsyncStorage.getItem('authToken');
       socketRef.current?.emit('join_game', {
         room_code: code,
         player_id: userData.id,
+        token,
       });
     });
 
@@ -0,0 +1,82 @@
+"""Shared fixtures: server.py imported on the in-memory storage engine.
+
+Every test starts from empty collections and empty in-process game state, so
+the suite needs neither MongoDB nor a running server.
+"""
+
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+os.environ["STORAGE_ENGINE"] = "memory"
+os.environ.pop("TRAFFIC_RECORD_PATH", None)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+
+# Module-level state cleared between tests
+GAME_STATE = (
+    "active_games", "player_connections", "room_sids", "sid_rooms", "room_activity",
+    "round_trackers", "pending_round_rows", "pending_room_updates", "room_update_attempts",
+    "matchmaking_queues", "matchmaking_entries", "matchmaking_bucket_sizes",
+    "power_inventory", "active_effects", "power_cooldowns",
+    "rssi_rooms", "movement_rooms", "trace_buffers", "pending_traces",
+    "spectator_sids", "sid_spectating", "spectator_events", "spectator_sends",
+    "achievement_progress", "pending_unlocks", "queued_unlocks", "player_sids", "bot_players", "bot_rooms",
+    "outbox_pending", "outbox_scheduled", "outbox_scheduled_ids", "outbox_running", "outbox_running_by_kind", "outbox_results",
+)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(autouse=True)
+def memory_state():
+    for collection in server.db._collections.values():
+        collection._docs.clear()
+        for _, entries in collection._unique:
+            entries.clear()
+    for name in GAME_STATE:
+        getattr(server, name).clear()
+    for reads in (server.room_reads, server.public_room_reads, server.stats_reads, server.leaderboard_reads):
+        reads.cache.clear()
+        reads.inflight.clear()
+    server.draining = False
+    yield
+
+
+async def create_user(username: str = "player", **fields) -> str:
+    result = await server.db.users.insert_one({
+        "username": username,
+        "email": f"{username}@example.com",
+        "password": "",
+        "coins": 100, "gems": 10, "is_premium": False, "subscription_type": None,
+        "owned_powers": [], "owned_skins": ["default"], "equipped_skin": "default",
+        "stats": {"games_played": 0, "games_won": 0, "times_frozen": 0,
+                  "times_unfrozen_others": 0, "times_as_mraz": 0,
+                  "total_play_time": 0, "longest_survival": 0, "xp": 0, "level": 1},
+        "created_at": server.datetime.utcnow(),
+        **fields,
+    })
+    return str(result.inserted_id)
+
+
+@pytest.fixture
+def emitted(monkeypatch):
+    """Socket.IO emits captured as (event, data, to) instead of being sent"""
+    sent = []
+
+    async def emit(event, data=None, to=None, room=None, **kwargs):
+        sent.append((event, data, to or room))
+
+    monkeypatch.setattr(server.sio, "emit", emit)
+    return sent
+
+
+async def connect_sid() -> str:
+    """A Socket.IO sid registered with the manager, without a transport behind it"""
+    return await server.sio.manager.connect(server.uuid.uuid4().hex, "/")
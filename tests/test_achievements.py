@@ -0,0 +1,57 @@
+"""Achievement unlocks are queued, announced and rewarded once"""
+
+import pytest
+
+import server
+
+from .conftest import create_user
+
+pytestmark = pytest.mark.anyio
+
+
+async def load(user_id):
+    doc = await server.db.users.find_one({"_id": server.ObjectId(user_id)}, server.ACHIEVEMENT_PROJECTION)
+    server.load_achievements(user_id, doc)
+
+
+def unlocked(emitted):
+    return [a["id"] for event, data, _ in emitted if event == "achievement_unlocked" for a in data["achievements"]]
+
+
+async def test_rejoin_before_flush_does_not_duplicate_unlocks(emitted):
+    user_id = await create_user("ana", achievements=[])
+    await server.db.users.update_one({"_id": server.ObjectId(user_id)}, {"$set": {"stats.games_played": 1}})
+    server.player_sids[user_id] = "sid"
+    await load(user_id)
+    await load(user_id)  # reconnect before the flush
+    assert server.pending_unlocks == [(user_id, "first_game")]
+
+    before = server.achievements_unlocked_total
+    await server.flush_achievements()
+    await load(user_id)  # and again after it: already stored
+    await server.flush_achievements()
+    assert unlocked(emitted) == ["first_game"]
+    assert server.achievements_unlocked_total == before + 1
+    doc = await server.db.users.find_one({"_id": server.ObjectId(user_id)})
+    assert doc["achievements"] == ["first_game"] and doc["coins"] == 110
+    assert server.queued_unlocks == {}
+
+
+async def test_event_unlocks_and_failed_writes_are_retried(emitted, monkeypatch):
+    user_id = await create_user("ana", achievements=[])
+    server.player_sids[user_id] = "sid"
+    await load(user_id)
+    server.publish_game_event("player_frozen", room_code="ROOM01", player_id=user_id, mraz_id="a" * 24)
+    server.publish_game_event("player_frozen", room_code="ROOM01", player_id=user_id, mraz_id="a" * 24)
+
+    async def down(requests, **kwargs):
+        raise ConnectionError("down")
+
+    with monkeypatch.context() as m:
+        m.setattr(server.db.users, "bulk_write", down)
+        await server.flush_achievements()
+    await load(user_id)  # rejoin while the unlock waits for a retry
+    assert server.pending_unlocks == [(user_id, "brrr")] and emitted == []
+
+    await server.flush_achievements()
+    assert unlocked(emitted) == ["brrr"]
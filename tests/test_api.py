@@ -0,0 +1,51 @@
+"""REST routes end to end through the ASGI app, on the in-memory engine"""
+
+import httpx
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def api():
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test/api") as client:
+        yield client
+
+
+async def register(api, name):
+    response = await api.post("/auth/register", json={
+        "username": name, "email": f"{name}@example.com", "password": "secret123"
+    })
+    assert response.status_code == 200
+    return response.json()
+
+
+async def test_register_login_and_profile(api):
+    registered = await register(api, "ana")
+    response = await api.post("/auth/login", json={"email": "ana@example.com", "password": "wrong"})
+    assert response.status_code == 401
+    response = await api.post("/auth/login", json={"email": "ana@example.com", "password": "secret123"})
+    assert response.status_code == 200
+    me = (await api.get("/auth/me", params={"token": response.json()["token"]})).json()
+    assert me["id"] == registered["user"]["id"] and me["username"] == "ana"
+
+
+async def test_create_join_and_read_room(api):
+    host = await register(api, "host")
+    guest = await register(api, "guest")
+    response = await api.post("/rooms/create", params={"token": host["token"]},
+                              json={"name": "Park", "max_players": 2, "is_private": False})
+    code = response.json()["room"]["code"]
+
+    response = await api.post("/rooms/join", params={"token": guest["token"]}, json={"room_code": code.lower()})
+    assert [p["username"] for p in response.json()["room"]["players"]] == ["host", "guest"]
+    room = (await api.get(f"/rooms/{code}")).json()
+    assert len(room["players"]) == 2
+
+    third = await register(api, "third")
+    response = await api.post("/rooms/join", params={"token": third["token"]}, json={"room_code": code})
+    assert response.status_code == 400
+    assert (await api.get("/rooms/NOPE00")).status_code == 404
@@ -0,0 +1,56 @@
+"""Bot rooms: no autoplay rounds while draining, and bots alone do not keep a room occupied"""
+
+import time
+
+import pytest
+
+import server
+from .conftest import connect_sid
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def load_room(emitted):
+    room = {"code": "BOTS01", "name": "Bot load", "players": [], "status": "waiting", "max_players": 4,
+            "is_private": True, "settings": dict(server.DEFAULT_ROOM_SETTINGS), "created_at": server.datetime.utcnow()}
+    await server.db.rooms.insert_one(room)
+    bots = await server.add_bots(room, 4, autoplay=True)
+    await server.db.rooms.update_one({"code": "BOTS01"}, {"$set": {"host_id": bots[0]["id"]}})
+    bot_room = server.bot_rooms["BOTS01"]
+    bot_room.idle_since -= server.BOT_RESTART_DELAY + 1
+    return bot_room
+
+
+async def test_no_autoplay_rounds_while_draining(load_room, monkeypatch):
+    monkeypatch.setattr(server, "draining", True)
+    await server.run_bot_tick(1.0)
+    assert "BOTS01" not in server.round_trackers and load_room.rounds == 0
+
+    monkeypatch.setattr(server, "draining", False)
+    await server.run_bot_tick(1.0)
+    assert "BOTS01" in server.round_trackers and load_room.rounds == 1
+
+
+async def test_rooms_left_to_bots_are_evicted_and_archived(emitted):
+    finished_at = server.datetime.utcnow() - server.timedelta(seconds=server.ROOM_ARCHIVE_AFTER_SECONDS + 1)
+    for code in ("LEFT01", "DONE01"):
+        room = {"code": code, "name": code, "players": [{"id": "a" * 24, "username": "a"}], "status": "finished",
+                "finished_at": finished_at, "max_players": 4, "settings": dict(server.DEFAULT_ROOM_SETTINGS)}
+        await server.db.rooms.insert_one(room)
+        await server.add_bots(room, 2)
+        human = await connect_sid()
+        server.add_room_sid(code, human)
+        server.remove_room_sid(code, human)
+    server.room_activity["LEFT01"] = time.time() - server.ROOM_IDLE_EVICT_SECONDS - 1
+
+    assert await server.evict_idle_rooms() == 1
+    assert "LEFT01" not in server.bot_rooms and "LEFT01" not in server.room_sids
+    assert await server.archive_rooms() == 2
+    assert "DONE01" not in server.bot_rooms and not server.room_sids and not server.bot_players
+
+
+async def test_autoplay_rooms_stay_live(load_room):
+    server.room_activity["BOTS01"] = time.time() - server.ROOM_IDLE_EVICT_SECONDS - 1
+    await server.run_bot_tick(1.0)
+    assert await server.evict_idle_rooms() == 0 and "BOTS01" in server.bot_rooms
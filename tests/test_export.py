@@ -0,0 +1,73 @@
+"""Incremental exports resume after the last document, also on shared timestamps"""
+
+import json
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+
+import server
+from .conftest import create_user
+
+pytestmark = pytest.mark.anyio
+
+START = datetime(2025, 1, 1)
+
+
+async def finish_rounds(*offsets):
+    await server.db.room_history.insert_many([
+        {"room_code": f"R{i}", "finished_at": START + timedelta(seconds=offset)}
+        for i, offset in enumerate(offsets)
+    ])
+
+
+async def export(job):
+    rows = []
+    async for batch in job.batches():
+        rows.extend(doc["room_code"] for doc in batch)
+    return rows
+
+
+async def test_resume_keeps_documents_sharing_the_last_timestamp():
+    await finish_rounds(0, 1, 1, 1, 2)
+    # Stopped after R1: R2 and R3 share its timestamp and must still follow
+    partial = server.ExportJob("room_history", "finished_at", batch_size=2, secondary=False)
+    batches = partial.batches()
+    assert [doc["room_code"] for doc in await batches.__anext__()] == ["R0", "R1"]
+    await batches.__anext__()
+    assert partial.last.startswith((START + timedelta(seconds=1)).isoformat() + "|")
+
+    resumed = server.ExportJob("room_history", "finished_at", partial.last, secondary=False)
+    assert await export(resumed) == ["R2", "R3", "R4"]
+
+
+async def test_bare_time_since_means_strictly_after():
+    await finish_rounds(0, 1, 1, 2)
+    job = server.ExportJob("room_history", "finished_at", (START + timedelta(seconds=1)).isoformat(), secondary=False)
+    assert await export(job) == ["R3"]
+
+
+async def test_route_returns_the_next_watermark_value():
+    admin = await create_user("admin", is_admin=True)
+    token = server.create_token(admin)
+    await finish_rounds(0, 1, 1)
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test/api") as api:
+        response = await api.get("/admin/export/room_history", params={
+            "token": token, "watermark": "finished_at", "secondary": False
+        })
+        assert response.status_code == 200
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        assert [row["room_code"] for row in rows] == ["R0", "R1", "R2"]
+        since = response.headers["X-Export-Since"]
+        assert since == f"{rows[-1]['finished_at']}|{rows[-1]['_id']}"
+
+        # Added after the snapshot: ties with the watermark and later rounds
+        await server.db.room_history.insert_many([
+            {"room_code": "R3", "finished_at": START + timedelta(seconds=1)},
+            {"room_code": "R4", "finished_at": START + timedelta(seconds=3)},
+        ])
+        response = await api.get("/admin/export/room_history", params={
+            "token": token, "watermark": "finished_at", "since": since, "secondary": False
+        })
+        assert [json.loads(line)["room_code"] for line in response.text.splitlines()] == ["R3", "R4"]
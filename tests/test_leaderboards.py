@@ -0,0 +1,25 @@
+"""Period leaderboard calendar: bucket keys and expiry of each period"""
+
+from datetime import datetime
+
+import pytest
+
+import server
+
+
+@pytest.mark.parametrize("at, day, week, season", [
+    (datetime(2025, 1, 1, 12), "2025-01-01", "2025-W01", "2025-Q1"),
+    (datetime(2024, 12, 30), "2024-12-30", "2025-W01", "2024-Q4"),
+    (datetime(2025, 6, 30, 23, 59), "2025-06-30", "2025-W27", "2025-Q2"),
+])
+def test_period_keys(at, day, week, season):
+    assert [server.period_key(p, at) for p in server.LEADERBOARD_PERIODS] == [day, week, season]
+
+
+@pytest.mark.parametrize("at, day, week, season", [
+    (datetime(2025, 1, 1, 12), datetime(2025, 1, 2), datetime(2025, 1, 6), datetime(2025, 4, 1)),
+    (datetime(2025, 11, 16), datetime(2025, 11, 17), datetime(2025, 11, 17), datetime(2026, 1, 1)),
+    (datetime(2025, 9, 30, 23), datetime(2025, 10, 1), datetime(2025, 10, 6), datetime(2025, 10, 1)),
+])
+def test_period_ends(at, day, week, season):
+    assert [server.period_end(p, at) for p in server.LEADERBOARD_PERIODS] == [day, week, season]
@@ -0,0 +1,92 @@
+"""Quick play: authenticated joins, size-guarded room fills, no lost players"""
+
+import pytest
+
+import server
+
+from .conftest import connect_sid, create_user
+
+pytestmark = pytest.mark.anyio
+
+
+async def join(player_id, token=None):
+    sid = await connect_sid()
+    await server.matchmaking_join(sid, {"player_id": player_id, "token": token or server.create_token(player_id)})
+    return sid
+
+
+def statuses(emitted, sid):
+    return [data["status"] for event, data, to in emitted if event == "matchmaking" and to == sid]
+
+
+async def test_join_requires_the_players_token(emitted):
+    premium = await create_user("vip", subscription_type="pro_monthly")
+    attacker = await create_user("eve")
+
+    sid = await join(premium, token=server.create_token(attacker))
+    assert statuses(emitted, sid) == ["error"] and premium not in server.matchmaking_entries
+    # Without a token the payload does not even reach the handler
+    await server.sio._trigger_event("matchmaking_join", "/", sid, {"player_id": premium})
+    assert premium not in server.matchmaking_entries
+
+    sid = await join(premium)
+    assert statuses(emitted, sid) == ["queued"]
+    assert server.matchmaking_entries[premium]["lane"] == server.PRIORITY_LANE
+
+
+async def test_only_the_queued_connection_can_leave(emitted):
+    player = await create_user("ana")
+    sid = await join(player)
+    other = await connect_sid()
+    await server.matchmaking_leave(other, {"player_id": player})
+    assert statuses(emitted, other) == [] and player in server.matchmaking_entries
+
+    await server.matchmaking_leave(sid, {"player_id": player})
+    assert statuses(emitted, sid) == ["queued", "cancelled"] and player not in server.matchmaking_entries
+
+
+async def test_fill_racing_join_room_requeues_instead_of_overfilling(emitted, monkeypatch):
+    host = await create_user("host")
+    await server.db.rooms.insert_one({
+        "code": "OPEN01", "players": [{"id": host}], "max_players": 3,
+        "is_private": False, "status": "waiting",
+    })
+    players = [await create_user(f"p{i}") for i in range(2)]
+    for player_id in players:
+        await join(player_id)
+
+    real_update = server.db.rooms.update_one
+
+    async def join_room_lands_first(query, update, **kwargs):
+        await real_update({"code": "OPEN01"}, {"$push": {"players": {"id": "late"}}})
+        monkeypatch.setattr(server.db.rooms, "update_one", real_update)
+        return await real_update(query, update, **kwargs)
+
+    monkeypatch.setattr(server.db.rooms, "update_one", join_room_lands_first)
+    await server.run_matchmaking_tick()
+
+    open_room = await server.db.rooms.find_one({"code": "OPEN01"})
+    assert len(open_room["players"]) == 2
+    # Both went back to the queue and were grouped into a new room in the same tick
+    new_room = await server.db.rooms.find_one({"code": {"$ne": "OPEN01"}})
+    assert sorted(p["id"] for p in new_room["players"]) == sorted(players)
+    assert server.matchmaking_entries == {}
+
+
+async def test_failed_room_insert_requeues_players(emitted, monkeypatch):
+    players = [await create_user(f"p{i}") for i in range(3)]
+    sids = [await join(player_id) for player_id in players]
+
+    async def insert_fails(docs, **kwargs):
+        # One of them hangs up while the insert is in flight
+        await server.sio.manager.disconnect(sids[0], "/")
+        raise ConnectionError("no primary")
+
+    with monkeypatch.context() as m:
+        m.setattr(server.db.rooms, "insert_many", insert_fails)
+        await server.run_matchmaking_tick()
+    assert set(server.matchmaking_entries) == set(players[1:])
+    assert all(statuses(emitted, sid) == ["queued"] for sid in sids)
+
+    await server.run_matchmaking_tick()
+    assert [statuses(emitted, sid) for sid in sids] == [["queued"], ["queued", "matched"], ["queued", "matched"]]
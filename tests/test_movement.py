@@ -0,0 +1,91 @@
+"""Vectorised movement validation against each player's last accepted fix"""
+
+import numpy as np
+import pytest
+
+import server
+from .conftest import connect_sid, create_user
+
+METRES_PER_DEGREE = np.radians(1) * server.EARTH_RADIUS_M
+
+
+def north(metres, lat=45.0):
+    return lat + metres / METRES_PER_DEGREE
+
+
+def tick(room, *fixes):
+    """Buffer (player, latitude, longitude, at) fixes and validate them as one batch"""
+    for player_id, latitude, longitude, at in fixes:
+        room.add(player_id, f"sid-{player_id}-{at}", latitude, longitude, at)
+    return room.validate()
+
+
+@pytest.fixture
+def room():
+    room = server.MovementRoom()
+    accepted, rejected = tick(room, ("p1", 45.0, 15.0, 0.0))
+    assert accepted and not rejected
+    return room
+
+
+def test_walking_is_accepted_and_newest_fix_returned(room):
+    accepted, rejected = tick(room, *[("p1", north(1.5 * i), 15.0, i) for i in range(1, 6)])
+    assert rejected == []
+    assert accepted == [(0, pytest.approx(north(7.5)), 15.0, False)]
+    assert room.count[0] == 6
+
+
+def test_rejected_fix_is_not_a_stepping_stone(room):
+    # 111 km north, then the same spot again 50 ms later
+    accepted, rejected = tick(room, ("p1", 46.0, 15.0, 1.0), ("p1", 46.0, 15.0, 1.05))
+    assert accepted == []
+    assert [reason for _, reason in rejected] == ["jump", "jump"]
+    assert room.count[0] == 1 and room.lat[0, 0] == 45.0
+
+
+def test_rejected_speed_does_not_feed_the_accel_check(room):
+    accepted, rejected = tick(
+        room,
+        ("p1", north(60), 15.0, 1.0),   # 60 m/s: rejected as too fast
+        ("p1", north(2), 15.0, 2.0),    # 1 m/s from the last accepted fix
+    )
+    assert [reason for _, reason in rejected] == ["speed"]
+    assert accepted == [(0, pytest.approx(north(2)), 15.0, False)]
+    assert room.speed[0] == pytest.approx(1.0)
+
+
+def test_stale_player_reanchors_despite_speed(room):
+    # Gone for longer than LOCATION_REANCHOR_SECONDS, back 5 km away
+    at = server.LOCATION_REANCHOR_SECONDS + 1
+    accepted, rejected = tick(room, ("p1", north(5000), 15.0, at))
+    assert rejected == []
+    assert accepted == [(0, pytest.approx(north(5000)), 15.0, False)]
+    # The next step is measured from the new anchor, from standstill
+    accepted, rejected = tick(room, ("p1", north(5003), 15.0, at + 1))
+    assert rejected == [] and accepted[0][3] is False
+
+
+def test_players_are_validated_independently(room):
+    fixes = [("p2", 44.0, 20.0, 0.0)]
+    fixes += [("p1", 46.0, 15.0, 1.0), ("p2", north(3, 44.0), 20.0, 1.0), ("p1", north(3), 15.0, 2.0)]
+    accepted, rejected = tick(room, *fixes)
+    assert [reason for _, reason in rejected] == ["jump"]
+    assert sorted(i for i, *_ in accepted) == [0, 1]
+
+
+@pytest.mark.anyio
+async def test_locations_only_from_a_socket_joined_with_the_players_token(emitted):
+    victim = await create_user("victim")
+    attacker = await create_user("attacker")
+    sid = await connect_sid()
+    await server.join_game(sid, {"room_code": "GAME01", "player_id": victim,
+                                 "token": server.create_token(attacker)})
+    await server.update_location(sid, {"room_code": "GAME01", "player_id": victim,
+                                       "latitude": 46.0, "longitude": 15.0})
+    assert "GAME01" not in server.movement_rooms
+
+    await server.join_game(sid, {"room_code": "GAME01", "player_id": victim,
+                                 "token": server.create_token(victim)})
+    await server.update_location(sid, {"room_code": "GAME01", "player_id": victim,
+                                       "latitude": 46.0, "longitude": 15.0})
+    assert "GAME01" in server.movement_rooms
@@ -0,0 +1,109 @@
+"""Outbox: persisted before dispatch, retried with backoff, at most one run per record"""
+
+import asyncio
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def effects(monkeypatch):
+    """A 'probe' side effect that fails while calls["fail"] > 0"""
+    calls = {"runs": [], "fail": 0}
+
+    async def probe(payload, key):
+        calls["runs"].append(key)
+        if calls["fail"]:
+            calls["fail"] -= 1
+            raise RuntimeError("unavailable")
+
+    monkeypatch.setitem(server.outbox_handlers, "probe", (probe, 2))
+    monkeypatch.setattr(server, "OUTBOX_RETRY_BASE", 0.0)
+    return calls
+
+
+async def settle():
+    # Handlers run inside wait_for, a couple of loop iterations after dispatch
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+
+async def tick():
+    await server.flush_outbox()
+    await settle()
+    await asyncio.gather(*server.outbox_running.values())
+    await server.flush_outbox_results()
+
+
+async def test_records_are_persisted_then_run_once(effects):
+    key = server.enqueue_side_effect("probe", {"n": 1}, key="k1")
+    server.enqueue_side_effect("probe", {"n": 1}, key="k1")
+    assert key == "k1" and await server.db.outbox.count_documents({}) == 0
+    await tick()
+    doc = await server.db.outbox.find_one({"_id": "k1"})
+    assert doc["status"] == "done" and doc["attempts"] == 1
+    # Enqueued twice under one key: stored and run once
+    assert effects["runs"] == ["k1"]
+
+
+async def test_failures_retry_then_fail_permanently(effects, monkeypatch):
+    monkeypatch.setattr(server, "OUTBOX_MAX_ATTEMPTS", 3)
+    effects["fail"] = 1
+    server.enqueue_side_effect("probe", {}, key="retry")
+    await tick()
+    assert (await server.db.outbox.find_one({"_id": "retry"}))["status"] == "pending"
+    await tick()
+    assert (await server.db.outbox.find_one({"_id": "retry"}))["status"] == "done"
+
+    effects["fail"] = 10
+    server.enqueue_side_effect("probe", {}, key="doomed")
+    for _ in range(3):
+        await tick()
+    doc = await server.db.outbox.find_one({"_id": "doomed"})
+    assert doc["status"] == "failed" and doc["attempts"] == 3 and "unavailable" in doc["error"]
+
+
+async def test_per_kind_concurrency_cap(effects):
+    release = asyncio.Event()
+    running = []
+
+    async def slow(payload, key):
+        running.append(key)
+        await release.wait()
+
+    server.outbox_handlers["probe"] = (slow, 2)
+    for i in range(5):
+        server.enqueue_side_effect("probe", {}, key=f"s{i}")
+    await server.flush_outbox()
+    await settle()
+    assert len(running) == 2 and len(server.outbox_scheduled) == 3
+    release.set()
+    while server.outbox_running or server.outbox_scheduled:
+        await asyncio.gather(*server.outbox_running.values())
+        server.dispatch_outbox()
+        await settle()
+    assert sorted(running) == [f"s{i}" for i in range(5)]
+
+
+async def test_recovery_skips_records_waiting_past_their_lease(effects, monkeypatch):
+    effects["fail"] = 1
+    server.enqueue_side_effect("probe", {}, key="slow-retry")
+    await tick()
+    # The retry is still queued here when its lease runs out
+    server.outbox_scheduled[:] = [(due + 3600, seq, record) for due, seq, record in server.outbox_scheduled]
+    await server.db.outbox.update_one({"_id": "slow-retry"}, {"$set": {
+        "lease_until": server.datetime.utcnow() - server.timedelta(seconds=1)
+    }})
+    assert await server.recover_outbox() == 0
+    assert len(server.outbox_scheduled) == 1 and server.outbox_scheduled_ids == {"slow-retry"}
+
+    # Once it has left this worker, an expired lease is claimed again
+    server.outbox_scheduled.clear()
+    server.outbox_scheduled_ids.clear()
+    assert await server.recover_outbox() == 1
+    await tick()
+    assert effects["runs"] == ["slow-retry", "slow-retry"]
+    assert (await server.db.outbox.find_one({"_id": "slow-retry"}))["status"] == "done"
@@ -0,0 +1,80 @@
+"""Freeze protection powers are only spent on valid freezes, by the player's own connection"""
+
+import time
+
+import pytest
+
+import server
+from .conftest import connect_sid, create_user
+
+pytestmark = pytest.mark.anyio
+
+MRAZ, RUNNER, FROZEN = "a" * 24, "b" * 24, "c" * 24
+
+
+@pytest.fixture
+async def room():
+    await server.db.rooms.insert_one({
+        "code": "GAME01", "status": "playing", "current_mraz": MRAZ,
+        "players": [{"id": pid, "username": pid[:1]} for pid in (MRAZ, RUNNER, FROZEN)],
+        "frozen_players": [FROZEN],
+    })
+    server.active_effects[RUNNER] = {"escape_time": (time.monotonic() + 60, "second_chance")}
+    for pid in (MRAZ, RUNNER, FROZEN):
+        server.player_connections[sid_of(pid)] = pid
+
+
+def sid_of(player_id):
+    return f"sid-{player_id[:1]}"
+
+
+async def freeze(target, mraz_id=MRAZ, room_code="GAME01", sid=None):
+    await server.freeze_player(sid or sid_of(mraz_id), {"room_code": room_code, "frozen_player_id": target, "mraz_id": mraz_id})
+
+
+async def test_forged_freezes_do_not_spend_second_chance(room, emitted):
+    await freeze(RUNNER, mraz_id=FROZEN)        # not the Mraz
+    await freeze(RUNNER, room_code="NOPE00")    # no such room
+    server.active_effects[FROZEN] = {"escape_time": (time.monotonic() + 60, "second_chance")}
+    await freeze(FROZEN)                        # already frozen
+    assert emitted == []
+    assert "escape_time" in server.active_effects[RUNNER]
+    assert "escape_time" in server.active_effects[FROZEN]
+
+
+async def test_valid_freeze_uses_second_chance(room, emitted):
+    await freeze(RUNNER)
+    assert [(event, data["power_id"]) for event, data, _ in emitted] == [("freeze_blocked", "second_chance")]
+    assert "escape_time" not in server.active_effects[RUNNER]
+    room = await server.db.rooms.find_one({"code": "GAME01"})
+    assert room["frozen_players"] == [FROZEN]
+
+
+async def test_freeze_and_thaw_need_the_acting_players_connection(room, emitted):
+    await freeze(RUNNER, sid=sid_of(RUNNER))    # a runner's socket claiming to be the Mraz
+    await server.unfreeze_player(sid_of(MRAZ), {"room_code": "GAME01", "frozen_player_id": FROZEN,
+                                                "unfreezer_id": RUNNER})
+    assert emitted == []
+    room = await server.db.rooms.find_one({"code": "GAME01"})
+    assert room["frozen_players"] == [FROZEN]
+    assert "escape_time" in server.active_effects[RUNNER]
+
+
+async def test_join_game_needs_the_players_token(emitted):
+    victim = await create_user("victim", owned_powers=["shield"])
+    attacker = await create_user("attacker")
+    sid = await connect_sid()
+    await server.join_game(sid, {"room_code": "GAME01", "player_id": victim,
+                                 "token": server.create_token(attacker)})
+    assert emitted == [("join_rejected", {"room_code": "GAME01", "message": "Neautorizovan pristup"}, sid)]
+    assert sid not in server.player_connections and victim not in server.player_sids
+
+    emitted.clear()
+    await server.use_power(sid, {"room_code": "GAME01", "player_id": victim, "power_id": "shield"})
+    assert [(event, data["reason"]) for event, data, _ in emitted] == [("power_rejected", "not_joined")]
+
+    emitted.clear()
+    await server.join_game(sid, {"room_code": "GAME01", "player_id": victim,
+                                 "token": server.create_token(victim)})
+    assert server.player_connections[sid] == victim and server.player_sids[victim] == sid
+    assert emitted[-1] == ("player_joined", {"player_id": victim}, "GAME01")
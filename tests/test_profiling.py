@@ -0,0 +1,35 @@
+"""Profiling sessions end on their own timer only, and memory reports cover every per-room map"""
+
+import pytest
+
+import server
+from .conftest import connect_sid, create_user
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_stopped_session_timer_does_not_end_the_next_one():
+    token = server.create_token(await create_user("admin", is_admin=True))
+    await server.start_profiling(token, seconds=60)
+    first = server.profile_session["timer"]
+    assert (await server.end_profiling(token)) == {"stopped": True}
+    assert first.cancelled()
+
+    await server.start_profiling(token, seconds=60)
+    try:
+        second = server.profile_session["timer"]
+        assert second is not first and not second.cancelled()
+        assert server.profile_session["profiler"] is not None
+    finally:
+        server.stop_profiling()
+    assert second.cancelled()
+
+
+async def test_room_memory_counts_bots_and_spectators():
+    bot_room = server.bot_rooms["BOTS01"] = server.BotRoom("BOTS01", autoplay=True, anchored=False)
+    bot_room.add([str(server.ObjectId())])
+    await server.add_spectator(await connect_sid(), "WATCH1")
+    server.spectator_event("WATCH1", "round_over", {})
+    usage = server.room_memory()
+    assert usage["BOTS01"]["bots"] > 0
+    assert {"spectators", "spectator_events"} <= set(usage["WATCH1"])
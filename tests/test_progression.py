@@ -0,0 +1,45 @@
+"""XP levels and per-user round aggregation, computed in batch"""
+
+import numpy as np
+
+import server
+
+
+def test_levels_for_xp_matches_threshold_table():
+    thresholds = server.LEVEL_THRESHOLDS
+    xp = np.array([0, thresholds[0] - 1, thresholds[0], thresholds[1], thresholds[-1], thresholds[-1] * 10])
+    assert server.levels_for_xp(xp).tolist() == [1, 1, 2, 3, server.MAX_LEVEL, server.MAX_LEVEL]
+    # Same answer as a linear scan for every XP value up to level 10
+    values = np.arange(int(thresholds[9]) + 1)
+    linear = 1 + (values[:, None] >= thresholds[None, :]).sum(axis=1)
+    assert np.array_equal(server.levels_for_xp(values), linear)
+
+
+def row(user_id, room="ROOM01", **fields):
+    base = {"user_id": user_id, "play_time": 60, "survival": 30, "freezes": 0, "unfreezes": 0,
+            "won": False, "room_code": room, "username": user_id}
+    return {**base, **fields}
+
+
+def test_round_user_updates_aggregate_per_user():
+    a, b = "a" * 24, "b" * 24
+    rows = [
+        row(a, survival=40, unfreezes=2),
+        row(a, room="ROOM02", survival=10, won=True, freezes=3),
+        row(b, survival=90),
+    ]
+    accounts = {a: {"stats": {"xp": 0, "level": 1}}, b: {"stats": {"xp": 0, "level": 1}, "subscription_type": "pro_monthly"}}
+    updates, level_ups, gains = server.build_round_user_updates(rows, accounts)
+
+    assert list(gains) == [a, b]
+    expected_a = (2 * server.XP_PER_ROUND + 50 * server.XP_PER_SURVIVAL_SECOND + 3 * server.XP_PER_FREEZE
+                  + 2 * server.XP_PER_UNFREEZE + server.XP_PER_WIN)
+    assert gains[a] == {"xp": expected_a, "wins": 1, "rounds": 2, "freezes": 3, "unfreezes": 2}
+    assert gains[b]["xp"] == int((server.XP_PER_ROUND + 90) * server.XP_BOOST_MULTIPLIER)
+
+    update_a = updates[0]._doc
+    assert update_a["$inc"]["stats.total_play_time"] == 120
+    assert update_a["$max"]["stats.longest_survival"] == 40
+    assert update_a["$max"]["stats.level"] == 2
+    # Level-ups are announced in the room of the user's latest round
+    assert level_ups == [("ROOM02", a, 2), ("ROOM01", b, 2)]
@@ -0,0 +1,70 @@
+"""Kalman-smoothed RSSI pairs and their hysteretic proximity events"""
+
+import numpy as np
+
+import server
+
+
+def feed(room, rssi, now, observer="p1", target="p2"):
+    room.add(observer, [target], [rssi])
+    return room.process(now)
+
+
+def test_single_spike_does_not_enter_proximity():
+    room = server.RssiRoom()
+    for t in range(5):
+        assert feed(room, -85, t) == ([], [])
+    # One strong sample is smoothed away by the history
+    assert feed(room, -50, 5) == ([], [])
+
+
+def test_hysteresis_between_near_and_far_thresholds():
+    room = server.RssiRoom()
+    entered, t = [], 0
+    while not entered:
+        entered, _ = feed(room, -55, t)
+        t += 1
+    assert entered == [(0, 1)]
+    # Between the two thresholds the pair stays near
+    midway = (server.RSSI_NEAR_DBM + server.RSSI_FAR_DBM) / 2
+    for _ in range(20):
+        assert feed(room, midway, t) == ([], [])
+        t += 1
+    left = []
+    while not left:
+        _, left = feed(room, -90, t)
+        t += 1
+    assert left == [(0, 1)]
+
+
+def test_samples_in_one_tick_are_averaged_per_pair():
+    room = server.RssiRoom()
+    room.add("p1", ["p2", "p2"], [-60, -70])
+    room.add("p2", ["p1"], [-65])
+    room.process(0)
+    assert np.isclose(room.estimate[0, 1], -65)
+    assert np.isnan(room.estimate[1, 0])
+
+
+def test_stale_pair_leaves_and_resets():
+    room = server.RssiRoom()
+    for t in range(3):
+        feed(room, -50, t)
+    assert room.near[0, 1]
+    _, left = room.process(2 + server.RSSI_STALE_SECONDS + 1)
+    assert left == [(0, 1)]
+    assert np.isnan(room.estimate[0, 1]) and not room.near[0, 1]
+
+
+def test_growing_the_room_keeps_buffered_pairs():
+    room = server.RssiRoom(capacity=3)
+    room.add("p1", ["p3"], [-60])
+    room.add("p2", ["p3"], [-70])
+    # A fourth player forces the matrices to grow before the tick
+    room.add("p4", ["p1"], [-80])
+    room.process(0)
+    assert room.capacity == 6
+    assert np.isclose(room.estimate[0, 1], -60)
+    assert np.isclose(room.estimate[1, 2], -70)
+    assert np.isclose(room.estimate[0, 3], -80)
+    assert np.count_nonzero(~np.isnan(room.estimate)) == 3
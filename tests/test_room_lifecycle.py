@@ -0,0 +1,87 @@
+"""Idle room eviction and archiving clear every per-room map; archiving copies each room once"""
+
+import time
+
+import pytest
+
+import server
+
+from .conftest import connect_sid
+
+pytestmark = pytest.mark.anyio
+
+PER_ROOM = ("active_games", "round_trackers", "room_activity", "rssi_rooms", "movement_rooms",
+            "trace_buffers", "bot_rooms", "spectator_sids", "spectator_events", "spectator_sends")
+
+
+async def populate(code, idle_for):
+    server.active_games[code] = {"code": code, "players": []}
+    server.start_round_tracker(code, [], mraz_id="a" * 24)
+    server.room_activity[code] = time.time() - idle_for
+    server.rssi_rooms[code] = server.RssiRoom()
+    server.movement_rooms[code] = server.MovementRoom()
+    bot_room = server.bot_rooms[code] = server.BotRoom(code, autoplay=False, anchored=True)
+    bot_id = str(server.ObjectId())
+    bot_room.add([bot_id])
+    server.bot_players[bot_id] = code
+    spectator = await connect_sid()
+    await server.add_spectator(spectator, code)
+    server.spectator_event(code, "round_over", {})
+    server.spectator_sends[code] = None
+    await server.room_reads.do(code, lambda: server.db.rooms.find_one({"code": code}))
+    return spectator
+
+
+async def test_eviction_clears_all_room_state():
+    spectator = await populate("IDLE01", idle_for=server.ROOM_IDLE_EVICT_SECONDS + 1)
+    await populate("BUSY01", idle_for=server.ROOM_IDLE_EVICT_SECONDS + 1)
+    server.add_room_sid("BUSY01", await connect_sid())
+
+    assert await server.evict_idle_rooms() == 1
+    for name in PER_ROOM:
+        assert "IDLE01" not in getattr(server, name), name
+        assert "BUSY01" in getattr(server, name), name
+    assert list(server.bot_players.values()) == ["BUSY01"]
+    assert spectator not in server.sid_spectating
+    assert "IDLE01" not in server.room_reads.cache
+    assert not list(server.sio.manager.get_participants("/", server.spectator_room("IDLE01")))
+
+
+async def test_archiving_clears_room_state():
+    await populate("DONE01", idle_for=0)
+    server.room_activity.pop("DONE01")
+    await server.db.rooms.insert_one({
+        "code": "DONE01", "status": "finished", "players": [],
+        "finished_at": server.datetime.utcnow() - server.timedelta(seconds=server.ROOM_ARCHIVE_AFTER_SECONDS + 1),
+    })
+    assert await server.archive_rooms() == 1
+    for name in PER_ROOM:
+        assert "DONE01" not in getattr(server, name), name
+
+
+async def finished_room(code):
+    await server.db.rooms.insert_one({
+        "code": code, "status": "finished", "players": [],
+        "finished_at": server.datetime.utcnow() - server.timedelta(seconds=server.ROOM_ARCHIVE_AFTER_SECONDS + 1),
+    })
+
+
+async def test_archiving_twice_keeps_one_history_row(monkeypatch):
+    await finished_room("DONE01")
+    await finished_room("DONE02")
+    # A crash between the copy and the delete, like a second sweeper that
+    # copied the same rooms: the next sweep copies them again
+    delete_many = server.db.rooms.delete_many
+
+    async def crash(query, **kwargs):
+        raise RuntimeError("connection lost")
+
+    monkeypatch.setattr(server.db.rooms, "delete_many", crash)
+    with pytest.raises(RuntimeError):
+        await server.archive_rooms()
+    monkeypatch.setattr(server.db.rooms, "delete_many", delete_many)
+    assert await server.archive_rooms() == 2
+
+    history = await server.db.room_history.find({}).to_list(None)
+    assert sorted(row["code"] for row in history) == ["DONE01", "DONE02"]
+    assert await server.db.rooms.count_documents({}) == 0
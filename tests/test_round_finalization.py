@@ -0,0 +1,96 @@
+"""Batched round finalization: failed writes are retried, not lost"""
+
+import pytest
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+import server
+
+from .conftest import create_user
+
+pytestmark = pytest.mark.anyio
+
+
+def queue_round(user_id, room_code="ROOM01"):
+    server.pending_round_rows.append({
+        "user_id": user_id, "play_time": 60, "survival": 30, "freezes": 0, "unfreezes": 0,
+        "won": False, "room_code": room_code, "username": "ana",
+    })
+
+
+def failing(error):
+    async def bulk_write(requests, ordered=True, **kwargs):
+        raise error
+    return bulk_write
+
+
+async def xp(user_id):
+    return (await server.db.users.find_one({"_id": server.ObjectId(user_id)}))["stats"]["xp"]
+
+
+async def test_user_write_failure_requeues_rows(monkeypatch):
+    user_id = await create_user("ana")
+    queue_round(user_id)
+    with monkeypatch.context() as m:
+        m.setattr(server.stats_db.users, "bulk_write", failing(ConnectionError("primary stepped down")))
+        await server.flush_round_results()
+    assert [row["attempts"] for row in server.pending_round_rows] == [1]
+    assert await xp(user_id) == 0
+
+    await server.flush_round_results()
+    assert server.pending_round_rows == []
+    assert await xp(user_id) == server.XP_PER_ROUND + 30 * server.XP_PER_SURVIVAL_SECOND
+    bucket = await server.db.leaderboard_buckets.find_one({"period": "day", "user_id": user_id})
+    assert bucket["rounds"] == 1
+
+
+async def test_partial_bulk_failure_requeues_only_failed_users(monkeypatch):
+    ana, ben = sorted([await create_user("ana"), await create_user("ben")])
+    queue_round(ana)
+    queue_round(ben)
+    real = server.stats_db.users.bulk_write
+
+    async def second_fails(requests, ordered=True, **kwargs):
+        await real(requests[:1], ordered=ordered)
+        raise BulkWriteError({"writeErrors": [{"index": 1, "code": 91, "errmsg": "shutdown"}]})
+
+    monkeypatch.setattr(server.stats_db.users, "bulk_write", second_fails)
+    await server.flush_round_results()
+    assert [row["user_id"] for row in server.pending_round_rows] == [ben]
+    assert await xp(ana) > 0 and await xp(ben) == 0
+
+
+async def test_rows_are_dropped_after_max_attempts(monkeypatch):
+    monkeypatch.setattr(server, "ROUND_FLUSH_MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(server.stats_db.users, "bulk_write", failing(ConnectionError("down")))
+    queue_round(await create_user("ana"))
+    await server.flush_round_results()
+    assert len(server.pending_round_rows) == 1
+    await server.flush_round_results()
+    assert server.pending_round_rows == []
+
+
+async def test_room_update_failure_requeues_unless_superseded(monkeypatch):
+    await server.db.rooms.insert_many([
+        {"code": "ROOM01", "round_number": 1, "status": "playing"},
+        {"code": "ROOM02", "round_number": 1, "status": "playing"},
+    ])
+    for code in ("ROOM01", "ROOM02"):
+        server.pending_room_updates[code] = UpdateOne(
+            {"code": code, "round_number": 1}, {"$set": {"status": "finished"}})
+    newer = UpdateOne({"code": "ROOM02", "round_number": 2}, {"$set": {"status": "finished", "round": 2}})
+
+    async def fails_while_room02_finishes_again(requests, ordered=True, **kwargs):
+        server.pending_room_updates["ROOM02"] = newer
+        raise ConnectionError("down")
+
+    with monkeypatch.context() as m:
+        m.setattr(server.db.rooms, "bulk_write", fails_while_room02_finishes_again)
+        await server.flush_round_results()
+    # ROOM01 is retried; ROOM02's newer update wins over the failed one
+    assert server.pending_room_updates["ROOM02"] is newer
+    assert server.room_update_attempts == {"ROOM01": 1}
+
+    await server.flush_round_results()
+    assert server.pending_room_updates == {} and server.room_update_attempts == {}
+    assert (await server.db.rooms.find_one({"code": "ROOM01"}))["status"] == "finished"
@@ -0,0 +1,92 @@
+"""Single-flight coalescing of concurrent reads"""
+
+import asyncio
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_concurrent_calls_share_one_fetch():
+    reads = server.SingleFlight(ttl=60)
+    started = asyncio.Event()
+    release = asyncio.Event()
+    fetches = 0
+
+    async def fetch():
+        nonlocal fetches
+        fetches += 1
+        started.set()
+        await release.wait()
+        return {"code": "ROOM01"}
+
+    first = asyncio.create_task(reads.do("ROOM01", fetch))
+    await started.wait()
+    others = [asyncio.create_task(reads.do("ROOM01", fetch)) for _ in range(10)]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(first, *others)
+    assert fetches == 1 and all(r is results[0] for r in results)
+    # Served from the cache until the TTL runs out
+    assert await reads.do("ROOM01", fetch) is results[0]
+    assert (reads.calls, reads.shared) == (1, 11)
+
+
+async def test_errors_reach_every_waiter_and_are_not_cached():
+    reads = server.SingleFlight(ttl=60)
+    release = asyncio.Event()
+
+    async def failing():
+        await release.wait()
+        raise RuntimeError("db down")
+
+    tasks = [asyncio.create_task(reads.do("k", failing)) for _ in range(3)]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+    async def ok():
+        return 1
+    assert await reads.do("k", ok) == 1
+
+
+async def test_forget_during_fetch_skips_the_cache():
+    reads = server.SingleFlight(ttl=60)
+    values = iter([1, 2])
+
+    async def fetch():
+        value = next(values)
+        reads.forget("k")  # a write landed while the read was in flight
+        return value
+
+    assert await reads.do("k", fetch) == 1
+    assert await reads.do("k", fetch) == 2
+
+
+async def test_cache_is_bounded_and_skips_misses(monkeypatch):
+    reads = server.SingleFlight(ttl=60, max_entries=3)
+
+    async def missing():
+        return None
+
+    for i in range(100):
+        assert await reads.do(f"NOPE{i:02d}", missing) is None
+    assert len(reads.cache) == 0
+
+    for i in range(10):
+        await reads.do(i, lambda: asyncio.sleep(0, result=i))
+    assert list(reads.cache) == [7, 8, 9]
+
+
+async def test_expired_entries_are_swept_on_insert(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(server.time, "monotonic", lambda: clock[0])
+    reads = server.SingleFlight(ttl=1, max_entries=1000)
+    for i in range(50):
+        await reads.do(f"old{i}", lambda: asyncio.sleep(0, result=i))
+    clock[0] += 2
+    await reads.do("new", lambda: asyncio.sleep(0, result=1))
+    assert list(reads.cache) == ["new"]
@@ -0,0 +1,48 @@
+"""Spectating needs a token, and private rooms only admit their own players"""
+
+import pytest
+
+import server
+
+from .conftest import connect_sid
+
+pytestmark = pytest.mark.anyio
+
+PLAYER, OUTSIDER = "a" * 24, "b" * 24
+
+
+@pytest.fixture
+async def rooms():
+    await server.db.rooms.insert_many([
+        {"code": "PRIV01", "is_private": True, "status": "playing", "players": [{"id": PLAYER}]},
+        {"code": "OPEN01", "is_private": False, "status": "playing", "players": [{"id": PLAYER}]},
+    ])
+
+
+async def spectate(room_code, token):
+    sid = await connect_sid()
+    await server.sio._trigger_event("spectate", "/", sid, {"room_code": room_code, "token": token})
+    return sid
+
+
+def replies(emitted, sid):
+    return [(event, data.get("message")) for event, data, to in emitted if to == sid]
+
+
+async def test_spectating_requires_a_token(rooms, emitted):
+    sid = await spectate("OPEN01", "not.a.token")
+    assert replies(emitted, sid) == [("spectate_rejected", "Neautorizovan pristup")]
+    sid = await connect_sid()
+    await server.sio._trigger_event("spectate", "/", sid, {"room_code": "OPEN01"})
+    assert server.sid_spectating == {}
+
+
+async def test_private_rooms_admit_only_their_players(rooms, emitted):
+    outsider = await spectate("PRIV01", server.create_token(OUTSIDER))
+    assert replies(emitted, outsider) == [("spectate_rejected", "Soba je privatna")]
+    player = await spectate("PRIV01", server.create_token(PLAYER))
+    public = await spectate("OPEN01", server.create_token(OUTSIDER))
+    missing = await spectate("NOPE00", server.create_token(OUTSIDER))
+    assert replies(emitted, missing) == [("spectate_rejected", "Soba nije pronadjena")]
+    assert server.sid_spectating == {player: "PRIV01", public: "OPEN01"}
+    assert server.spectator_sids["PRIV01"] == {player}
@@ -0,0 +1,89 @@
+"""The in-memory storage engine behind STORAGE_ENGINE=memory"""
+
+import pytest
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from storage import MemoryClient
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def collection():
+    return MemoryClient()["test"]["docs"]
+
+
+async def test_query_operators(collection):
+    await collection.insert_many([
+        {"name": "a", "n": 1, "tags": ["x", "y"], "players": [{"id": "p1"}]},
+        {"name": "b", "n": 5, "tags": ["y"], "players": []},
+        {"name": "c", "n": 9},
+    ])
+
+    async def names(query):
+        return sorted(d["name"] for d in await collection.find(query).to_list(None))
+
+    assert await names({"n": {"$gt": 1, "$lte": 9}}) == ["b", "c"]
+    assert await names({"tags": "y"}) == ["a", "b"]
+    assert await names({"tags": {"$size": 1}}) == ["b"]
+    assert await names({"players.id": "p1"}) == ["a"]
+    assert await names({"tags": {"$exists": False}}) == ["c"]
+    assert await names({"$or": [{"n": 1}, {"name": "c"}]}) == ["a", "c"]
+    assert await names({"name": {"$nin": ["a", "b"]}}) == ["c"]
+
+
+async def test_update_operators_and_upsert(collection):
+    await collection.insert_one({"_id": 1, "stats": {"xp": 10, "level": 2}, "list": []})
+    await collection.update_one({"_id": 1}, {
+        "$inc": {"stats.xp": 5}, "$max": {"stats.level": 1}, "$push": {"list": {"$each": [1, 2, 3], "$slice": -2}}
+    })
+    assert await collection.find_one({"_id": 1}) == {"_id": 1, "stats": {"xp": 15, "level": 2}, "list": [2, 3]}
+
+    result = await collection.update_one({"key": "k"}, {"$setOnInsert": {"v": 1}, "$inc": {"n": 1}}, upsert=True)
+    assert result.upserted_id is not None
+    await collection.update_one({"key": "k"}, {"$setOnInsert": {"v": 2}, "$inc": {"n": 1}}, upsert=True)
+    assert await collection.find_one({"key": "k"}, {"_id": 0}) == {"key": "k", "v": 1, "n": 2}
+
+
+async def test_unique_index_and_bulk_write(collection):
+    await collection.create_index("code", unique=True)
+    await collection.insert_one({"code": "AAAAAA"})
+    with pytest.raises(DuplicateKeyError):
+        await collection.insert_one({"code": "AAAAAA"})
+
+    result = await collection.bulk_write([
+        UpdateOne({"code": "AAAAAA"}, {"$set": {"status": "finished"}}),
+        UpdateOne({"code": "BBBBBB"}, {"$set": {"status": "waiting"}}, upsert=True),
+    ], ordered=False)
+    assert (result.matched_count, result.upserted_count) == (1, 1)
+    assert await collection.count_documents({"status": {"$in": ["finished", "waiting"]}}) == 2
+
+
+async def test_partial_unique_index_skips_uncovered_documents(collection):
+    await collection.create_index("room_id", unique=True, partialFilterExpression={"room_id": {"$exists": True}})
+    await collection.insert_many([{"name": "old"}, {"name": "older"}, {"room_id": 1}])
+    with pytest.raises(DuplicateKeyError):
+        await collection.insert_one({"room_id": 1})
+    await collection.update_one({"room_id": 1}, {"$setOnInsert": {"name": "again"}}, upsert=True)
+    assert await collection.count_documents({}) == 3
+
+
+async def test_cursor_batches_and_projection(collection):
+    await collection.insert_many([{"_id": i, "n": i, "secret": "x"} for i in range(10)])
+    cursor = collection.find({}, {"secret": 0}).sort("n", -1).skip(1).limit(5)
+    first = await cursor.to_list(2)
+    rest = [doc async for doc in cursor]
+    assert [d["n"] for d in first + rest] == [8, 7, 6, 5, 4]
+    assert all("secret" not in d for d in first + rest)
+
+
+async def test_expr_queries(collection):
+    await collection.insert_many([
+        {"code": "A", "players": [1, 2], "max_players": 3},
+        {"code": "B", "players": [1, 2, 3], "max_players": 3},
+    ])
+    fits_one = {"$expr": {"$lte": [{"$add": [{"$size": "$players"}, 1]}, "$max_players"]}}
+    assert [d["code"] for d in await collection.find(fits_one).to_list(None)] == ["A"]
+    result = await collection.update_one({"code": "B", **fits_one}, {"$push": {"players": 4}})
+    assert result.matched_count == 0
@@ -0,0 +1,55 @@
+"""Delta-encoded per-round location traces"""
+
+from array import array
+
+import numpy as np
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.mark.parametrize("values, dtype", [
+    ([5], "<i1"),
+    ([100, 101, 99, 226], "<i1"),
+    ([4481250, 4481250 + 300, 4481250 - 30000], "<i2"),
+    ([0, 2 ** 40, -(2 ** 40)], "<i8"),
+])
+def test_encode_deltas_picks_narrowest_dtype(values, dtype):
+    first, chosen, data = server.encode_deltas(array('q', values))
+    assert (first, chosen) == (values[0], dtype)
+    assert len(data) == (len(values) - 1) * np.dtype(dtype).itemsize
+
+
+def test_trace_round_trip_within_quantisation():
+    rng = np.random.default_rng(7)
+    buffer = server.TraceBuffer(started_at=1000.0)
+    lat = 44.8125 + np.cumsum(rng.normal(0, 2e-5, 500))
+    lon = 20.4612 + np.cumsum(rng.normal(0, 2e-5, 500))
+    at = 1000.0 + np.cumsum(rng.uniform(0.05, 2.0, 500))
+    for y, x, t in zip(lat, lon, at):
+        buffer.add("p1", float(y), float(x), float(t))
+
+    doc = server.encode_trace("ROOM01", 3, buffer.started_at, "p1", buffer.points["p1"])
+    assert doc["points"] == 500 and doc["lat"]["dtype"] == "<i1"
+    decoded = server.decode_trace(doc)
+    assert np.abs(decoded["latitude"] - lat).max() <= 0.5 / server.TRACE_SCALE
+    assert np.abs(decoded["longitude"] - lon).max() <= 0.5 / server.TRACE_SCALE
+    assert np.abs(decoded["t"] - (at - 1000.0)).max() <= 0.0005
+
+
+def test_decode_rejects_unknown_encoding():
+    with pytest.raises(ValueError):
+        server.decode_trace({"encoding": "raw"})
+
+
+async def test_finished_round_traces_are_flushed():
+    server.start_trace("ROOM01")
+    for i in range(3):
+        server.record_trace("ROOM01", "p1", 44.8 + i * 1e-4, 20.4)
+    server.finish_trace("ROOM01", round_number=1)
+    assert "ROOM01" not in server.trace_buffers
+    await server.flush_traces()
+    doc = await server.db.location_traces.find_one({"room_code": "ROOM01", "player_id": "p1"})
+    assert server.decode_trace(doc)["latitude"].round(4).tolist() == [44.8, 44.8001, 44.8002]